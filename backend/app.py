@@ -33,6 +33,8 @@ def create_app():
     app.url_map.strict_slashes = False
     CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret')
+    # Nivel de las trazas de auth por request (INFO por defecto; DEBUG para silenciarlas en producción)
+    app.config['AUTH_LOG_LEVEL'] = os.environ.get('AUTH_LOG_LEVEL', 'INFO').upper()
 
     # Conexiones a Supabase
     SUPABASE_URL = os.environ.get('SUPABASE_URL')
@@ -48,11 +50,61 @@ def create_app():
         except Exception as e:
             print(f"⚠️ Error cliente Proyectos: {e}")
 
+    # Pool compartido para consultas concurrentes dentro de un request
+    try:
+        from .utils.query_batch import init_query_pool
+    except ImportError:
+        from utils.query_batch import init_query_pool
+    init_query_pool(app)
+
+    # Sesión HTTP saliente compartida (keep-alive y reintentos hacia el Storage)
+    try:
+        from .utils.http import init_http, estado_http
+    except ImportError:
+        from utils.http import init_http, estado_http
+    init_http(app)
+
+    try:
+        from .utils.eventos import estado_eventos
+    except ImportError:
+        from utils.eventos import estado_eventos
+
+    # Cola de escritura de puntos GPS (journal local + hilo de vaciado)
+    try:
+        from .utils.gps_cola import init_cola_gps, estado_cola
+    except ImportError:
+        from utils.gps_cola import init_cola_gps, estado_cola
+    init_cola_gps(app)
+
+    # Las métricas por worker exponen pid y errores internos: requieren sesión
+    try:
+        from .utils.auth import auth_required
+    except ImportError:
+        from utils.auth import auth_required
+
     # --- 3. RUTA HEALTH CHECK ---
     @app.route('/api/health', methods=['GET'])
     def health():
         return jsonify({"status": "ok", "message": "API Online"})
 
+    @app.route('/api/health/gps', methods=['GET'])
+    @auth_required
+    def health_gps():
+        # Métricas del worker que atiende el request (cada proceso tiene su propia cola)
+        return jsonify(estado_cola())
+
+    @app.route('/api/health/http', methods=['GET'])
+    @auth_required
+    def health_http():
+        # Uso del pool de conexiones salientes del worker que atiende el request
+        return jsonify(estado_http())
+
+    @app.route('/api/health/eventos', methods=['GET'])
+    @auth_required
+    def health_eventos():
+        # Clientes SSE conectados al worker que atiende el request
+        return jsonify(estado_eventos())
+
     # --- 4. REGISTRO DE BLUEPRINTS ---
     try:
         # Importaciones relativas consistentes para todos los módulos
@@ -0,0 +1,16 @@
+-- Resumen materializado por vehículo (odómetro, última mantención, recorrido).
+-- Lo mantiene backend/utils/vehiculo_estado.py desde los endpoints de escritura
+-- (órdenes y mantenimientos). Las filas faltantes se calculan y guardan de forma
+-- perezosa en la primera lectura, por lo que no requiere backfill.
+
+create table if not exists public.flota_vehiculos_resumen (
+    vehiculo_id       bigint primary key references public.flota_vehiculos(id) on delete cascade,
+    km_max_ordenes    integer not null default 0,
+    km_max_mant       integer not null default 0,
+    km_actual         integer not null default 0,
+    km_ultima_mant    integer not null default 0,
+    fecha_ultima_mant date,
+    km_recorridos     integer not null default 0,
+    total_viajes      integer not null default 0,
+    actualizado_en    timestamptz not null default now()
+);
@@ -0,0 +1,67 @@
+-- Agregaciones de reportes calculadas en la base (llamadas vía supabase.rpc).
+-- Usadas por backend/modules/reportes.py y backend/modules/reportes_mant.py;
+-- si no existen, los endpoints recalculan en Python (ver backend/utils/rpc.py).
+
+-- Costo total de mantenimientos programados desde p_desde (reportes/costo_mantenimiento_mensual)
+create or replace function public.flota_costo_mantenimiento(p_desde date)
+returns numeric
+language sql
+stable
+as $$
+    select coalesce(sum(m.costo), 0)
+    from public.flota_mantenimientos m
+    where m.deleted_at is null
+      and m.fecha_programada >= p_desde;
+$$;
+
+-- Gasto histórico del período para reportes_mant/dashboard.
+-- El costo de una mantención es la suma de sus detalles o, si no tiene, el costo de cabecera.
+create or replace function public.flota_dashboard_mant_periodo(p_fecha_ini date, p_fecha_fin date)
+returns jsonb
+language sql
+stable
+as $$
+    with mant as (
+        select m.id, m.costo, coalesce(v.placa, 'S/P') as placa
+        from public.flota_mantenimientos m
+        left join public.flota_vehiculos v on v.id = m.vehiculo_id
+        where m.deleted_at is null
+          and m.fecha_programada between p_fecha_ini and p_fecha_fin
+    ),
+    det as (
+        select d.mantenimiento_id,
+               coalesce(d.costo, 0) as costo,
+               coalesce(cat.nombre, 'General') as categoria
+        from public.mantenimiento_detalles d
+        join mant on mant.id = d.mantenimiento_id
+        left join public.conceptos_gasto c on c.id = d.concepto_id
+        left join public.categorias_mantencion cat on cat.id = c.categoria_id
+    ),
+    costo_mant as (
+        select mant.id, mant.placa,
+               coalesce((select sum(det.costo) from det where det.mantenimiento_id = mant.id),
+                        coalesce(mant.costo, 0)) as costo
+        from mant
+    ),
+    por_categoria as (
+        select categoria as name, sum(costo) as value from det group by categoria
+        union all
+        select 'General', coalesce(mant.costo, 0)
+        from mant
+        where not exists (select 1 from det where det.mantenimiento_id = mant.id)
+    ),
+    por_categoria_total as (
+        select name, sum(value) as value from por_categoria group by name
+    ),
+    por_vehiculo as (
+        select placa as name, sum(costo) as value from costo_mant group by placa
+    )
+    select jsonb_build_object(
+        'total_gasto_periodo', (select coalesce(sum(costo), 0) from costo_mant),
+        'total_items_periodo', (select count(*) from mant),
+        'por_categoria', coalesce((select jsonb_agg(jsonb_build_object('name', name, 'value', value) order by value desc)
+                                   from por_categoria_total), '[]'::jsonb),
+        'por_vehiculo', coalesce((select jsonb_agg(jsonb_build_object('name', name, 'value', value) order by value desc)
+                                  from (select * from por_vehiculo order by value desc limit 10) top), '[]'::jsonb)
+    );
+$$;
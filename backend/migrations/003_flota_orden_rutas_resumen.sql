@@ -0,0 +1,61 @@
+-- Resumen de ruta GPS por orden (primer punto, último punto y cantidad).
+-- Lo mantiene backend/utils/rutas.py en cada ingesta (POST /api/ordenes/<id>/ruta).
+-- Las órdenes sin fila se calculan con flota_rutas_resumen en la primera lectura
+-- y se guardan, por lo que no requiere backfill.
+
+create table if not exists public.flota_orden_rutas_resumen (
+    orden_id          bigint primary key references public.flota_ordenes(id) on delete cascade,
+    total_puntos      integer not null default 0,
+    inicio_latitud    double precision,
+    inicio_longitud   double precision,
+    inicio_timestamp  timestamptz,
+    fin_latitud       double precision,
+    fin_longitud      double precision,
+    fin_timestamp     timestamptz,
+    actualizado_en    timestamptz not null default now()
+);
+
+-- Lecturas de puntos por orden en orden cronológico (ruta completa y extremos)
+create index if not exists flota_orden_rutas_orden_ts_idx
+    on public.flota_orden_rutas (orden_id, "timestamp");
+
+-- Resumen de varias órdenes en una sola llamada
+create or replace function public.flota_rutas_resumen(p_orden_ids bigint[])
+returns table (
+    orden_id          bigint,
+    total_puntos      integer,
+    inicio_latitud    double precision,
+    inicio_longitud   double precision,
+    inicio_timestamp  timestamptz,
+    fin_latitud       double precision,
+    fin_longitud      double precision,
+    fin_timestamp     timestamptz
+)
+language sql
+stable
+as $$
+    with conteo as (
+        select r.orden_id, count(*)::integer as total_puntos
+        from public.flota_orden_rutas r
+        where r.orden_id = any(p_orden_ids)
+        group by r.orden_id
+    ),
+    inicio as (
+        select distinct on (r.orden_id) r.orden_id, r.latitud, r.longitud, r."timestamp"
+        from public.flota_orden_rutas r
+        where r.orden_id = any(p_orden_ids) and r."timestamp" is not null
+        order by r.orden_id, r."timestamp" asc
+    ),
+    fin as (
+        select distinct on (r.orden_id) r.orden_id, r.latitud, r.longitud, r."timestamp"
+        from public.flota_orden_rutas r
+        where r.orden_id = any(p_orden_ids) and r."timestamp" is not null
+        order by r.orden_id, r."timestamp" desc
+    )
+    select c.orden_id, c.total_puntos,
+           i.latitud::double precision, i.longitud::double precision, i."timestamp"::timestamptz,
+           f.latitud::double precision, f.longitud::double precision, f."timestamp"::timestamptz
+    from conteo c
+    left join inicio i on i.orden_id = c.orden_id
+    left join fin f on f.orden_id = c.orden_id;
+$$;
@@ -0,0 +1,14 @@
+-- Niveles de detalle precalculados de la ruta GPS de cada orden (100/500/2000 puntos).
+-- Los genera backend/utils/rutas.py en segundo plano al finalizar el viaje y los
+-- sirve GET /api/ordenes/<id>/ruta según max_points. Un nivel cuyo
+-- total_puntos_origen no coincide con flota_orden_rutas_resumen.total_puntos
+-- se considera obsoleto y se regenera.
+
+create table if not exists public.flota_orden_rutas_niveles (
+    orden_id             bigint not null references public.flota_ordenes(id) on delete cascade,
+    nivel                integer not null,
+    puntos               jsonb not null,
+    total_puntos_origen  integer not null,
+    generado_en          timestamptz not null default now(),
+    primary key (orden_id, nivel)
+);
@@ -0,0 +1,24 @@
+-- Ingesta GPS idempotente (POST /api/ordenes/<id>/ruta, backend/utils/gps_ingesta.py).
+
+-- 1. Un punto por (orden, timestamp): los reintentos de la app no duplican puntos.
+--    Se eliminan primero los duplicados existentes (se conserva una fila por par).
+delete from public.flota_orden_rutas a
+using public.flota_orden_rutas b
+where a.orden_id = b.orden_id
+  and a."timestamp" = b."timestamp"
+  and a.ctid > b.ctid;
+
+create unique index if not exists flota_orden_rutas_orden_ts_uidx
+    on public.flota_orden_rutas (orden_id, "timestamp");
+
+-- El índice único cubre las lecturas por (orden_id, timestamp) de la migración 003
+drop index if exists public.flota_orden_rutas_orden_ts_idx;
+
+-- 2. Respuestas de ingestas con Idempotency-Key (un reintento recibe la respuesta original)
+create table if not exists public.flota_orden_rutas_ingestas (
+    orden_id         bigint not null references public.flota_ordenes(id) on delete cascade,
+    idempotency_key  text not null,
+    resultado        jsonb not null,
+    creado_en        timestamptz not null default now(),
+    primary key (orden_id, idempotency_key)
+);
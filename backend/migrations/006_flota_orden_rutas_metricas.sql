@@ -0,0 +1,14 @@
+-- Métricas de viaje calculadas desde la traza GPS de cada orden (distancia,
+-- tiempo en movimiento/detenido, velocidad máxima y promedio, paradas).
+-- Las calcula backend/utils/rutas.py en segundo plano junto con los niveles de
+-- detalle (al finalizar el viaje o al listar rutas sin métricas) y las sirven
+-- GET /api/ordenes/<id>/ruta y GET /api/ordenes/vehiculo/<id>/rutas. Una fila cuyo
+-- total_puntos_origen no coincide con flota_orden_rutas_resumen.total_puntos
+-- se considera obsoleta y se recalcula.
+
+create table if not exists public.flota_orden_rutas_metricas (
+    orden_id             bigint primary key references public.flota_ordenes(id) on delete cascade,
+    metricas             jsonb not null,
+    total_puntos_origen  integer not null,
+    calculado_en         timestamptz not null default now()
+);
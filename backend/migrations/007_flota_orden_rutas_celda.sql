@@ -0,0 +1,23 @@
+-- Consultas de puntos GPS de toda la flota por ventana de tiempo y área
+-- (GET /api/ordenes/rutas, backend/utils/rutas.py:consultar_puntos).
+--
+-- `celda` identifica la celda de 0,01° (~1,1 km) de una grilla fija; el backend
+-- traduce un rectángulo a rangos de celdas (utils/geo.rangos_celdas), así que la
+-- fórmula debe coincidir con utils/geo.celda_de. Es una columna generada: la
+-- ingesta no cambia y los puntos existentes se calculan al aplicar la migración
+-- (reescribe la tabla; aplicar en un momento de poco tráfico).
+
+alter table public.flota_orden_rutas
+    add column if not exists celda integer
+    generated always as (
+        floor((latitud::double precision + 90) * 100)::integer * 36000
+        + least(floor((longitud::double precision + 180) * 100), 35999)::integer
+    ) stored;
+
+-- Área + tiempo: rango de celdas y luego ventana de tiempo dentro de cada celda
+create index if not exists flota_orden_rutas_celda_ts_idx
+    on public.flota_orden_rutas (celda, "timestamp");
+
+-- Solo tiempo ("dónde estaban los vehículos entre las 14:00 y las 15:00")
+create index if not exists flota_orden_rutas_ts_idx
+    on public.flota_orden_rutas ("timestamp");
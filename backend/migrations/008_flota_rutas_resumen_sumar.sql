@@ -0,0 +1,75 @@
+-- Suma atómica de un lote de puntos GPS al resumen de ruta de la orden (migración 003).
+-- La llama backend/utils/rutas.registrar_puntos en cada ingesta y en cada bloque
+-- que escribe la cola GPS. La suma y los extremos se resuelven en un UPDATE, que
+-- bloquea la fila: ingestas concurrentes de varios workers no pierden puntos ni
+-- retroceden el fin de la ruta.
+--
+-- p_lote: resumen de las filas recién insertadas ({total_puntos, inicio_*, fin_*}).
+-- Sin fila de resumen (primera ingesta o ruta previa a la tabla) o con p_lote null,
+-- el resumen se recalcula completo desde flota_orden_rutas (ya incluye el lote).
+-- Retorna el total de puntos resultante.
+
+create or replace function public.flota_rutas_resumen_sumar(p_orden_id bigint, p_lote jsonb default null)
+returns integer
+language plpgsql
+as $$
+declare
+    l record;
+    v_total integer;
+begin
+    if p_lote is not null then
+        select * into l from jsonb_to_record(p_lote) as x(
+            total_puntos      integer,
+            inicio_latitud    double precision,
+            inicio_longitud   double precision,
+            inicio_timestamp  timestamptz,
+            fin_latitud       double precision,
+            fin_longitud      double precision,
+            fin_timestamp     timestamptz
+        );
+
+        -- Las expresiones del SET ven la fila anterior: cada extremo se compara contra el guardado
+        update public.flota_orden_rutas_resumen t set
+            total_puntos     = t.total_puntos + coalesce(l.total_puntos, 0),
+            inicio_latitud   = case when l.inicio_timestamp < t.inicio_timestamp or t.inicio_timestamp is null
+                                    then coalesce(l.inicio_latitud, t.inicio_latitud) else t.inicio_latitud end,
+            inicio_longitud  = case when l.inicio_timestamp < t.inicio_timestamp or t.inicio_timestamp is null
+                                    then coalesce(l.inicio_longitud, t.inicio_longitud) else t.inicio_longitud end,
+            inicio_timestamp = least(t.inicio_timestamp, l.inicio_timestamp),
+            fin_latitud      = case when l.fin_timestamp >= t.fin_timestamp or t.fin_timestamp is null
+                                    then coalesce(l.fin_latitud, t.fin_latitud) else t.fin_latitud end,
+            fin_longitud     = case when l.fin_timestamp >= t.fin_timestamp or t.fin_timestamp is null
+                                    then coalesce(l.fin_longitud, t.fin_longitud) else t.fin_longitud end,
+            fin_timestamp    = greatest(t.fin_timestamp, l.fin_timestamp),
+            actualizado_en   = now()
+        where t.orden_id = p_orden_id
+        returning t.total_puntos into v_total;
+
+        if found then
+            return v_total;
+        end if;
+    end if;
+
+    insert into public.flota_orden_rutas_resumen as t (
+        orden_id, total_puntos,
+        inicio_latitud, inicio_longitud, inicio_timestamp,
+        fin_latitud, fin_longitud, fin_timestamp, actualizado_en
+    )
+    select r.orden_id, r.total_puntos,
+           r.inicio_latitud, r.inicio_longitud, r.inicio_timestamp,
+           r.fin_latitud, r.fin_longitud, r.fin_timestamp, now()
+    from public.flota_rutas_resumen(array[p_orden_id]) r
+    on conflict (orden_id) do update set
+        total_puntos     = excluded.total_puntos,
+        inicio_latitud   = excluded.inicio_latitud,
+        inicio_longitud  = excluded.inicio_longitud,
+        inicio_timestamp = excluded.inicio_timestamp,
+        fin_latitud      = excluded.fin_latitud,
+        fin_longitud     = excluded.fin_longitud,
+        fin_timestamp    = excluded.fin_timestamp,
+        actualizado_en   = now()
+    returning t.total_puntos into v_total;
+
+    return coalesce(v_total, 0);
+end;
+$$;
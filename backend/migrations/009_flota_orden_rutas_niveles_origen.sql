@@ -0,0 +1,9 @@
+-- Último timestamp de los puntos con que se generó cada nivel de detalle (migración 004).
+-- backend/utils/rutas.py considera un nivel al día si fin_timestamp_origen alcanza
+-- el fin_timestamp de flota_orden_rutas_resumen, en lugar de exigir que
+-- total_puntos_origen coincida exactamente con total_puntos: un total desfasado
+-- ya no deja el nivel obsoleto para siempre. Las filas existentes (sin el valor)
+-- siguen comparándose por total hasta su próxima reconstrucción.
+
+alter table public.flota_orden_rutas_niveles
+    add column if not exists fin_timestamp_origen timestamptz;
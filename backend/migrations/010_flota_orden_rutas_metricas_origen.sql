@@ -0,0 +1,7 @@
+-- Último timestamp de los puntos con que se calcularon las métricas de viaje (migración 006).
+-- Igual que en los niveles de detalle (migración 009), backend/utils/rutas.py
+-- considera las métricas al día si fin_timestamp_origen alcanza el fin_timestamp
+-- de flota_orden_rutas_resumen.
+
+alter table public.flota_orden_rutas_metricas
+    add column if not exists fin_timestamp_origen timestamptz;
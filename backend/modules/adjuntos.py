@@ -1,11 +1,30 @@
 import os
-import requests
-from flask import Blueprint, request, jsonify, current_app, g, Response, stream_with_context
+from flask import Blueprint, request, jsonify, current_app, g, Response, stream_with_context, redirect
 from ..utils.auth import auth_required
+from ..utils.http import sesion_http
+from ..utils.storage import (
+    url_publica, url_firmada, agregar_urls_adjuntos, pide_firmas, bucket_privado, marcar_bucket_privado,
+    con_descarga, ruta_en_storage, BUCKET_ADJUNTOS,
+)
 from datetime import datetime
 
 bp = Blueprint('adjuntos', __name__)
 
+# Modo de /download: 'redirect' (302 a la URL del Storage), 'accel' (X-Accel-Redirect para
+# un nginx delante) o 'proxy' (los bytes pasan por Flask). ?modo= lo cambia por request.
+MODOS_DESCARGA = ('redirect', 'accel', 'proxy')
+DESCARGA_MODO = os.environ.get('DESCARGA_MODO', 'redirect').lower()
+if DESCARGA_MODO not in MODOS_DESCARGA:
+    DESCARGA_MODO = 'redirect'
+# Location interna de nginx que hace proxy_pass a <SUPABASE_URL>/storage/v1/
+DESCARGA_ACCEL_PREFIJO = os.environ.get('DESCARGA_ACCEL_PREFIJO', '/_storage/')
+DESCARGA_CHUNK_BYTES = int(os.environ.get('DESCARGA_CHUNK_BYTES', 256 * 1024))
+# Headers del cliente que el modo proxy reenvía al Storage (rangos y GET condicional)
+HEADERS_PETICION_DESCARGA = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+# Headers del Storage que se devuelven al cliente tal cual
+HEADERS_RESPUESTA_DESCARGA = ('Content-Type', 'Content-Length', 'Content-Range', 'Content-Encoding',
+                              'Accept-Ranges', 'ETag', 'Last-Modified', 'Cache-Control')
+
 @bp.route('/', methods=['GET'])
 @auth_required
 def search_adjuntos():
@@ -80,13 +99,6 @@ def search_adjuntos():
 
         for item in res_orden.data or []:
             placa = item.get('orden', {}).get('vehiculo', {}).get('placa') if item.get('orden') else None
-            # Add publicUrl for each adjunto
-            try:
-                sp = item.get('storage_path')
-                public = supabase.storage.from_('adjuntos_ordenes').get_public_url(sp) if sp else None
-                url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None) if public else None
-            except Exception:
-                url = None
             orden_adjuntos.append({
                 'id': item['id'],
                 'created_at': item['created_at'],
@@ -97,7 +109,6 @@ def search_adjuntos():
                 'entidad_id': item['orden_id'],
                 'tipo_entidad': 'Orden de Servicio'
             })
-            orden_adjuntos[-1]['publicUrl'] = url
             
     except Exception as e:
         current_app.logger.error(f"Error al buscar adjuntos de órdenes: {e}")
@@ -156,12 +167,6 @@ def search_adjuntos():
             res_mant = mant_query.order('created_at', desc=True).limit(50).execute()
 
         for item in res_mant.data or []:
-            try:
-                sp = item.get('storage_path')
-                public = supabase.storage.from_('adjuntos_ordenes').get_public_url(sp) if sp else None
-                url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None) if public else None
-            except Exception:
-                url = None
             placa = item.get('mantenimiento', {}).get('vehiculo', {}).get('placa') if item.get('mantenimiento') else None
             mant_adjuntos.append({
                 'id': item['id'],
@@ -173,7 +178,6 @@ def search_adjuntos():
                 'entidad_id': item['mantenimiento_id'],
                 'tipo_entidad': 'Mantenimiento'
             })
-            mant_adjuntos[-1]['publicUrl'] = url
             
     except Exception as e:
         current_app.logger.error(f"Error al buscar adjuntos de mantenimiento: {e}")
@@ -181,6 +185,8 @@ def search_adjuntos():
     # 3. Combinar y ordenar
     todos_adjuntos = orden_adjuntos + mant_adjuntos
     todos_adjuntos.sort(key=lambda x: x['created_at'], reverse=True)
+    # publicUrl (y signedUrl con ?signed=true) de todos los resultados en una pasada
+    agregar_urls_adjuntos(supabase, todos_adjuntos, pide_firmas(request.args))
 
     return jsonify({
         'status': 'success',
@@ -192,9 +198,19 @@ def search_adjuntos():
 @bp.route('/download', methods=['GET'])
 @auth_required
 def download_adjunto():
-    """Proxy para descargar un archivo de Supabase Storage y forzar Content-Disposition=attachment.
+    """Descarga un archivo de Supabase Storage forzando Content-Disposition=attachment.
 
-    Parámetros: ?path=<storage_path>&name=<filename_optional>
+    Parámetros: ?path=<storage_path>&name=<filename_optional>&modo=<redirect|accel|proxy>
+
+    - redirect (default, DESCARGA_MODO): 302 a una URL firmada (cacheada) con
+      `download=<name>`; el Storage entrega el archivo y Flask no toca los bytes.
+    - accel: X-Accel-Redirect a DESCARGA_ACCEL_PREFIJO + la misma URL relativa al
+      Storage, para un nginx con `location /_storage/ { internal; proxy_pass
+      <SUPABASE_URL>/storage/v1/; }`.
+    - proxy: los bytes pasan por Flask en bloques de DESCARGA_CHUNK_BYTES (para
+      clientes que necesitan la descarga en el mismo origen). Range, If-Range,
+      If-None-Match e If-Modified-Since se reenvían al Storage, que responde
+      206/304/416; ETag, Last-Modified y Content-Range vuelven al cliente.
     """
     supabase = current_app.config.get('SUPABASE')
     if not supabase:
@@ -202,58 +218,94 @@ def download_adjunto():
 
     storage_path = request.args.get('path')
     filename = request.args.get('name') or (os.path.basename(storage_path) if storage_path else 'file')
-    bucket = 'adjuntos_ordenes'
+    bucket = BUCKET_ADJUNTOS
+    modo = (request.args.get('modo') or DESCARGA_MODO).lower()
+    if modo not in MODOS_DESCARGA:
+        return jsonify({'message': f"modo debe ser uno de: {', '.join(MODOS_DESCARGA)}"}), 400
 
     if not storage_path:
         return jsonify({'message': 'Falta parámetro path'}), 400
 
     try:
-        # Intentar obtener una URL pública/signed desde Supabase
-        try:
-            public = supabase.storage.from_(bucket).get_public_url(storage_path)
-            url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None)
-        except Exception:
-            url = None
-
-        # Si no hay public url, intentar crear signed url (1 hora)
-        if not url:
-            try:
-                signed = supabase.storage.from_(bucket).create_signed_url(storage_path, 3600)
-                # signed puede devolver dict con 'signedURL' o 'data' según versión
-                url = (signed.get('signedURL') if isinstance(signed, dict) and signed.get('signedURL') else (signed.get('data', {}).get('signed_url') if isinstance(signed, dict) else None))
-            except Exception:
-                url = None
+        if modo in ('redirect', 'accel'):
+            # Firmada sirve para buckets públicos y privados; si no se puede firmar, la pública
+            url = url_firmada(supabase, storage_path, bucket) or url_publica(supabase, storage_path, bucket)
+            if not url:
+                return jsonify({'message': 'No se pudo obtener URL del archivo'}), 500
+            url = con_descarga(url, filename)
+            interna = ruta_en_storage(supabase, url) if modo == 'accel' else None
+            if interna:
+                response = Response(status=200)
+                response.headers['X-Accel-Redirect'] = DESCARGA_ACCEL_PREFIJO.rstrip('/') + '/' + interna
+                response.headers['Content-Disposition'] = _content_disposition(filename)
+                return response
+            response = redirect(url, code=302)
+            response.headers['Cache-Control'] = 'private, no-store'
+            return response
 
+        # Bucket público: URL armada localmente. Privado: URL firmada reutilizada desde caché
+        privado = bucket_privado(bucket)
+        url = url_firmada(supabase, storage_path, bucket) if privado else url_publica(supabase, storage_path, bucket)
         if not url:
             return jsonify({'message': 'No se pudo obtener URL del archivo'}), 500
 
-        # Solicitar el recurso y streamarlo al cliente con header de descarga
-        r = requests.get(url, stream=True, timeout=30)
-        if r.status_code != 200:
+        # identity: los rangos se calculan sobre el archivo original, no sobre una versión comprimida
+        peticion = {'Accept-Encoding': 'identity'}
+        for nombre in HEADERS_PETICION_DESCARGA:
+            if request.headers.get(nombre):
+                peticion[nombre] = request.headers[nombre]
+
+        # Solicitar el recurso (sesión compartida: conexiones reutilizadas) y streamarlo al cliente
+        http = sesion_http()
+        r = http.get(url, headers=peticion, stream=True, timeout=30)
+        if r.status_code in (400, 401, 403, 404) and not privado:
+            # La URL pública fue rechazada: el bucket es privado, se reintenta firmada
+            firmada = url_firmada(supabase, storage_path, bucket)
+            if firmada:
+                r.close()
+                r = http.get(firmada, headers=peticion, stream=True, timeout=30)
+                if r.status_code in (200, 206, 304):
+                    marcar_bucket_privado(bucket)
+        if r.status_code not in (200, 206, 304, 416):
+            r.close()
             return jsonify({'message': f'Error al descargar archivo (status {r.status_code})'}), 502
 
-        # Sanitizar filename para evitar caracteres no-ASCII en headers HTTP
-        # Usamos ASCII transliteration y luego percent-encoding para filename*
-        try:
-            safe_filename = filename.encode('ascii').decode('ascii')
-        except (UnicodeEncodeError, UnicodeDecodeError):
-            # Si contiene caracteres no-ASCII, usar solo ASCII seguro y añadir filename* encoded
-            import re
-            from urllib.parse import quote
-            safe_filename = re.sub(r'[^a-zA-Z0-9._-]', '_', filename)
-            # RFC 5987: filename*=UTF-8''<percent-encoded-filename>
-            encoded_filename = quote(filename.encode('utf-8'))
-            disposition = f"attachment; filename=\"{safe_filename}\"; filename*=UTF-8''{encoded_filename}"
-        else:
-            disposition = f'attachment; filename="{safe_filename}"'
+        headers = {nombre: r.headers[nombre] for nombre in HEADERS_RESPUESTA_DESCARGA if r.headers.get(nombre)}
+        headers.setdefault('Accept-Ranges', 'bytes')
+        if r.status_code in (304, 416):
+            # Sin cuerpo: 304 conserva ETag/Last-Modified; 416 informa el tamaño en Content-Range
+            r.close()
+            headers.pop('Content-Length', None)
+            return Response(status=r.status_code, headers=headers)
+        headers.setdefault('Content-Type', 'application/octet-stream')
+        headers['Content-Disposition'] = _content_disposition(filename)
 
-        headers = {
-            'Content-Type': r.headers.get('Content-Type', 'application/octet-stream'),
-            'Content-Length': r.headers.get('Content-Length') or '',
-            'Content-Disposition': disposition
-        }
+        def _bloques():
+            try:
+                # Sin decodificar: el cuerpo corresponde a Content-Length/Content-Encoding reenviados
+                yield from r.raw.stream(DESCARGA_CHUNK_BYTES, decode_content=False)
+            finally:
+                r.close()
 
-        return Response(stream_with_context(r.iter_content(chunk_size=8192)), headers=headers, status=200)
+        return Response(stream_with_context(_bloques()), headers=headers, status=r.status_code)
     except Exception as e:
         current_app.logger.error(f'Error en download_adjunto: {e}')
         return jsonify({'message': 'Error al procesar la descarga'}), 500
+
+
+def _content_disposition(filename: str) -> str:
+    # Sanitizar filename para evitar caracteres no-ASCII en headers HTTP
+    # Usamos ASCII transliteration y luego percent-encoding para filename*
+    try:
+        safe_filename = filename.encode('ascii').decode('ascii')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        # Si contiene caracteres no-ASCII, usar solo ASCII seguro y añadir filename* encoded
+        import re
+        from urllib.parse import quote
+        safe_filename = re.sub(r'[^a-zA-Z0-9._-]', '_', filename)
+        # RFC 5987: filename*=UTF-8''<percent-encoded-filename>
+        encoded_filename = quote(filename.encode('utf-8'))
+        disposition = f"attachment; filename=\"{safe_filename}\"; filename*=UTF-8''{encoded_filename}"
+    else:
+        disposition = f'attachment; filename="{safe_filename}"'
+    return disposition
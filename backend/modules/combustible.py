@@ -8,6 +8,8 @@ try:
 except Exception:
     create_client = None
 from ..utils.auth import auth_required, _has_write_permission, _is_admin
+from ..utils.paginacion import preparar_pagina, cerrar_pagina, modo_conteo
+from ..utils.storage import agregar_urls_adjuntos, pide_firmas
 from datetime import datetime
 from postgrest.exceptions import APIError as PostgrestAPIError
 
@@ -118,42 +120,42 @@ def list_cargas():
     except ValueError:
         return jsonify({'message': 'Parámetros de paginación inválidos'}), 400
 
-    start = (page - 1) * per_page
-    end = start + per_page - 1
+    cursor = request.args.get('cursor')
+    orden = [('fecha_carga', True), ('id', True)]
+    try:
+        conteo = modo_conteo(request.args.get('count'), cursor)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
+    # El total (si se pide) viene en la misma respuesta que la página
     query = supabase.table('flota_combustible').select(
-        '*, vehiculo:flota_vehiculos(placa, marca, modelo), conductor:flota_conductores(nombre, apellido)'
+        '*, vehiculo:flota_vehiculos(placa, marca, modelo), conductor:flota_conductores(nombre, apellido)',
+        count=conteo
     ).is_('deleted_at', None) # Solo no eliminados
 
     if q:
         like_q = f'%{q}%'
         query = query.or_(f"estacion_servicio.ilike.{like_q},observaciones.ilike.{like_q}")
     
-    query = query.order('fecha_carga', desc=True)
+    try:
+        query = preparar_pagina(query, orden, page, per_page, cursor)
+    except ValueError:
+        return jsonify({'message': 'Cursor de paginación inválido'}), 400
 
     try:
-        res = query.range(start, end).execute()
-        data = res.data or []
+        res = query.execute()
+        data, next_cursor = cerrar_pagina(res.data or [], orden, per_page)
+        total = res.count
     except Exception as e:
         current_app.logger.error(f"Error al listar cargas: {e}")
         return jsonify({'message': 'Error en la base de datos', 'detail': str(e)}), 500
 
-    # Conteo (simplificado, similar a otros módulos)
-    try:
-        count_query = supabase.table('flota_combustible').select('id', count='exact').is_('deleted_at', None)
-        if q:
-            like_q = f'%{q}%'
-            count_query = count_query.or_(f"estacion_servicio.ilike.{like_q},observaciones.ilike.{like_q}")
-        count_res = count_query.execute()
-        total = count_res.count if hasattr(count_res, 'count') else len(data)
-    except Exception:
-        total = None
-
     return jsonify({
         'data': data, 
         'meta': {
             'page': page, 'per_page': per_page, 'total': total, 
-            'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total else None
+            'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total else None,
+            'next_cursor': next_cursor
         }
     })
 
@@ -279,17 +281,8 @@ def list_carga_adjuntos(carga_id):
             .eq('carga_id', carga_id) \
             .order('created_at', desc=True) \
             .execute()
-        data = res.data or []
-        try:
-            for item in data:
-                sp = item.get('storage_path')
-                if sp:
-                    public = supabase.storage.from_('adjuntos_ordenes').get_public_url(sp)
-                    url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None)
-                    item['publicUrl'] = url
-        except Exception:
-            pass
-        return jsonify({'data': data or []})
+        data = agregar_urls_adjuntos(supabase, res.data or [], pide_firmas(request.args))
+        return jsonify({'data': data})
     except Exception:
         return jsonify({'message': 'Error al obtener adjuntos'}), 500
 
@@ -1,5 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app, g
 from ..utils.auth import auth_required
+from ..utils.kpi_snapshot import invalidar_kpis
+from ..utils.paginacion import preparar_pagina, cerrar_pagina, modo_conteo
 from datetime import datetime
 import re
 
@@ -63,10 +65,15 @@ def list_conductores():
     except ValueError:
         return jsonify({'message': 'Parámetros de paginación inválidos'}), 400
 
-    start = (page - 1) * per_page
-    end = start + per_page - 1
+    cursor = request.args.get('cursor')
+    orden = [('apellido', False), ('id', False)]
+    try:
+        conteo = modo_conteo(request.args.get('count'), cursor)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    query = supabase.table('flota_conductores').select('*')
+    # El total (si se pide) viene en la misma respuesta y respeta los filtros
+    query = supabase.table('flota_conductores').select('*', count=conteo)
     
     if q:
         like_q = f'%{q}%'
@@ -74,21 +81,20 @@ def list_conductores():
     if estado:
         query = query.eq('estado', estado)
 
-    query = query.is_('deleted_at', None).order('apellido', desc=False)
+    query = query.is_('deleted_at', None)
 
     try:
-        res = query.range(start, end).execute()
-        data = res.data or []
-    except Exception as e:
-        current_app.logger.error(f"Error al listar conductores: {e}")
-        return jsonify({'message': 'Error en la base de datos al obtener listado'}), 500
+        query = preparar_pagina(query, orden, page, per_page, cursor)
+    except ValueError:
+        return jsonify({'message': 'Cursor de paginación inválido'}), 400
 
     try:
-        count_res = supabase.table('flota_conductores').select('id', count='exact').is_('deleted_at', None).execute()
-        total = count_res.count if hasattr(count_res, 'count') and count_res.count is not None else len(data)
+        res = query.execute()
+        data, next_cursor = cerrar_pagina(res.data or [], orden, per_page)
+        total = res.count
     except Exception as e:
-        current_app.logger.warning(f"No se pudo obtener el conteo total: {e}")
-        total = None
+        current_app.logger.error(f"Error al listar conductores: {e}")
+        return jsonify({'message': 'Error en la base de datos al obtener listado'}), 500
 
     return jsonify({
         'data': data, 
@@ -96,7 +102,8 @@ def list_conductores():
             'page': page, 
             'per_page': per_page, 
             'total': total, 
-            'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total is not None else None
+            'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total is not None else None,
+            'next_cursor': next_cursor
         }
     })
 
@@ -154,6 +161,7 @@ def create_conductor():
 
     try:
         res = supabase.table('flota_conductores').insert(row).execute()
+        invalidar_kpis()
         return jsonify({'data': res.data[0]}), 201
     except PostgrestAPIError as e:
         current_app.logger.error(f"Error Supabase (POST): {e}")
@@ -246,6 +254,7 @@ def delete_conductor(conductor_id):
         res = supabase.table('flota_conductores').update({'deleted_at': datetime.now().isoformat()}).eq('id', conductor_id).execute()
         
         if res.data:
+            invalidar_kpis()
             return jsonify({'message': f'Conductor {conductor_id} marcado como eliminado (soft-delete).'}), 200
         return jsonify({'message': 'Conductor no encontrado para eliminar'}), 404
         
@@ -8,12 +8,24 @@ from datetime import datetime
 auth_required = None
 try:
     from ..utils.auth import auth_required, _has_write_permission, _is_admin
+    from ..utils.vehiculo_estado import refrescar_vehiculos
+    from ..utils.kpi_snapshot import invalidar_kpis
+    from ..utils.paginacion import preparar_pagina, cerrar_pagina, modo_conteo
+    from ..utils.storage import agregar_urls_adjuntos, pide_firmas
 except (ImportError, ValueError):
     try:
         from backend.utils.auth import auth_required, _has_write_permission, _is_admin
+        from backend.utils.vehiculo_estado import refrescar_vehiculos
+        from backend.utils.kpi_snapshot import invalidar_kpis
+        from backend.utils.paginacion import preparar_pagina, cerrar_pagina, modo_conteo
+        from backend.utils.storage import agregar_urls_adjuntos, pide_firmas
     except ImportError:
         try:
             from utils.auth import auth_required, _has_write_permission, _is_admin
+            from utils.vehiculo_estado import refrescar_vehiculos
+            from utils.kpi_snapshot import invalidar_kpis
+            from utils.paginacion import preparar_pagina, cerrar_pagina, modo_conteo
+            from utils.storage import agregar_urls_adjuntos, pide_firmas
         except ImportError:
             pass
 
@@ -21,6 +33,8 @@ if not auth_required:
     def auth_required(f): return f
     def _has_write_permission(u): return True
     def _is_admin(u): return True
+    def refrescar_vehiculos(*ids): pass
+    def invalidar_kpis(): pass
 
 # === 2. DEFINICIÓN DEL BLUEPRINT ===
 bp = Blueprint('mantenimiento', __name__)
@@ -69,11 +83,15 @@ def list_mantenimientos():
     except ValueError:
         return jsonify({'message': 'Pagination error'}), 400
 
-    start = (page - 1) * per_page
-    end = start + per_page - 1
+    cursor = request.args.get('cursor')
+    orden = [('fecha_programada', True), ('id', True)]
+    try:
+        conteo = modo_conteo(request.args.get('count'), cursor)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
     # 1. CONSULTA PRINCIPAL (Solo tabla base, sin joins que fallan)
-    query = supabase.table('flota_mantenimientos').select('*', count='exact').is_('deleted_at', None)
+    query = supabase.table('flota_mantenimientos').select('*', count=conteo).is_('deleted_at', None)
     
     # Filtros de búsqueda (Texto y Patente)
     if q:
@@ -91,13 +109,16 @@ def list_mantenimientos():
     if estado: query = query.eq('estado', estado)
     if vehiculo_id: query = query.eq('vehiculo_id', vehiculo_id)
 
-    query = query.order('fecha_programada', desc=True)
+    try:
+        query = preparar_pagina(query, orden, page, per_page, cursor)
+    except ValueError:
+        return jsonify({'message': 'Cursor de paginación inválido'}), 400
 
     try:
         # Ejecutar paginación
-        res = query.range(start, end).execute()
-        data = res.data or []
-        total = res.count if res.count is not None else len(data)
+        res = query.execute()
+        data, next_cursor = cerrar_pagina(res.data or [], orden, per_page)
+        total = res.count
 
         # --- ESTRATEGIA JOIN MANUAL (DETECTIVE) ---
         if data:
@@ -145,7 +166,7 @@ def list_mantenimientos():
 
     return jsonify({
         'data': data, 
-        'meta': {'page': page, 'per_page': per_page, 'total': total, 'pages': (total // per_page) + (1 if total % per_page > 0 else 0)}
+        'meta': {'page': page, 'per_page': per_page, 'total': total, 'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total is not None else None, 'next_cursor': next_cursor}
     })
 
 @bp.route('/', methods=['POST'])
@@ -199,6 +220,9 @@ def create_mantenimiento():
         if renovar_gases and header_data['vehiculo_id']:
             supabase.table('flota_vehiculos').update({'fecha_vencimiento_gases': renovar_gases}).eq('id', header_data['vehiculo_id']).execute()
 
+        refrescar_vehiculos(header_data['vehiculo_id'])
+        invalidar_kpis()
+
         return jsonify({'message': 'Orden creada', 'id': mant_id}), 201
 
     except Exception as e:
@@ -215,6 +239,10 @@ def update_mantenimiento(mant_id):
     payload = request.get_json() or {}
 
     try:
+        # 0. Vehículo actual (para refrescar su resumen de odómetro/mantención)
+        curr = supabase.table('flota_mantenimientos').select('vehiculo_id').eq('id', mant_id).limit(1).execute()
+        vid_actual = curr.data[0]['vehiculo_id'] if curr.data else None
+
         # 1. Cabecera
         updates = {
             'vehiculo_id': _safe_int(payload.get('vehiculo_id')),
@@ -258,13 +286,16 @@ def update_mantenimiento(mant_id):
         # Renovar gases
         if 'renovar_gases' in payload:
             r_gas = _safe_date(payload.get('renovar_gases'))
-            vid = final_updates.get('vehiculo_id')
-            if not vid:
-                curr = supabase.table('flota_mantenimientos').select('vehiculo_id').eq('id', mant_id).single().execute()
-                if curr.data: vid = curr.data['vehiculo_id']
+            vid = final_updates.get('vehiculo_id') or vid_actual
             if r_gas and vid:
                 supabase.table('flota_vehiculos').update({'fecha_vencimiento_gases': r_gas}).eq('id', vid).execute()
 
+        campos_km = ('vehiculo_id', 'estado', 'km_programado', 'km_realizacion', 'fecha_realizacion')
+        if any(k in final_updates for k in campos_km):
+            refrescar_vehiculos(vid_actual, final_updates.get('vehiculo_id'))
+        if 'estado' in final_updates:
+            invalidar_kpis()
+
         return jsonify({'message': 'Actualizado'}), 200
 
     except Exception as e:
@@ -276,7 +307,9 @@ def delete_mantenimiento(mant_id):
     user = g.get('current_user')
     if not _is_admin(user): return jsonify({'message': 'Permisos insuficientes'}), 403
     try:
-        current_app.config.get('SUPABASE').table('flota_mantenimientos').update({'deleted_at': datetime.now().isoformat()}).eq('id', mant_id).execute()
+        res = current_app.config.get('SUPABASE').table('flota_mantenimientos').update({'deleted_at': datetime.now().isoformat()}).eq('id', mant_id).execute()
+        refrescar_vehiculos(*[m.get('vehiculo_id') for m in (res.data or [])])
+        invalidar_kpis()
         return jsonify({'message': 'Eliminado'}), 200
     except Exception as e: return jsonify({'message': 'Error delete', 'detail': str(e)}), 500
 
@@ -287,17 +320,7 @@ def list_mant_adjuntos(mant_id):
     supabase = current_app.config.get('SUPABASE')
     try:
         res = supabase.table('flota_mantenimiento_adjuntos').select('*').eq('mantenimiento_id', mant_id).order('created_at', desc=True).execute()
-        data = res.data or []
-        for item in data:
-            if item.get('storage_path'):
-                try:
-                    public = supabase.storage.from_('adjuntos_ordenes').get_public_url(item['storage_path'])
-                    # Ajuste de compatibilidad para diferentes versiones de librería
-                    if hasattr(public, 'publicUrl'): url = public.publicUrl
-                    elif isinstance(public, dict): url = public.get('publicUrl')
-                    else: url = str(public) 
-                    item['publicUrl'] = url
-                except: pass
+        data = agregar_urls_adjuntos(supabase, res.data or [], pide_firmas(request.args))
         return jsonify({'data': data})
     except Exception: return jsonify({'message': 'Error'}), 500
 
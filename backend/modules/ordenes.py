@@ -1,8 +1,26 @@
 # === 1. IMPORTS (TODOS AL PRINCIPIO) ===
-from flask import Blueprint, request, jsonify, current_app, g
-from ..utils.auth import auth_required, _has_write_permission
-from datetime import datetime
-import re
+from flask import Blueprint, request, jsonify, current_app, g, Response, stream_with_context
+from ..utils.auth import auth_required, auth_required_stream, _has_write_permission
+from ..utils.vehiculo_estado import refrescar_vehiculos
+from ..utils.kpi_snapshot import invalidar_kpis
+from ..utils.rutas import (
+    registrar_puntos, obtener_resumenes_ruta, punto_inicio, punto_fin,
+    leer_puntos_ruta, obtener_nivel, programar_niveles, formatear_puntos, FORMATOS_RUTA,
+    metricas_ruta, obtener_metricas_ruta, odometro_sospechoso,
+    consultar_puntos, CONSULTA_MAX_HORAS, CONSULTA_MAX_PUNTOS, leer_timestamp,
+)
+from ..utils.geo import simplificar_puntos
+from ..utils.gps_ingesta import ingerir_puntos, validar_puntos, leer_ndjson, buscar_ingesta, guardar_ingesta
+from ..utils.gps_cola import cola_activa, encolar, reintentar_en
+from ..utils.posiciones import actualizar_posicion, ultimo_punto, obtener_posiciones
+from ..utils.eventos import suscribir, desuscribir, publicar_cambio_estado
+from ..utils.cache import TTLCache
+from ..utils.storage import agregar_urls_adjuntos, pide_firmas
+from ..utils.paginacion import preparar_pagina, cerrar_pagina, modo_conteo
+from datetime import datetime, timedelta
+import json
+import queue
+import time
 
 try:
     from postgrest.exceptions import APIError as PostgrestAPIError
@@ -13,6 +31,9 @@ except ImportError:
 # === 2. DEFINICIÓN DEL BLUEPRINT ===
 bp = Blueprint('ordenes', __name__)
 
+# Órdenes ya verificadas al recibir GPS: el celular envía lotes cada pocos segundos
+_ordenes_con_gps = TTLCache(maxsize=4096, ttl=300)
+
 # === 3. HELPERS DE PERMISOS Y DATOS ===
 
 def _is_admin(user: dict) -> bool:
@@ -58,13 +79,16 @@ def _registrar_cambio_estado(orden_id, estado_anterior, estado_nuevo, usuario_id
     
     supabase = current_app.config.get('SUPABASE')
     try:
-        supabase.table('flota_orden_historial').insert({
+        res = supabase.table('flota_orden_historial').insert({
             'orden_id': orden_id,
             'usuario_id': usuario_id,
             'estado_anterior': estado_anterior,
             'estado_nuevo': estado_nuevo,
             'observacion': observacion
         }).execute()
+        # Aviso inmediato a los clientes SSE de este worker (el resto lo ve por sondeo)
+        if res.data:
+            publicar_cambio_estado(res.data[0])
         current_app.logger.info(f"📝 Estado cambiado: {estado_anterior} → {estado_nuevo} (Orden #{orden_id})")
     except Exception as e:
         current_app.logger.error(f"Error registrando historial: {e}")
@@ -137,11 +161,17 @@ def list_ordenes():
     except ValueError:
         return jsonify({'message': 'Parámetros de paginación inválidos'}), 400
 
-    start = (page - 1) * per_page
-    end = start + per_page - 1
+    cursor = request.args.get('cursor')
+    orden = [('fecha_inicio_programada', True), ('id', True)]
+    try:
+        conteo = modo_conteo(request.args.get('count'), cursor)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
+    # El total (si se pide) viene en la misma respuesta que la página
     query = supabase.table('flota_ordenes').select(
-        '*, vehiculo:flota_vehiculos(placa, marca, modelo), conductor:flota_conductores(nombre, apellido, rut)'
+        '*, vehiculo:flota_vehiculos(placa, marca, modelo), conductor:flota_conductores(nombre, apellido, rut)',
+        count=conteo
     )
     
     if q:
@@ -154,40 +184,27 @@ def list_ordenes():
     if fecha_hasta:
         query = query.lte('fecha_inicio_programada', fecha_hasta)
 
-    query = query.order('fecha_inicio_programada', desc=True)
+    try:
+        query = preparar_pagina(query, orden, page, per_page, cursor)
+    except ValueError:
+        return jsonify({'message': 'Cursor de paginación inválido'}), 400
 
     try:
-        res = query.range(start, end).execute()
-        data = res.data or []
+        res = query.execute()
+        data, next_cursor = cerrar_pagina(res.data or [], orden, per_page)
+        total = res.count
     except Exception as e:
         current_app.logger.error(f"Error al listar órdenes: {e}")
         return jsonify({'message': 'Error en la base de datos', 'detail': str(e)}), 500
 
-    try:
-        count_query = supabase.table('flota_ordenes').select('id', count='exact')
-        if q:
-            like_q = f'%{q}%'
-            count_query = count_query.or_(f"origen.ilike.{like_q},destino.ilike.{like_q},descripcion.ilike.{like_q}")
-        if estado:
-            count_query = count_query.eq('estado', estado)
-        if fecha_desde:
-            count_query = count_query.gte('fecha_inicio_programada', fecha_desde)
-        if fecha_hasta:
-            count_query = count_query.lte('fecha_inicio_programada', fecha_hasta)
-            
-        count_res = count_query.execute()
-        total = count_res.count if hasattr(count_res, 'count') else None
-    except Exception as e:
-        current_app.logger.warning(f"No se pudo obtener conteo: {e}")
-        total = None
-
     return jsonify({
         'data': data, 
         'meta': {
             'page': page, 
             'per_page': per_page, 
             'total': total, 
-            'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total else None
+            'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total else None,
+            'next_cursor': next_cursor
         }
     })
 
@@ -267,6 +284,9 @@ def create_orden():
                 user.get('id'),
                 'Orden creada'
             )
+            if orden_creada.get('kilometraje_inicio') is not None:
+                refrescar_vehiculos(orden_creada.get('vehiculo_id'))
+            invalidar_kpis()
             
         return jsonify({'data': res.data[0]}), 201
     except PostgrestAPIError as e:
@@ -361,6 +381,9 @@ def update_orden(orden_id):
                     user.get('id'),
                     'Actualización de orden'
                 )
+                invalidar_kpis()
+            # Odómetro / viajes: refrescar vehículo anterior y nuevo (si cambió)
+            refrescar_vehiculos(orden_actual.get('vehiculo_id'), res.data[0].get('vehiculo_id'))
             
             return jsonify({'data': res.data[0]})
         return jsonify({'message': f'Orden {orden_id} no encontrada'}), 404
@@ -382,7 +405,7 @@ def delete_orden(orden_id):
 
     supabase = current_app.config.get('SUPABASE')
     try:
-        res_actual = supabase.table('flota_ordenes').select('estado').eq('id', orden_id).limit(1).execute()
+        res_actual = supabase.table('flota_ordenes').select('estado, vehiculo_id').eq('id', orden_id).limit(1).execute()
         if not res_actual.data:
             return jsonify({'message': 'Orden no encontrada'}), 404
         
@@ -392,6 +415,9 @@ def delete_orden(orden_id):
         
         if res.data:
             _registrar_cambio_estado(orden_id, estado_anterior, 'cancelada', user.get('id'), 'Orden cancelada manualmente')
+            invalidar_kpis()
+            if estado_anterior == 'completada':
+                refrescar_vehiculos(res_actual.data[0].get('vehiculo_id'))
             return jsonify({'message': f'Orden {orden_id} cancelada'}), 200
         return jsonify({'message': 'Orden no encontrada'}), 404
         
@@ -411,18 +437,8 @@ def list_adjuntos(orden_id):
             .eq('orden_id', orden_id) \
             .order('created_at', desc=True) \
             .execute()
-        data = res.data or []
-        # Añadir public_url a cada adjunto si es posible
-        try:
-            for item in data:
-                sp = item.get('storage_path')
-                if sp:
-                    public = supabase.storage.from_('adjuntos_ordenes').get_public_url(sp)
-                    url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None)
-                    item['publicUrl'] = url
-        except Exception:
-            # No crítico: si falla, el cliente puede construir URL si lo desea
-            pass
+        # publicUrl construida localmente (sin llamar al cliente de Storage por fila)
+        data = agregar_urls_adjuntos(supabase, res.data or [], pide_firmas(request.args))
         return jsonify({'data': data})
     except Exception as e:
         return jsonify({'message': 'Error al obtener adjuntos'}), 500
@@ -630,6 +646,8 @@ def iniciar_viaje_conductor(orden_id):
                 user.get('id'), # ID del usuario (flota_usuarios)
                 'Viaje iniciado desde App Móvil'
             )
+            if 'kilometraje_inicio' in updates:
+                refrescar_vehiculos(orden.get('vehiculo_id'))
             return jsonify({'data': res_update.data[0], 'message': 'Viaje iniciado correctamente'}), 200
         else:
             return jsonify({'message': 'No se pudo actualizar la orden'}), 500
@@ -756,6 +774,10 @@ def finalizar_viaje_conductor(orden_id):
                 user.get('id'),
                 f'Viaje finalizado desde App Móvil con KM {km_fin_int}'
             )
+            refrescar_vehiculos(orden.get('vehiculo_id'))
+            invalidar_kpis()
+            # Niveles de detalle del mapa, en segundo plano
+            programar_niveles(orden_id, forzar=True)
             # Try to update the vehicle's km_actual in flota_vehiculos if such field exists.
             try:
                 veh_id = orden.get('vehiculo_id')
@@ -821,42 +843,112 @@ def get_ordenes_conductor_historial():
 @auth_required
 def registrar_ruta_gps(orden_id):
     """
-    Recibe una lista de puntos GPS y los guarda en la tabla flota_orden_rutas.
-    Payload esperado: { "puntos": [ {lat, lng, timestamp, speed}, ... ] }
+    Recibe puntos GPS y los guarda en la tabla flota_orden_rutas.
+    Payload esperado: { "puntos": [ {latitude, longitude, timestamp, speed}, ... ] }
+    o NDJSON (Content-Type: application/x-ndjson), un punto por línea, para lotes grandes.
+
+    Se descartan puntos con coordenadas o timestamp inválidos y duplicados por
+    (orden, timestamp). Con el header Idempotency-Key un reintento recibe la
+    respuesta original sin reprocesar.
+
+    Con la cola GPS activa (GPS_COLA_ACTIVA) responde 202 apenas el lote queda
+    en el journal local y la escritura en la base es asíncrona; si la cola
+    está llena responde 503 con Retry-After.
     """
     supabase = current_app.config.get('SUPABASE')
-    
+    clave = (request.headers.get('Idempotency-Key') or '').strip()[:200] or None
+
+    if clave:
+        previo = buscar_ingesta(supabase, orden_id, clave)
+        if previo is not None:
+            response = jsonify(previo)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response, 200
+
     # Validar que la orden existe
     # (Podríamos validar conductor también, pero por rendimiento confiamos en el token por ahora)
-    
-    payload = request.get_json() or {}
-    puntos = payload.get('puntos', [])
-    
-    if not puntos or not isinstance(puntos, list):
-        return jsonify({'message': 'Se requiere una lista de puntos GPS.'}), 400
-
-    # Preparamos los datos para inserción masiva
-    datos_para_insertar = []
-    for p in puntos:
-        datos_para_insertar.append({
-            'orden_id': orden_id,
-            'latitud': p.get('latitude'),
-            'longitud': p.get('longitude'),
-            'velocidad': p.get('speed'),
-            'timestamp': p.get('timestamp') # Debe venir en formato ISO o compatible
-        })
+    if _ordenes_con_gps.get(orden_id) is None:
+        try:
+            orden_res = supabase.table('flota_ordenes').select('id').eq('id', orden_id).limit(1).execute()
+        except Exception as e:
+            current_app.logger.error(f"Error verificando orden para ruta GPS: {e}")
+            return jsonify({'message': 'Error al guardar ruta'}), 500
+        if not orden_res.data:
+            return jsonify({'message': 'Orden no encontrada'}), 404
+        _ordenes_con_gps.set(orden_id, True)
+
+    if (request.mimetype or '').endswith('ndjson'):
+        # Se procesa a medida que llega, sin cargar el body completo
+        puntos = leer_ndjson(request.stream)
+    else:
+        payload = request.get_json(silent=True) or {}
+        puntos = payload.get('puntos', [])
+        if not puntos or not isinstance(puntos, list):
+            return jsonify({'message': 'Se requiere una lista de puntos GPS.'}), 400
+
+    if cola_activa():
+        # Escritura diferida: se confirma tras el append al journal local (ver utils/gps_cola.py)
+        conteo = {}
+        filas = list(validar_puntos(puntos, orden_id, conteo))
+        if conteo.get('recibidos', 0) == 0:
+            return jsonify({'message': 'Se requiere una lista de puntos GPS.'}), 400
+        try:
+            encolado = encolar(filas)
+        except OSError as e:
+            current_app.logger.error(f"Journal GPS no disponible, guardando directo: {e}")
+            encolado = None
+        if encolado is False:
+            response = jsonify({'message': 'Cola de puntos GPS llena, reintente más tarde'})
+            response.headers['Retry-After'] = str(reintentar_en())
+            return response, 503
+        if encolado:
+            actualizar_posicion(orden_id, ultimo_punto(filas))
+            rechazos = conteo.get('motivos_rechazo', {})
+            respuesta = {
+                'recibidos': conteo['recibidos'],
+                'aceptados': len(filas),
+                'duplicados': conteo.get('duplicados', 0),
+                'rechazados': sum(rechazos.values()),
+                'motivos_rechazo': rechazos,
+                'encolado': True,
+                'message': f"{len(filas)} puntos recibidos" if filas else 'No hay puntos válidos',
+            }
+            if clave:
+                guardar_ingesta(supabase, orden_id, clave, respuesta)
+            return jsonify(respuesta), 202 if filas else 200
+        # Sin journal: las filas ya validadas se insertan en línea
+        puntos = filas
+    else:
+        conteo = None
 
     try:
-        # Inserción masiva en Supabase
-        if datos_para_insertar:
-            res = supabase.table('flota_orden_rutas').insert(datos_para_insertar).execute()
-            return jsonify({'message': f'{len(datos_para_insertar)} puntos guardados'}), 201
-        else:
-            return jsonify({'message': 'No hay puntos válidos'}), 200
-
+        resultado = ingerir_puntos(supabase, orden_id, puntos)
     except Exception as e:
         current_app.logger.error(f"Error guardando ruta GPS: {e}")
         return jsonify({'message': 'Error al guardar ruta'}), 500
+    if conteo:
+        # Conteos de la validación hecha antes de intentar encolar
+        resultado['recibidos'] = conteo['recibidos']
+        resultado['duplicados'] += conteo.get('duplicados', 0)
+        resultado['motivos_rechazo'] = conteo.get('motivos_rechazo', {})
+        resultado['rechazados'] = sum(resultado['motivos_rechazo'].values())
+
+    if resultado['recibidos'] == 0:
+        return jsonify({'message': 'Se requiere una lista de puntos GPS.'}), 400
+
+    if resultado['aceptados']:
+        # Inicio / fin / cantidad de puntos para el historial de rutas del vehículo
+        registrar_puntos(supabase, orden_id, resumen_lote=resultado['resumen'])
+    if resultado['aceptados'] or resultado['duplicados']:
+        actualizar_posicion(orden_id, resultado['ultimo'])
+
+    respuesta = {k: v for k, v in resultado.items() if k not in ('resumen', 'ultimo')}
+    respuesta['message'] = f"{resultado['aceptados']} puntos guardados" if resultado['aceptados'] else 'No hay puntos válidos'
+    if clave:
+        guardar_ingesta(supabase, orden_id, clave, respuesta)
+    return jsonify(respuesta), 201 if resultado['aceptados'] else 200
+
+
 # --- RUTA PARA OBTENER PUNTOS GPS (WEB Y MÓVIL) ---
 
 @bp.route('/<int:orden_id>/ruta', methods=['GET'])
@@ -864,36 +956,250 @@ def registrar_ruta_gps(orden_id):
 def get_ruta_gps(orden_id):
     """
     Obtiene todos los puntos GPS registrados para una orden, ordenados por tiempo.
+    Parámetros opcionales:
+    - simplify (float): tolerancia en metros para simplificar la línea (Douglas-Peucker)
+    - max_points (int): tope de puntos devueltos (default: 800). Sin simplify se sirve
+      el nivel de detalle precalculado más cercano (100/500/2000) si está al día.
+    - format (str): json (default), columnar (arreglos paralelos) o polyline (encoded polyline
+      con timestamps y velocidades diferenciados; ver utils/rutas.formatear_puntos)
+    La respuesta incluye 'metricas' (distancia GPS, tiempos en movimiento/detenido,
+    velocidades y paradas) calculadas sobre la ruta completa; None si aún no están.
     """
     supabase = current_app.config.get('SUPABASE')
-    
+
     try:
-        # Obtener puntos ordenados por timestamp
-        res = supabase.table('flota_orden_rutas') \
-            .select('latitud, longitud, timestamp, velocidad') \
-            .eq('orden_id', orden_id) \
-            .order('timestamp', desc=False) \
-            .execute()
-        data = res.data or []
+        tolerancia_m = float(request.args.get('simplify', 0) or 0)
+    except ValueError:
+        return jsonify({'message': 'El parámetro simplify debe ser una tolerancia en metros'}), 400
+    try:
+        max_points = int(request.args.get('max_points', 800))
+    except ValueError:
+        max_points = 800
+    formato = request.args.get('format', 'json')
+    if formato not in FORMATOS_RUTA:
+        return jsonify({'message': f"format debe ser uno de: {', '.join(FORMATOS_RUTA)}"}), 400
+
+    try:
+        # Nivel de detalle precalculado: evita leer los puntos crudos
+        if tolerancia_m <= 0 and max_points > 0:
+            nivel = obtener_nivel(supabase, orden_id, max_points)
+            if nivel:
+                response = jsonify({'data': formatear_puntos(nivel['puntos'], formato), 'metricas': nivel.get('metricas')})
+                response.headers['X-Ruta-Nivel'] = str(nivel['nivel'])
+                return response, 200
+
+        # Obtener puntos ordenados por timestamp (todas las páginas)
+        data = leer_puntos_ruta(supabase, orden_id)
+        metricas = metricas_ruta(data)
+        # Simplificación geométrica: conserva curvas y descarta puntos redundantes en rectas
+        if tolerancia_m > 0:
+            data = simplificar_puntos(data, tolerancia_m)
         # Sampling: limit points to a reasonable number for web maps
-        try:
-            max_points = int(request.args.get('max_points', 800))
-        except ValueError:
-            max_points = 800
         if len(data) > max_points and max_points > 0:
+            ultimo = data[-1]
             # Simple downsample by evenly selecting points
             step = max(1, len(data) // max_points)
             data = [data[i] for i in range(0, len(data), step)]
             # Ensure the last point is included
-            if data[-1] != (res.data or [])[-1]:
-                data.append((res.data or [])[-1])
-        return jsonify({'data': data}), 200
+            if data[-1] is not ultimo:
+                data.append(ultimo)
+        return jsonify({'data': formatear_puntos(data, formato), 'metricas': metricas}), 200
 
     except Exception as e:
         current_app.logger.error(f"Error al obtener ruta GPS: {e}")
         return jsonify({'message': 'Error al obtener la ruta'}), 500
 
 
+# --- EVENTOS EN VIVO (SSE): CAMBIOS DE ESTADO Y POSICIONES ---
+
+# Un stream se cierra tras este tiempo; EventSource reconecta solo (con Last-Event-ID)
+EVENTOS_DURACION_MAX_SEG = 900
+EVENTOS_KEEPALIVE_SEG = 15
+
+
+def _sse(evento: str, data, id_evento: str | None = None) -> str:
+    cabecera = f'id: {id_evento}\n' if id_evento else ''
+    return f"{cabecera}event: {evento}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@bp.route('/eventos', methods=['GET'])
+@auth_required_stream
+def stream_eventos():
+    """
+    Stream Server-Sent Events con los cambios de estado de órdenes ('estado') y las
+    nuevas posiciones de órdenes en curso ('posicion').
+    Parámetros opcionales:
+    - tipos: lista separada por comas (estado,posicion); por defecto ambos
+    - orden_id: solo eventos de esa orden
+    - token: JWT, para EventSource (que no puede enviar el header Authorization)
+    Al conectar envía 'posiciones' con la foto actual (si se pidieron posiciones).
+    'sync' indica que pudieron perderse eventos y conviene recargar los listados.
+    """
+    tipos = [t for t in (request.args.get('tipos') or '').split(',') if t in ('estado', 'posicion')] or None
+    orden_id = _safe_int(request.args.get('orden_id'))
+    app = current_app._get_current_object()
+    suscripcion, reanudada = suscribir(app, tipos, orden_id, request.headers.get('Last-Event-ID'))
+    if suscripcion is None:
+        response = jsonify({'message': 'Demasiados clientes conectados, reintente más tarde'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    foto = None
+    if not reanudada and (tipos is None or 'posicion' in tipos):
+        try:
+            foto, _ = obtener_posiciones(current_app.config.get('SUPABASE'))
+            if orden_id:
+                foto = [p for p in foto if p['orden_id'] == orden_id]
+        except Exception as e:
+            current_app.logger.warning(f"SSE: no se pudo obtener la foto de posiciones: {e}")
+
+    def generar():
+        try:
+            yield 'retry: 3000\n\n'
+            if request.headers.get('Last-Event-ID') and not reanudada:
+                yield _sse('sync', {})
+            if foto is not None:
+                yield _sse('posiciones', foto)
+            fin = time.monotonic() + EVENTOS_DURACION_MAX_SEG
+            while time.monotonic() < fin:
+                if suscripcion.desbordada:
+                    yield _sse('sync', {})
+                    return
+                try:
+                    evento = suscripcion.cola.get(timeout=EVENTOS_KEEPALIVE_SEG)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                yield _sse(evento['tipo'], evento['data'], evento['id'])
+        finally:
+            desuscribir(suscripcion)
+
+    response = Response(stream_with_context(generar()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Evita que nginx/proxies acumulen el stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# --- POSICIÓN ACTUAL DE LA FLOTA (ÓRDENES EN CURSO) ---
+
+@bp.route('/posiciones', methods=['GET'])
+@auth_required
+def get_posiciones_flota():
+    """
+    Última posición conocida de cada vehículo con orden en curso, en una sola respuesta.
+    Responde con ETag; un cliente que repite la consulta con If-None-Match recibe 304
+    si nada se movió. Las órdenes en curso sin puntos GPS vienen con latitud/longitud None.
+    """
+    supabase = current_app.config.get('SUPABASE')
+    try:
+        data, etag = obtener_posiciones(supabase)
+    except Exception as e:
+        current_app.logger.error(f"Error al obtener posiciones de la flota: {e}")
+        return jsonify({'message': 'Error al obtener posiciones'}), 500
+
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify({'data': data, 'meta': {'total': len(data)}})
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# --- CONSULTA DE PUNTOS GPS DE TODA LA FLOTA (TIEMPO / ÁREA) ---
+
+@bp.route('/rutas', methods=['GET'])
+@auth_required
+def consultar_rutas_flota():
+    """
+    Puntos GPS de todas las órdenes en una ventana de tiempo, agrupados por orden.
+    Parámetros:
+    - desde, hasta (ISO 8601, requeridos): ventana de hasta CONSULTA_MAX_HORAS horas
+    - bbox (opcional): lng_min,lat_min,lng_max,lat_max (área por la que pasaron)
+    - vehiculo_id (opcional): solo órdenes de ese vehículo
+    - limit (opcional): tope de puntos (default y máximo CONSULTA_MAX_PUNTOS); meta.truncado avisa si se alcanzó
+    - solo_ordenes (opcional): true para omitir los puntos y retornar solo las órdenes encontradas
+    - format (opcional): json, columnar o polyline (ver get_ruta_gps)
+    """
+    supabase = current_app.config.get('SUPABASE')
+
+    desde, hasta = leer_timestamp(request.args.get('desde')), leer_timestamp(request.args.get('hasta'))
+    if desde is None or hasta is None or hasta <= desde:
+        return jsonify({'message': 'Se requieren desde y hasta (ISO 8601), con hasta posterior a desde'}), 400
+    if hasta - desde > timedelta(hours=CONSULTA_MAX_HORAS):
+        return jsonify({'message': f'La ventana de tiempo no puede superar {CONSULTA_MAX_HORAS} horas'}), 400
+
+    bbox = None
+    if request.args.get('bbox'):
+        try:
+            bbox = tuple(float(v) for v in request.args['bbox'].split(','))
+        except ValueError:
+            bbox = ()
+        if len(bbox) != 4 or not (-180 <= bbox[0] <= bbox[2] <= 180) or not (-90 <= bbox[1] <= bbox[3] <= 90):
+            return jsonify({'message': 'bbox debe ser lng_min,lat_min,lng_max,lat_max'}), 400
+
+    try:
+        limite = min(max(int(request.args.get('limit', CONSULTA_MAX_PUNTOS)), 1), CONSULTA_MAX_PUNTOS)
+    except ValueError:
+        limite = CONSULTA_MAX_PUNTOS
+    formato = request.args.get('format', 'json')
+    if formato not in FORMATOS_RUTA:
+        return jsonify({'message': f"format debe ser uno de: {', '.join(FORMATOS_RUTA)}"}), 400
+    solo_ordenes = request.args.get('solo_ordenes', 'false').lower() == 'true'
+    vehiculo_id = _safe_int(request.args.get('vehiculo_id'))
+
+    try:
+        orden_ids = None
+        if vehiculo_id:
+            # Órdenes del vehículo que pudieron estar en curso durante la ventana
+            res = supabase.table('flota_ordenes').select('id').eq('vehiculo_id', vehiculo_id) \
+                .lte('fecha_inicio_real', hasta.isoformat()) \
+                .or_(f'fecha_fin_real.is.null,fecha_fin_real.gte."{desde.isoformat()}"').execute()
+            orden_ids = [o['id'] for o in res.data or []]
+            if not orden_ids:
+                return jsonify({'data': [], 'meta': {'total_puntos': 0, 'truncado': False, 'limite': limite}}), 200
+
+        puntos, truncado = consultar_puntos(supabase, desde, hasta, bbox, orden_ids, limite)
+
+        por_orden = {}
+        for p in puntos:
+            por_orden.setdefault(p.pop('orden_id'), []).append(p)
+        ordenes = {}
+        if por_orden:
+            res = supabase.table('flota_ordenes').select(
+                'id, estado, vehiculo_id, vehiculo:flota_vehiculos(placa), conductor:flota_conductores(nombre, apellido)'
+            ).in_('id', list(por_orden)).execute()
+            ordenes = {o['id']: o for o in res.data or []}
+
+        data = []
+        for oid, pts in por_orden.items():
+            orden = ordenes.get(oid, {})
+            conductor = orden.get('conductor') or {}
+            item = {
+                'orden_id': oid,
+                'estado': orden.get('estado'),
+                'vehiculo_id': orden.get('vehiculo_id'),
+                'placa': (orden.get('vehiculo') or {}).get('placa'),
+                'conductor': f"{conductor.get('nombre', '')} {conductor.get('apellido', '')}".strip() or None,
+                'total_puntos': len(pts),
+                'primer_timestamp': pts[0].get('timestamp'),
+                'ultimo_timestamp': pts[-1].get('timestamp'),
+            }
+            if not solo_ordenes:
+                item['puntos'] = formatear_puntos(pts, formato)
+            data.append(item)
+
+        return jsonify({
+            'data': data,
+            'meta': {'total_puntos': len(puntos), 'truncado': truncado, 'limite': limite},
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error en consulta de rutas de flota: {e}")
+        return jsonify({'message': 'Error al consultar rutas'}), 500
+
+
 # --- NUEVO: OBTENER RUTAS COMPLETADAS DE UN VEHÍCULO ---
 @bp.route('/vehiculo/<int:vehiculo_id>/rutas', methods=['GET'])
 @auth_required
@@ -901,6 +1207,8 @@ def get_rutas_vehiculo(vehiculo_id):
     """
     Obtiene todas las rutas COMPLETADAS de un vehículo específico.
     Retorna: lista de órdenes con origen, destino, fechas y coordenadas de inicio/fin.
+    Incluye km_gps / metricas_gps desde la traza y km_sospechoso cuando el odómetro
+    ingresado no cuadra con la distancia GPS (None si no hay métricas todavía).
     """
     supabase = current_app.config.get('SUPABASE')
     
@@ -911,20 +1219,18 @@ def get_rutas_vehiculo(vehiculo_id):
         ).eq('vehiculo_id', vehiculo_id).eq('estado', 'completada').order('fecha_fin_real', desc=True).execute()
         
         ordenes = res.data or []
-        
-        # Para cada orden, obtener primer y último punto GPS (si existen)
+
+        # Primer y último punto GPS de todas las órdenes en una sola lectura (resumen por orden)
+        resumenes_ruta = obtener_resumenes_ruta(supabase, [o.get('id') for o in ordenes])
+        # Métricas calculadas desde la traza GPS (guardadas por orden completada)
+        metricas_ruta_ordenes = obtener_metricas_ruta(supabase, [o.get('id') for o in ordenes], resumenes_ruta)
+
         resultado = []
         for orden in ordenes:
             orden_id = orden.get('id')
-            
-            # Obtener puntos GPS (primero y último)
-            ruta_res = supabase.table('flota_orden_rutas').select(
-                'latitud, longitud, timestamp'
-            ).eq('orden_id', orden_id).order('timestamp').execute()
-            
-            puntos = ruta_res.data or []
-            punto_inicio = puntos[0] if len(puntos) > 0 else None
-            punto_fin = puntos[-1] if len(puntos) > 1 else None
+            resumen_ruta = resumenes_ruta.get(orden_id)
+            metricas = metricas_ruta_ordenes.get(orden_id)
+            km_recorridos = (orden.get('kilometraje_fin') or 0) - (orden.get('kilometraje_inicio') or 0)
             
             # Construir nombre completo del conductor
             conductor_data = orden.get('conductor', {})
@@ -942,11 +1248,14 @@ def get_rutas_vehiculo(vehiculo_id):
                 'fecha_fin': orden.get('fecha_fin_real'),
                 'km_inicio': orden.get('kilometraje_inicio'),
                 'km_fin': orden.get('kilometraje_fin'),
-                'km_recorridos': (orden.get('kilometraje_fin') or 0) - (orden.get('kilometraje_inicio') or 0),
+                'km_recorridos': km_recorridos,
+                'km_gps': metricas.get('distancia_km') if metricas else None,
+                'km_sospechoso': odometro_sospechoso(km_recorridos, metricas),
+                'metricas_gps': metricas,
                 'conductor': conductor_nombre,
-                'punto_inicio': punto_inicio,
-                'punto_fin': punto_fin,
-                'tiene_mapa': len(puntos) > 0
+                'punto_inicio': punto_inicio(resumen_ruta),
+                'punto_fin': punto_fin(resumen_ruta),
+                'tiene_mapa': bool(resumen_ruta and resumen_ruta.get('total_puntos'))
             })
         
         return jsonify({'status': 'success', 'data': resultado}), 200
@@ -2,6 +2,10 @@
 
 from flask import Blueprint, jsonify, current_app, request, g
 from ..utils.auth import auth_required
+from ..utils.vehiculo_estado import obtener_resumenes
+from ..utils.query_batch import ejecutar_consultas
+from ..utils.kpi_snapshot import obtener_kpis
+from ..utils.rpc import llamar_rpc
 from datetime import datetime, timedelta
 
 try:
@@ -12,40 +16,38 @@ except ImportError:
 
 reportes_bp = Blueprint('reportes', __name__)
 
+def _calcular_kpis(supabase):
+    """Ejecuta los 4 conteos del dashboard. Retorna (kpis, completo)."""
+    # Los 4 conteos son independientes: se ejecutan en paralelo
+    res = ejecutar_consultas({
+        # Total de vehículos activos (no eliminados)
+        'total_vehiculos': lambda: supabase.table('flota_vehiculos').select('id', count='exact').is_('deleted_at', None).execute(),
+        # Total de conductores activos (no eliminados)
+        'total_conductores': lambda: supabase.table('flota_conductores').select('id', count='exact').is_('deleted_at', None).execute(),
+        # Órdenes activas = todas las que NO están completadas ni canceladas
+        'ordenes_activas': lambda: supabase.table('flota_ordenes').select('id', count='exact').not_.in_('estado', ['completada', 'cancelada']).execute(),
+        # Mantenimientos pendientes (no completados ni cancelados)
+        'mantenimientos_pendientes': lambda: supabase.table('flota_mantenimientos').select('id', count='exact').in_('estado', ['PROGRAMADO', 'PENDIENTE', 'EN_TALLER']).is_('deleted_at', None).execute(),
+    })
+    data = {k: (r.count if r is not None and r.count is not None else 0) for k, r in res.items()}
+    completo = all(r is not None and r.count is not None for r in res.values())
+    return data, completo
+
+
 @reportes_bp.route('/kpis_resumen', methods=['GET'])
 @auth_required
 def get_kpis_resumen():
-    """Obtiene KPIs de resumen para el dashboard"""
+    """Obtiene KPIs de resumen para el dashboard (servidos desde snapshot en memoria)"""
     try:
         supabase = current_app.config.get('SUPABASE')
         if not supabase:
             return jsonify({'status': 'error', 'message': 'Error de configuración: Supabase no disponible'}), 500
 
-        # Total de vehículos activos (no eliminados)
-        vehiculos_res = supabase.table('flota_vehiculos').select('id', count='exact').is_('deleted_at', None).execute()
-        total_vehiculos = vehiculos_res.count if vehiculos_res.count is not None else 0
-
-        # Total de conductores activos (no eliminados)
-        conductores_res = supabase.table('flota_conductores').select('id', count='exact').is_('deleted_at', None).execute()
-        total_conductores = conductores_res.count if conductores_res.count is not None else 0
-
-        # Órdenes activas = todas las que NO están completadas ni canceladas
-        ordenes_res = supabase.table('flota_ordenes').select('id', count='exact').not_.in_('estado', ['completada', 'cancelada']).execute()
-        ordenes_activas = ordenes_res.count if ordenes_res.count is not None else 0
-
-        # Mantenimientos pendientes (no completados ni cancelados)
-        mantenimientos_res = supabase.table('flota_mantenimientos').select('id', count='exact').in_('estado', ['PROGRAMADO', 'PENDIENTE', 'EN_TALLER']).is_('deleted_at', None).execute()
-        mantenimientos_pendientes = mantenimientos_res.count if mantenimientos_res.count is not None else 0
+        data, cache_estado = obtener_kpis(lambda: _calcular_kpis(supabase))
 
-        return jsonify({
-            'status': 'success',
-            'data': {
-                'total_vehiculos': total_vehiculos,
-                'total_conductores': total_conductores,
-                'ordenes_activas': ordenes_activas,
-                'mantenimientos_pendientes': mantenimientos_pendientes,
-            }
-        }), 200
+        response = jsonify({'status': 'success', 'data': data})
+        response.headers['X-Cache'] = cache_estado
+        return response, 200
 
     except Exception as e:
         current_app.logger.error(f'Error en kpis_resumen: {e}')
@@ -62,16 +64,21 @@ def get_costo_mantenimiento():
             return jsonify({'status': 'error', 'message': 'Error de configuración'}), 500
 
         fecha_limite = (datetime.now() - timedelta(days=30)).date().isoformat()
-        
-        res = supabase.table('flota_mantenimientos').select('costo').gte('fecha_programada', fecha_limite).is_('deleted_at', None).execute()
-        
-        costo_total = 0
-        for m in res.data or []:
-            if m.get('costo'):
-                try:
-                    costo_total += float(m['costo'])
-                except (ValueError, TypeError):
-                    pass
+
+        # Suma en la base (migración 002); si la función no existe, se suma en Python
+        costo_total = llamar_rpc(supabase, 'flota_costo_mantenimiento', {'p_desde': fecha_limite})
+        if costo_total is not None:
+            costo_total = float(costo_total)
+        else:
+            res = supabase.table('flota_mantenimientos').select('costo').gte('fecha_programada', fecha_limite).is_('deleted_at', None).execute()
+
+            costo_total = 0
+            for m in res.data or []:
+                if m.get('costo'):
+                    try:
+                        costo_total += float(m['costo'])
+                    except (ValueError, TypeError):
+                        pass
 
         return jsonify({
             'status': 'success',
@@ -162,7 +169,7 @@ def get_licencias_por_vencer():
 @reportes_bp.route('/detalle_vehiculos', methods=['GET'])
 @auth_required
 def get_detalle_vehiculos():
-    """Obtiene listado detallado de vehículos con KM actual calculado desde órdenes"""
+    """Obtiene listado detallado de vehículos con KM actual (resumen precalculado por vehículo)"""
     try:
         supabase = current_app.config.get('SUPABASE')
         if not supabase:
@@ -175,57 +182,14 @@ def get_detalle_vehiculos():
 
         vehiculos = res_vehiculos.data or []
 
-        # 2. Obtener todos los kilometrajes de órdenes
-        res_ordenes = supabase.table('flota_ordenes').select(
-            'vehiculo_id, kilometraje_inicio, kilometraje_fin, estado'
-        ).execute()
-
-        ordenes = res_ordenes.data or []
+        # 2. KM actual y KM recorridos desde el resumen materializado por vehículo
+        resumenes = obtener_resumenes(supabase, [v.get('id') for v in vehiculos])
 
-        # 3. Calcular KM máximo por vehículo y KM total recorrido
-        km_por_vehiculo = {}
-        km_recorridos_por_vehiculo = {}
-        for orden in ordenes:
-            vehiculo_id = orden.get('vehiculo_id')
-            if not vehiculo_id:
-                continue
-            
-            km_inicio = orden.get('kilometraje_inicio')
-            km_fin = orden.get('kilometraje_fin')
-            
-            # Encontrar el valor máximo
-            valores = []
-            if km_inicio is not None:
-                try: valores.append(int(float(km_inicio)))
-                except: pass
-            if km_fin is not None:
-                try: valores.append(int(float(km_fin)))
-                except: pass
-            
-            if valores:
-                km_max = max(valores)
-                if vehiculo_id not in km_por_vehiculo:
-                    km_por_vehiculo[vehiculo_id] = km_max
-                else:
-                    km_por_vehiculo[vehiculo_id] = max(km_por_vehiculo[vehiculo_id], km_max)
-            
-            # Sum deltas
-            try:
-                if orden.get('kilometraje_inicio') is not None and orden.get('kilometraje_fin') is not None:
-                    ki_val = int(float(orden.get('kilometraje_inicio')))
-                    kf_val = int(float(orden.get('kilometraje_fin')))
-                    if kf_val > ki_val and orden.get('estado') and str(orden.get('estado')).lower() == 'completada':
-                        delta = kf_val - ki_val
-                        if delta >= 0 and delta < 100000:
-                            km_recorridos_por_vehiculo[vehiculo_id] = km_recorridos_por_vehiculo.get(vehiculo_id, 0) + delta
-            except Exception:
-                pass
-
-        # 4. Agregar KM actual y km_recorridos a cada vehículo
         for vehiculo in vehiculos:
-            vehiculo_id = vehiculo.get('id')
-            vehiculo['km_actual'] = km_por_vehiculo.get(vehiculo_id, 0)
-            vehiculo['km_recorridos'] = km_recorridos_por_vehiculo.get(vehiculo_id, 0)
+            resumen = resumenes.get(vehiculo.get('id')) or {}
+            # Odómetro de las órdenes: el km programado de una mantención no es una lectura
+            vehiculo['km_actual'] = resumen.get('km_max_ordenes', 0)
+            vehiculo['km_recorridos'] = resumen.get('km_recorridos', 0)
         
         return jsonify({
             'status': 'success',
@@ -338,6 +302,153 @@ def get_detalle_ordenes():
         return jsonify({'status': 'error', 'message': 'Error al obtener detalle de órdenes'}), 500
 
 
+def _agrupar_por_vehiculo(filas: list) -> dict:
+    """Índice {vehiculo_id: [filas]} construido en una sola pasada."""
+    grupos = {}
+    for f in filas:
+        grupos.setdefault(f.get('vehiculo_id'), []).append(f)
+    return grupos
+
+
+def _resumir_cargas(cargas: list, desde_iso: str) -> dict:
+    """Rendimiento de combustible por vehículo en una sola pasada sobre las cargas.
+
+    Retorna {vehiculo_id: {'n', 'km_min', 'km_max', 'litros', 'costo', 'costo_mes'}};
+    `costo_mes` suma solo las cargas con fecha_carga >= desde_iso.
+    """
+    resumen = {}
+    for c in cargas:
+        vid = c.get('vehiculo_id')
+        r = resumen.get(vid)
+        if r is None:
+            r = resumen[vid] = {'n': 0, 'km_min': None, 'km_max': None, 'litros': 0.0, 'costo': 0.0, 'costo_mes': 0.0}
+        km = c.get('kilometraje') or 0
+        costo = float(c.get('costo_total') or 0)
+        r['n'] += 1
+        if r['km_min'] is None or km < r['km_min']:
+            r['km_min'] = km
+        if r['km_max'] is None or km > r['km_max']:
+            r['km_max'] = km
+        r['litros'] += float(c.get('litros_cargados') or 0)
+        r['costo'] += costo
+        fecha = c.get('fecha_carga')
+        if fecha and fecha >= desde_iso:
+            r['costo_mes'] += costo
+    return resumen
+
+
+def _construir_analisis(vehiculos, cargas, documentos, mantenimientos_pendientes, resumenes, ahora=None) -> list:
+    """Arma el análisis por vehículo. Cargas, documentos y mantenimientos se
+    indexan por vehículo una sola vez, por lo que el costo es lineal en el
+    total de filas (ver scripts/bench_analisis_vehiculos.py)."""
+    ahora = ahora or datetime.now()
+    hoy = ahora.date()
+    hace_30_dias = (ahora - timedelta(days=30)).isoformat()
+
+    cargas_por_vehiculo = _resumir_cargas(cargas, hace_30_dias)
+    docs_por_vehiculo = _agrupar_por_vehiculo(documentos)
+    # Agrupar pendientes/programados por vehículo
+    mants_por_vehiculo = _agrupar_por_vehiculo(mantenimientos_pendientes)
+
+    resultado = []
+    for vehiculo in vehiculos:
+        vehiculo_id = vehiculo['id']
+
+        # -- Kilometraje Actual (Ordenes vs Mantenciones) y Última Mantención --
+        resumen = resumenes.get(vehiculo_id) or {}
+        km_actual_real = resumen.get('km_actual', 0)
+        fecha_ultima_mant = resumen.get('fecha_ultima_mant')
+        km_ultima_mant = resumen.get('km_ultima_mant', 0)
+
+        # -- Combustible (Rendimiento) --
+        # Nota: El rendimiento se sigue calculando con los datos de cargas para mantener consistencia de "litros vs km recorridos entre cargas"
+        rc = cargas_por_vehiculo.get(vehiculo_id)
+        promedio_l_km, costo_por_km = 0, 0
+        if rc and rc['n'] >= 2:
+            km_min, km_max = rc['km_min'], rc['km_max']
+            km_recorridos = (km_max - km_min) if (km_max and km_min) else 0
+            if km_recorridos > 0:
+                promedio_l_km = round(rc['litros'] / km_recorridos, 2)
+                costo_por_km = round(rc['costo'] / km_recorridos, 0)
+        total_mes = rc['costo_mes'] if rc else 0
+
+        # -- Mantenimientos Pendientes (Costos) --
+        mis_mants_pendientes = mants_por_vehiculo.get(vehiculo_id, [])
+        costo_mant_pendiente = sum(float(m.get('costo') or 0) for m in mis_mants_pendientes)
+        descripciones = []
+        for m in mis_mants_pendientes:
+            tipo = m.get('tipo_mantenimiento') or 'MANT'
+            desc = m.get('descripcion') or ''
+            if desc: descripciones.append(f"{tipo}: {desc}")
+        detalle_mant_pendiente = " | ".join(descripciones) if descripciones else "-"
+
+        # -- Documentos (Lógica Dinámica) --
+        documentos_status = {} # Aquí guardaremos lo que encontremos, sea lo que sea
+
+        for doc in docs_por_vehiculo.get(vehiculo_id, []):
+            tipo = doc.get('tipo_documento') # Ej: "SEGURO_AUTOMOTRIZ", "SOAP", etc.
+            if not tipo: continue
+
+            fecha_venc = doc.get('fecha_vencimiento')
+            if fecha_venc:
+                try:
+                    # Calcular días restantes
+                    fecha_venc_date = datetime.fromisoformat(fecha_venc.replace('Z', ''))
+                    if hasattr(fecha_venc_date, 'date'): fecha_venc_date = fecha_venc_date.date()
+                    dias_restantes = (fecha_venc_date - hoy).days
+
+                    doc_obj = {
+                        'fecha_vencimiento': fecha_venc,
+                        'dias_restantes': dias_restantes,
+                        'estado': 'VIGENTE' if dias_restantes > 30 else 'POR_VENCER' if dias_restantes > 0 else 'VENCIDO'
+                    }
+                    # LA CLAVE ES ESTA: Usamos el nombre del tipo como clave directa
+                    documentos_status[tipo] = doc_obj
+                except: continue
+
+        # -- Gases --
+        fecha_gases = vehiculo.get('fecha_vencimiento_gases')
+        tipo_combustible = vehiculo.get('tipo_combustible')
+        gases_obj = None
+        if fecha_gases:
+            try:
+                fg = datetime.strptime(fecha_gases, '%Y-%m-%d').date()
+                dias_gases = (fg - hoy).days
+                umbral = 30 if tipo_combustible == 'DIESEL' else 15
+                estado_gases = 'VENCIDO' if dias_gases < 0 else 'POR_VENCER' if dias_gases <= umbral else 'VIGENTE'
+                gases_obj = {'fecha_vencimiento': fecha_gases, 'dias_restantes': dias_gases, 'estado': estado_gases}
+            except: gases_obj = None
+
+        # -- Contar viajes/rutas completadas --
+        total_viajes = resumen.get('total_viajes', 0)
+
+        # Al armar el resultado, inyectamos el diccionario completo
+        resultado.append({
+            'id': vehiculo_id,
+            'patente': vehiculo.get('placa'),
+            'marca': vehiculo.get('marca'),
+            'modelo': vehiculo.get('modelo'),
+            'ano': vehiculo.get('ano'),
+            'tipo': vehiculo.get('tipo'),
+            'promedio_l_km': promedio_l_km,
+            'costo_por_km': costo_por_km,
+            'total_gastado_mes': round(total_mes, 0),
+
+            'ultimo_km': km_actual_real,
+            'fecha_ultima_mant': fecha_ultima_mant,
+            'km_ultima_mant': km_ultima_mant,
+            'costo_mant_pendiente': costo_mant_pendiente,
+            'detalle_mant_pendiente': detalle_mant_pendiente,
+            'total_viajes': total_viajes,
+            'tiene_rutas': total_viajes > 0,
+            'gases': gases_obj,
+
+            # CAMBIO CRÍTICO: Enviamos el paquete dinámico en lugar de campos sueltos
+            'documentos': documentos_status
+        })
+    return resultado
+
+
 @reportes_bp.route('/analisis_vehiculos', methods=['GET'])
 @auth_required
 def get_analisis_vehiculos():
@@ -354,218 +465,39 @@ def get_analisis_vehiculos():
         if not supabase:
             return jsonify({'status': 'error', 'message': 'Error de configuración'}), 500
 
-        # 1. Obtener vehículos
-        vehiculos_res = supabase.table('flota_vehiculos').select(
-            'id, placa, marca, modelo, ano, tipo, fecha_vencimiento_gases, tipo_combustible'
-        ).is_('deleted_at', None).order('placa').execute()
-        vehiculos = vehiculos_res.data or []
-        vehiculo_ids = [v['id'] for v in vehiculos]
+        # 1-4. Lecturas independientes en paralelo
+        res = ejecutar_consultas({
+            # 1. Vehículos
+            'vehiculos': lambda: supabase.table('flota_vehiculos').select(
+                'id, placa, marca, modelo, ano, tipo, fecha_vencimiento_gases, tipo_combustible'
+            ).is_('deleted_at', None).order('placa').execute(),
+            # 2. Combustible (para cálculo de rendimiento)
+            'cargas': lambda: supabase.table('flota_combustible').select(
+                'vehiculo_id, kilometraje, litros_cargados, costo_total, fecha_carga'
+            ).execute(),
+            # 3. Documentos
+            'documentos': lambda: supabase.table('flota_vehiculos_documentos').select(
+                'vehiculo_id, tipo_documento, fecha_vencimiento'
+            ).is_('deleted_at', None).execute(),
+            # 4. Mantenimientos PENDIENTES (costos y detalle)
+            'mantenimientos': lambda: supabase.table('flota_mantenimientos').select(
+                'vehiculo_id, costo, descripcion, tipo_mantenimiento, estado'
+            ).in_('estado', ['PROGRAMADO', 'PENDIENTE', 'EN_TALLER']).is_('deleted_at', None).execute(),
+        })
+        if res['vehiculos'] is None:
+            return jsonify({'status': 'error', 'message': 'Error al obtener vehículos'}), 500
 
-        # 2. Obtener combustible (para cálculo de rendimiento)
-        combustible_res = supabase.table('flota_combustible').select(
-            'vehiculo_id, kilometraje, litros_cargados, costo_total, fecha_carga'
-        ).execute()
-        cargas = combustible_res.data or []
-        
-        # 3. Obtener documentos
-        documentos_res = supabase.table('flota_vehiculos_documentos').select(
-            'vehiculo_id, tipo_documento, fecha_vencimiento'
-        ).is_('deleted_at', None).execute()
-        documentos = documentos_res.data or []
-
-        # 4. Obtener Mantenimientos (PENDIENTES y FINALIZADOS para historial)
-        # Traemos todo lo necesario para calcular costos pendientes y última mantención
-        mantenimientos_res = supabase.table('flota_mantenimientos').select(
-            'vehiculo_id, costo, descripcion, tipo_mantenimiento, estado, km_realizacion, km_programado, fecha_realizacion'
-        ).is_('deleted_at', None).execute()
-        todos_mantenimientos = mantenimientos_res.data or []
-
-        # 5. Obtener Órdenes (Max KM y contar viajes completados)
-        ordenes_res = supabase.table('flota_ordenes').select(
-            'vehiculo_id, kilometraje_fin, estado'
-        ).not_.is_('kilometraje_fin', 'null').execute()
-        todas_ordenes = ordenes_res.data or []
-
-        # --- PROCESAMIENTO EN MEMORIA (Optimización) ---
-
-        # A. Calcular Max KM Ordenes por vehículo Y contar viajes completados
-        max_km_ordenes = {}
-        viajes_completados = {}  # Para contar órdenes COMPLETADAS
-        
-        for o in todas_ordenes:
-            vid = o.get('vehiculo_id')
-            km = int(float(o.get('kilometraje_fin') or 0))
-            estado = o.get('estado', '').upper()
-            
-            # Max KM
-            if vid not in max_km_ordenes: max_km_ordenes[vid] = 0
-            if km > max_km_ordenes[vid]: max_km_ordenes[vid] = km
-            
-            # Contar viajes completados
-            if estado == 'COMPLETADA':
-                if vid not in viajes_completados: viajes_completados[vid] = 0
-                viajes_completados[vid] += 1
-
-        # B. Procesar Mantenimientos (Pendientes y Último Realizado)
-        mants_por_vehiculo = {} # Para pendientes
-        historial_mant_por_vehiculo = {} # Para última realizada
-        max_km_mant = {} # Para KM actual
-
-        for m in todos_mantenimientos:
-            vid = m.get('vehiculo_id')
-            estado = m.get('estado')
-            
-            # Agrupar pendientes/programados
-            if estado in ['PROGRAMADO', 'PENDIENTE', 'EN_TALLER']:
-                if vid not in mants_por_vehiculo: mants_por_vehiculo[vid] = []
-                mants_por_vehiculo[vid].append(m)
-            
-            # Calcular KM máximo reportado en mantenimientos
-            km_r = int(float(m.get('km_realizacion') or 0))
-            km_p = int(float(m.get('km_programado') or 0))
-            km_val = max(km_r, km_p)
-            
-            if vid not in max_km_mant: max_km_mant[vid] = 0
-            if km_val > max_km_mant[vid]: max_km_mant[vid] = km_val
+        vehiculos = res['vehiculos'].data or []
+        vehiculo_ids = [v['id'] for v in vehiculos]
+        cargas = (res['cargas'].data if res['cargas'] else None) or []
+        documentos = (res['documentos'].data if res['documentos'] else None) or []
+        mantenimientos_pendientes = (res['mantenimientos'].data if res['mantenimientos'] else None) or []
 
-            # Buscar última mantención FINALIZADA
-            if estado == 'FINALIZADO':
-                if vid not in historial_mant_por_vehiculo:
-                    historial_mant_por_vehiculo[vid] = {'fecha': '1900-01-01', 'km': 0}
-                
-                fecha_m = m.get('fecha_realizacion') or '1900-01-01'
-                # Comparamos fechas strings ISO (funciona bien YYYY-MM-DD)
-                if fecha_m > historial_mant_por_vehiculo[vid]['fecha']:
-                    historial_mant_por_vehiculo[vid] = {
-                        'fecha': fecha_m,
-                        'km': km_val
-                    }
+        # 5. KM actual, última mantención y viajes desde el resumen materializado
+        resumenes = obtener_resumenes(supabase, vehiculo_ids)
 
-        # 6. Construir resultado final
-        hoy = datetime.now().date()
-        resultado = []
-        
-        import re
-        def _normalize_tipo(t):
-            if not t: return ''
-            s = str(t).strip().lower()
-            s = re.sub(r"[\s_\-]+", '', s)
-            s = re.sub(r"[^a-z0-9]+", '', s)
-            return s
+        resultado = _construir_analisis(vehiculos, cargas, documentos, mantenimientos_pendientes, resumenes)
 
-        for vehiculo in vehiculos:
-            vehiculo_id = vehiculo['id']
-            
-            # -- Cálculo Kilometraje Actual Robusto --
-            km_ord = max_km_ordenes.get(vehiculo_id, 0)
-            km_man = max_km_mant.get(vehiculo_id, 0)
-            km_actual_real = max(km_ord, km_man)
-
-            # -- Datos Última Mantención --
-            last_mant = historial_mant_por_vehiculo.get(vehiculo_id, None)
-            fecha_ultima_mant = last_mant['fecha'] if last_mant and last_mant['fecha'] != '1900-01-01' else None
-            km_ultima_mant = last_mant['km'] if last_mant else 0
-
-            # -- Combustible (Rendimiento) --
-            # Nota: El rendimiento se sigue calculando con los datos de cargas para mantener consistencia de "litros vs km recorridos entre cargas"
-            cargas_vehiculo = [c for c in cargas if c.get('vehiculo_id') == vehiculo_id]
-            if len(cargas_vehiculo) >= 2:
-                cargas_ordenadas = sorted(cargas_vehiculo, key=lambda x: x.get('kilometraje', 0))
-                km_min = cargas_ordenadas[0].get('kilometraje', 0) or 0
-                km_max = cargas_ordenadas[-1].get('kilometraje', 0) or 0
-                km_recorridos = (km_max - km_min) if (km_max and km_min) else 0
-                
-                total_litros = sum(float(c.get('litros_cargados') or 0) for c in cargas_vehiculo)
-                total_costo = sum(float(c.get('costo_total') or 0) for c in cargas_vehiculo)
-                
-                if km_recorridos > 0:
-                    promedio_l_km = round(total_litros / km_recorridos, 2)
-                    costo_por_km = round(total_costo / km_recorridos, 0)
-                else:
-                    promedio_l_km, costo_por_km = 0, 0
-            else:
-                promedio_l_km, costo_por_km = 0, 0
-            
-            hace_30_dias = (datetime.now() - timedelta(days=30)).isoformat()
-            cargas_mes = [c for c in cargas_vehiculo if c.get('fecha_carga', '') and c.get('fecha_carga') >= hace_30_dias]
-            total_mes = sum(float(c.get('costo_total') or 0) for c in cargas_mes)
-
-            # -- Mantenimientos Pendientes (Costos) --
-            mis_mants_pendientes = mants_por_vehiculo.get(vehiculo_id, [])
-            costo_mant_pendiente = sum(float(m.get('costo') or 0) for m in mis_mants_pendientes)
-            descripciones = []
-            for m in mis_mants_pendientes:
-                tipo = m.get('tipo_mantenimiento') or 'MANT'
-                desc = m.get('descripcion') or ''
-                if desc: descripciones.append(f"{tipo}: {desc}")
-            detalle_mant_pendiente = " | ".join(descripciones) if descripciones else "-"
-            
-            # -- Documentos (Lógica Dinámica) --
-            docs_vehiculo = [d for d in documentos if d.get('vehiculo_id') == vehiculo_id]
-            documentos_status = {} # Aquí guardaremos lo que encontremos, sea lo que sea
-            
-            for doc in docs_vehiculo:
-                tipo = doc.get('tipo_documento') # Ej: "SEGURO_AUTOMOTRIZ", "SOAP", etc.
-                if not tipo: continue
-                
-                fecha_venc = doc.get('fecha_vencimiento')
-                if fecha_venc:
-                    try:
-                        # Calcular días restantes
-                        fecha_venc_date = datetime.fromisoformat(fecha_venc.replace('Z', ''))
-                        if hasattr(fecha_venc_date, 'date'): fecha_venc_date = fecha_venc_date.date()
-                        dias_restantes = (fecha_venc_date - hoy).days
-                        
-                        doc_obj = {
-                            'fecha_vencimiento': fecha_venc,
-                            'dias_restantes': dias_restantes,
-                            'estado': 'VIGENTE' if dias_restantes > 30 else 'POR_VENCER' if dias_restantes > 0 else 'VENCIDO'
-                        }
-                        # LA CLAVE ES ESTA: Usamos el nombre del tipo como clave directa
-                        documentos_status[tipo] = doc_obj
-                    except: continue
-
-            # -- Gases --
-            fecha_gases = vehiculo.get('fecha_vencimiento_gases')
-            tipo_combustible = vehiculo.get('tipo_combustible')
-            gases_obj = None
-            if fecha_gases:
-                try:
-                    fg = datetime.strptime(fecha_gases, '%Y-%m-%d').date()
-                    dias_gases = (fg - hoy).days
-                    umbral = 30 if tipo_combustible == 'DIESEL' else 15
-                    estado_gases = 'VENCIDO' if dias_gases < 0 else 'POR_VENCER' if dias_gases <= umbral else 'VIGENTE'
-                    gases_obj = {'fecha_vencimiento': fecha_gases, 'dias_restantes': dias_gases, 'estado': estado_gases}
-                except: gases_obj = None
-            
-            # -- Contar viajes/rutas completadas --
-            total_viajes = viajes_completados.get(vehiculo_id, 0)
-            
-            # Al armar el resultado, inyectamos el diccionario completo
-            resultado.append({
-                'id': vehiculo_id,
-                'patente': vehiculo.get('placa'),
-                'marca': vehiculo.get('marca'),
-                'modelo': vehiculo.get('modelo'),
-                'ano': vehiculo.get('ano'),
-                'tipo': vehiculo.get('tipo'),
-                'promedio_l_km': promedio_l_km,
-                'costo_por_km': costo_por_km,
-                'total_gastado_mes': round(total_mes, 0),
-                
-                'ultimo_km': km_actual_real,
-                'fecha_ultima_mant': fecha_ultima_mant,
-                'km_ultima_mant': km_ultima_mant,
-                'costo_mant_pendiente': costo_mant_pendiente,
-                'detalle_mant_pendiente': detalle_mant_pendiente,
-                'total_viajes': total_viajes,
-                'tiene_rutas': total_viajes > 0,
-                'gases': gases_obj,
-                
-                # CAMBIO CRÍTICO: Enviamos el paquete dinámico en lugar de campos sueltos
-                'documentos': documentos_status 
-            })
-        
         return jsonify({'status': 'success', 'data': resultado}), 200
         
     except Exception as e:
@@ -573,6 +505,50 @@ def get_analisis_vehiculos():
         return jsonify({'status': 'error', 'message': f'Error: {str(e)}'}), 500
 
 
+def _pivot_gastos(conceptos: list, gastos: list):
+    """Acumula costos por patente y concepto en slots de arreglo.
+
+    El concepto se resuelve con un índice {concepto_id: columna}; los gastos sin
+    concepto conocido van a 'Otros'. Retorna (columnas, filas, totales, patentes),
+    con filas[i][j] = total de patentes[i] en columnas[j].
+    """
+    columnas = []
+    col_por_nombre = {}
+    for c in conceptos:
+        nombre = c['nombre']
+        if nombre not in col_por_nombre:
+            col_por_nombre[nombre] = len(columnas)
+            columnas.append(nombre)
+    if 'Otros' not in col_por_nombre:
+        col_por_nombre['Otros'] = len(columnas)
+        columnas.append('Otros')
+    col_por_concepto = {c['id']: col_por_nombre[c['nombre']] for c in conceptos}
+    col_otros = col_por_nombre['Otros']
+    n_cols = len(columnas)
+
+    fila_por_placa = {}
+    patentes, filas, totales = [], [], []
+    for gasto in gastos:
+        placa = (gasto.get('vehiculo') or {}).get('placa', 'Sin Placa')
+        try:
+            costo = float(gasto.get('costo') or 0)
+        except (ValueError, TypeError):
+            costo = 0
+
+        i = fila_por_placa.get(placa)
+        if i is None:
+            i = fila_por_placa[placa] = len(patentes)
+            patentes.append(placa)
+            filas.append([0] * n_cols)
+            totales.append(0)
+
+        # Si es antiguo (no tiene concepto_id), lo mandamos a 'Otros'
+        filas[i][col_por_concepto.get(gasto.get('concepto_id'), col_otros)] += costo
+        totales[i] += costo
+
+    return columnas, filas, totales, patentes
+
+
 @reportes_bp.route('/gastos_pivot', methods=['GET'])
 @auth_required
 def get_gastos_pivot():
@@ -604,42 +580,22 @@ def get_gastos_pivot():
         gastos = gastos_res.data or []
 
         # 3. Procesar Pivote
-        reporte = {} # Clave: Placa, Valor: {concepto_nom: total, ...}
-        
-        # Inicializar estructura
-        columnas = [c['nombre'] for c in conceptos]
-        if 'Otros' not in columnas:
-            columnas.append('Otros')
-
-        for g in gastos:
-            placa = g.get('vehiculo', {}).get('placa', 'Sin Placa')
-            try:
-                costo = float(g.get('costo') or 0)
-            except (ValueError, TypeError):
-                costo = 0
-            cid = g.get('concepto_id')
-            
-            if placa not in reporte:
-                reporte[placa] = {col: 0 for col in columnas}
-                reporte[placa]['TOTAL'] = 0
-            
-            # Buscar nombre del concepto
-            c_nombre = next((c['nombre'] for c in conceptos if c['id'] == cid), None)
-            
-            if c_nombre:
-                if c_nombre not in reporte[placa]:
-                    reporte[placa][c_nombre] = 0
-                reporte[placa][c_nombre] += costo
-            else:
-                # Si es antiguo (no tiene concepto_id), lo mandamos a 'Otros' o 'Sin Clasificar'
-                reporte[placa]['Otros'] = reporte[placa].get('Otros', 0) + costo
-                
-            reporte[placa]['TOTAL'] += costo
+        columnas, filas, totales, patentes = _pivot_gastos(conceptos, gastos)
+
+        if request.args.get('modo') == 'columnar':
+            # Una fila por patente alineada con `columnas` (sin repetir nombres de concepto)
+            return jsonify({
+                'status': 'success',
+                'modo': 'columnar',
+                'columnas': columnas,
+                'data': {'patentes': patentes, 'filas': filas, 'totales': totales}
+            })
 
         # Convertir a lista para el JSON
         data_final = []
-        for placa, valores in reporte.items():
-            valores_out = {k: v for k, v in valores.items()}
+        for placa, fila, total in zip(patentes, filas, totales):
+            valores_out = dict(zip(columnas, fila))
+            valores_out['TOTAL'] = total
             valores_out['patente'] = placa
             data_final.append(valores_out)
 
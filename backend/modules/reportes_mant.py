@@ -6,17 +6,21 @@ from flask import Blueprint, jsonify, current_app, request
 auth_required = None
 try:
     from ..utils.auth import auth_required
+    from ..utils.rpc import llamar_rpc
 except (ImportError, ValueError):
     try:
         from backend.utils.auth import auth_required
+        from backend.utils.rpc import llamar_rpc
     except ImportError:
         try:
             from utils.auth import auth_required
+            from utils.rpc import llamar_rpc
         except ImportError:
             pass
 
 if not auth_required:
     def auth_required(f): return f
+    def llamar_rpc(supabase, nombre, params=None): return None
 
 reportes_mant_bp = Blueprint('reportes_mant', __name__)
 
@@ -30,16 +34,27 @@ def get_dashboard_mantenimiento():
         fecha_ini = request.args.get('fecha_inicio')
         fecha_fin = request.args.get('fecha_fin')
         
+        estados_cerrados = ['FINALIZADO', 'CANCELADO', 'Finalizado', 'Cancelado']
+
+        # 0. GASTO DEL PERÍODO AGREGADO EN LA BASE (si la función existe)
+        periodo = None
+        if fecha_ini and fecha_fin:
+            periodo = llamar_rpc(supabase, 'flota_dashboard_mant_periodo', {'p_fecha_ini': fecha_ini, 'p_fecha_fin': fecha_fin})
+        # Sin período que calcular en Python basta con las órdenes activas
+        calcular_periodo = bool(fecha_ini and fecha_fin) and periodo is None
+
         # 1. TRAER VEHÍCULOS (Para tener patentes)
         res_veh = supabase.table('flota_vehiculos').select('id, placa, marca, modelo').execute()
         vehiculos_map = {v['id']: v for v in (res_veh.data or [])}
         
         # 2. TRAER MANTENIMIENTOS (Solo la cabecera)
-        res_mant = supabase.table('flota_mantenimientos')\
+        query_mant = supabase.table('flota_mantenimientos')\
             .select('*')\
-            .is_('deleted_at', None)\
-            .order('fecha_programada', desc=True)\
-            .execute()
+            .is_('deleted_at', None)
+        if not calcular_periodo:
+            # `not in` de SQL descarta estado NULL; en Python esas órdenes cuentan como activas
+            query_mant = query_mant.or_(f"estado.is.null,estado.not.in.({','.join(estados_cerrados)})")
+        res_mant = query_mant.order('fecha_programada', desc=True).execute()
         mantenimientos = res_mant.data or []
         
         # Crear un mapa de IDs de mantenimiento para filtrar detalles
@@ -72,7 +87,6 @@ def get_dashboard_mantenimiento():
         por_categoria = {}
         por_vehiculo = {}
         items_historicos_count = 0
-        estados_cerrados = ['FINALIZADO', 'CANCELADO', 'Finalizado', 'Cancelado']
 
         for m in mantenimientos:
             # A) Pegar Vehículo
@@ -98,7 +112,7 @@ def get_dashboard_mantenimiento():
 
             # E) Clasificar Históricos (Gráficas)
             f_prog = m.get('fecha_programada', '')
-            if f_prog and fecha_ini and fecha_fin and (fecha_ini <= f_prog <= fecha_fin):
+            if calcular_periodo and f_prog and (fecha_ini <= f_prog <= fecha_fin):
                 total_gasto_periodo += costo_real
                 items_historicos_count += 1
                 
@@ -107,7 +121,9 @@ def get_dashboard_mantenimiento():
                 
                 if mis_detalles:
                     for d in mis_detalles:
-                        cat = d.get('concepto', {}).get('categoria', {}).get('nombre', 'General')
+                        # Detalle sin concepto o concepto sin categoría: 'General', como en la función SQL
+                        categoria = ((d.get('concepto') or {}).get('categoria') or {})
+                        cat = categoria.get('nombre') or 'General'
                         val = float(d.get('costo', 0) or 0)
                         por_categoria[cat] = por_categoria.get(cat, 0) + val
                 else:
@@ -116,11 +132,17 @@ def get_dashboard_mantenimiento():
         # 5. RETORNAR
         total_pendiente = sum([m['costo'] for m in activos])
         
-        categorias_list = [{'name': k, 'value': v} for k, v in por_categoria.items()]
-        categorias_list.sort(key=lambda x: x['value'], reverse=True)
-        
-        vehiculos_list = [{'name': k, 'value': v} for k, v in por_vehiculo.items()]
-        vehiculos_list.sort(key=lambda x: x['value'], reverse=True)
+        if periodo is not None:
+            total_gasto_periodo = float(periodo.get('total_gasto_periodo') or 0)
+            items_historicos_count = int(periodo.get('total_items_periodo') or 0)
+            categorias_list = [{'name': c['name'], 'value': float(c['value'] or 0)} for c in periodo.get('por_categoria') or []]
+            vehiculos_list = [{'name': v['name'], 'value': float(v['value'] or 0)} for v in periodo.get('por_vehiculo') or []]
+        else:
+            categorias_list = [{'name': k, 'value': v} for k, v in por_categoria.items()]
+            categorias_list.sort(key=lambda x: x['value'], reverse=True)
+
+            vehiculos_list = [{'name': k, 'value': v} for k, v in por_vehiculo.items()]
+            vehiculos_list.sort(key=lambda x: x['value'], reverse=True)
 
         return jsonify({
             'kpis': {
@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify, current_app, g
 from werkzeug.security import generate_password_hash
-from ..utils.auth import auth_required, _is_admin
+from ..utils.auth import auth_required, _is_admin, invalidate_user_cache
 import re
 
 bp = Blueprint('usuarios', __name__)
@@ -210,6 +210,7 @@ def update_usuario(usuario_id):
             return jsonify({'message': 'No hay cambios para actualizar'}), 400
 
         response = supabase.table('flota_usuarios').update(updates).eq('id', usuario_id).execute()
+        invalidate_user_cache(user_id=usuario_id)
 
         if not response.data:
             return jsonify({'message': 'Error al actualizar usuario'}), 500
@@ -257,6 +258,7 @@ def delete_usuario(usuario_id):
 
         # Eliminar
         supabase.table('flota_usuarios').delete().eq('id', usuario_id).execute()
+        invalidate_user_cache(user_id=usuario_id)
 
         return jsonify({'message': 'Usuario eliminado exitosamente'}), 200
 
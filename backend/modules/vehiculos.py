@@ -1,7 +1,11 @@
 from flask import Blueprint, request, jsonify, current_app, g
-from ..utils.auth import authenticate, generate_token, auth_required, _has_write_permission, _is_admin
-from datetime import datetime, timedelta
-import numbers
+from ..utils.auth import auth_required, _has_write_permission, _is_admin
+from ..utils.vehiculo_estado import obtener_resumenes, estado_mantencion
+from ..utils.query_batch import ejecutar_consultas
+from ..utils.kpi_snapshot import invalidar_kpis
+from ..utils.paginacion import preparar_pagina, cerrar_pagina, modo_conteo
+from ..utils.storage import agregar_urls_adjuntos, pide_firmas
+from datetime import datetime
 
 try:
     from postgrest.exceptions import APIError as PostgrestAPIError
@@ -59,7 +63,7 @@ def _safe_date(value):
 @bp.route('/', methods=['GET'])
 @auth_required
 def list_vehiculos():
-    """Listar vehículos con cálculo optimizado de alertas (Solo 3 consultas a DB)."""
+    """Listar vehículos con alertas de mantención (estado precalculado por vehículo)."""
     supabase = current_app.config.get('SUPABASE')
     if not supabase:
         return jsonify({'message': 'Error de configuración: Supabase no disponible'}), 500
@@ -72,138 +76,49 @@ def list_vehiculos():
         return jsonify({'message': 'Parámetros de paginación inválidos'}), 400
 
     tipo = request.args.get('tipo')
-    start = (page - 1) * per_page
-    end = start + per_page - 1
+    cursor = request.args.get('cursor')
+    orden = [('id', False)]
+    try:
+        conteo = modo_conteo(request.args.get('count'), cursor)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    # 1. Obtener Vehículos (Consulta 1)
-    query = supabase.table('flota_vehiculos').select('*')
+    # 1. Obtener Vehículos; el total (si se pide) viene en la misma respuesta y respeta los filtros
+    query = supabase.table('flota_vehiculos').select('*', count=conteo)
     if q:
         like_q = f'%{q}%'
         query = query.or_(f"placa.ilike.{like_q},marca.ilike.{like_q},modelo.ilike.{like_q}")
     if tipo:
         query = query.eq('tipo', tipo)
 
-    query = query.is_('deleted_at', None).order('id', desc=False)
+    query = query.is_('deleted_at', None)
+    try:
+        query = preparar_pagina(query, orden, page, per_page, cursor)
+    except ValueError:
+        return jsonify({'message': 'Cursor de paginación inválido'}), 400
 
     try:
-        res = query.range(start, end).execute()
-        data = res.data or []
+        res = query.execute()
     except Exception as e:
         current_app.logger.error(f"Error al listar vehículos: {e}")
         return jsonify({'message': 'Error en la base de datos al obtener listado'}), 500
+    data, next_cursor = cerrar_pagina(res.data or [], orden, per_page)
+    total = res.count
 
     if not data:
-        return jsonify({'data': [], 'meta': {'page': page, 'per_page': per_page, 'total': 0}})
+        return jsonify({'data': [], 'meta': {'page': page, 'per_page': per_page, 'total': total, 'next_cursor': None}})
 
-    # --- OPTIMIZACIÓN: Carga masiva de datos relacionados ---
-    # Extraemos los IDs de los vehículos que se van a mostrar en esta página
+    # --- Estado de odómetro / mantención precalculado (flota_vehiculos_resumen) ---
     vehiculo_ids = [v['id'] for v in data]
+    try:
+        resumenes = obtener_resumenes(supabase, vehiculo_ids)
+    except Exception as e:
+        current_app.logger.warning(f"No se pudo obtener resumen de vehículos: {e}")
+        resumenes = {}
 
-    # 2. Obtener Órdenes RELEVANTES (Consulta 2)
-    # Traemos solo kilometraje_fin de órdenes completadas para estos vehículos
-    ordenes_data = []
-    if vehiculo_ids:
-        try:
-            o_res = supabase.table('flota_ordenes').select('vehiculo_id, kilometraje_fin') \
-                .in_('vehiculo_id', vehiculo_ids) \
-                .not_.is_('kilometraje_fin', 'null') \
-                .execute()
-            ordenes_data = o_res.data or []
-        except: pass
-
-    # 3. Obtener Mantenimientos RELEVANTES (Consulta 3)
-    # Traemos estado y KMs de mantenimientos para estos vehículos
-    mants_data = []
-    if vehiculo_ids:
-        try:
-            m_res = supabase.table('flota_mantenimientos').select('vehiculo_id, estado, km_realizacion, km_programado') \
-                .in_('vehiculo_id', vehiculo_ids) \
-                .is_('deleted_at', None) \
-                .execute()
-            mants_data = m_res.data or []
-        except: pass
-
-    # --- PROCESAMIENTO EN MEMORIA (Mucho más rápido) ---
-    
-    # Agrupamos órdenes por vehículo
-    ordenes_por_vehiculo = {}
-    for o in ordenes_data:
-        vid = o['vehiculo_id']
-        km = int(float(o.get('kilometraje_fin') or 0))
-        if vid not in ordenes_por_vehiculo:
-            ordenes_por_vehiculo[vid] = 0
-        if km > ordenes_por_vehiculo[vid]:
-            ordenes_por_vehiculo[vid] = km
-
-    # Agrupamos mantenimientos por vehículo
-    mants_por_vehiculo = {}
-    for m in mants_data:
-        vid = m['vehiculo_id']
-        if vid not in mants_por_vehiculo:
-            mants_por_vehiculo[vid] = []
-        mants_por_vehiculo[vid].append(m)
-
-    # Calculamos para cada vehículo
     for v in data:
-        veh_id = v['id']
-        
-        # Intervalo (default 10000)
-        km_intervalo = v.get('km_intervalo_mantencion') or 10000
-        
-        # A) Obtener Máximo KM de Órdenes
-        max_order_km = ordenes_por_vehiculo.get(veh_id, 0)
-
-        # B) Obtener datos desde Mantenimientos (Con tu nueva lógica)
-        max_mant_km = 0        # Para el KM Actual del vehículo
-        km_ultima_mant = 0     # Base para la próxima mantención (Solo FINALIZADOS)
-        
-        mis_mants = mants_por_vehiculo.get(veh_id, [])
-        
-        for m in mis_mants:
-            k_real = m.get('km_realizacion')
-            k_prog = m.get('km_programado')
-            
-            # Convertir a enteros seguros
-            val_real = int(float(k_real)) if k_real else 0
-            val_prog = int(float(k_prog)) if k_prog else 0
-            
-            # LÓGICA SOLICITADA:
-            # "Si KM Realización es menor al KM Programado, quedarse con KM Programado"
-            # Básicamente tomamos el mayor de los dos para ser seguros.
-            val_computado = max(val_real, val_prog)
-
-            # 1. Para determinar el KM ACTUAL del vehículo (Odómetro),
-            # consideramos cualquier mantenimiento que reporte kilometraje.
-            if val_computado > max_mant_km:
-                max_mant_km = val_computado
-            
-            # 2. Para determinar la ÚLTIMA MANTENCIÓN VÁLIDA (Reset del intervalo),
-            # solo consideramos los FINALIZADOS.
-            if m.get('estado') == 'FINALIZADO':
-                # Aquí también aplicamos la lógica: si se cerró con menos km del programado, 
-                # asumimos que cubrió el hito programado.
-                if val_computado > km_ultima_mant:
-                    km_ultima_mant = val_computado
-
-        # Definir KM Actual final (El mayor entre Órdenes y Mantenimientos)
-        km_actual = max(max_order_km, max_mant_km)
-        
-        # Cálculos finales
-        km_proxima = km_ultima_mant + km_intervalo
-        restante = km_proxima - km_actual
-        
-        v['km_actual_calculado'] = km_actual
-        v['km_ultima_mant'] = km_ultima_mant
-        v['mant_proxima_km'] = km_proxima
-        v['mant_restante_km'] = restante
-        
-        # Estado de Alerta (mantenimiento por km)
-        if restante < 0:
-            v['mant_estado'] = 'VENCIDO'
-        elif restante <= 700:
-            v['mant_estado'] = 'POR_VENCER'
-        else:
-            v['mant_estado'] = 'OK'
+        # Estado de Alerta (mantenimiento por km, intervalo default 10000)
+        v.update(estado_mantencion(resumenes.get(v['id']), v.get('km_intervalo_mantencion')))
 
         # --- NUEVO: CÁLCULO ALERTA GASES ---
         v['gases_estado'] = 'SIN_DATO'
@@ -234,20 +149,14 @@ def list_vehiculos():
                 pass
         # -----------------------------------
 
-    # Obtener total para paginación (Puede ser aproximado para velocidad, o count exacto)
-    try:
-        count_res = supabase.table('flota_vehiculos').select('id', count='exact').is_('deleted_at', None).execute()
-        total = count_res.count if hasattr(count_res, 'count') and count_res.count is not None else len(data)
-    except:
-        total = len(data)
-
     return jsonify({
         'data': data, 
         'meta': {
             'page': page, 
             'per_page': per_page, 
             'total': total, 
-            'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total is not None else None
+            'pages': (total // per_page) + (1 if total % per_page > 0 else 0) if total is not None else None,
+            'next_cursor': next_cursor
         }
     })
 
@@ -265,41 +174,13 @@ def get_vehiculo(veh_id):
             return jsonify({'message': f'Vehículo con ID {veh_id} no encontrado o ha sido eliminado'}), 404
 
         vehicle = rows[0]
-        # Compute km_actual: maximum of kilometraje_inicio and kilometraje_fin from orders for this vehicle
+        # km_actual / km_recorridos desde el resumen materializado del vehículo
         try:
-            orders_res = supabase.table('flota_ordenes').select('kilometraje_inicio, kilometraje_fin, estado').eq('vehiculo_id', veh_id).execute()
-            orders = orders_res.data or []
-            km_values = []
-            km_traveled_sum = 0
-            for o in orders:
-                ki = o.get('kilometraje_inicio')
-                kf = o.get('kilometraje_fin')
-                # Build candidate values for max odometer
-                for v in (ki, kf):
-                    if v is not None and v != '':
-                        try:
-                            km_values.append(int(float(v)))
-                        except Exception:
-                            pass
-
-                # Accumulate traveled distance only when both values are present and sensible
-                try:
-                    if o.get('estado') and str(o.get('estado')).lower() == 'completada' and ki is not None and kf is not None:
-                        ki_val = int(float(ki)) if ki != '' else None
-                        kf_val = int(float(kf)) if kf != '' else None
-                        if ki_val is not None and kf_val is not None and kf_val > ki_val:
-                            delta = kf_val - ki_val
-                            # Sanity: ignore unrealistically large deltas (e.g., > 10000km) to avoid data errors
-                            if delta >= 0 and delta < 100000:
-                                km_traveled_sum += delta
-                except Exception:
-                    # ignore any conversion errors
-                    pass
-
-            # km_actual: maximum known odometer reading, fallback to existing vehicle value or 0
-            vehicle['km_actual'] = max(km_values) if km_values else (vehicle.get('km_actual') or 0)
+            resumen = obtener_resumenes(supabase, [veh_id]).get(veh_id) or {}
+            # km_actual: maximum odometer reading from orders (not maintenance targets), fallback to existing vehicle value or 0
+            vehicle['km_actual'] = resumen.get('km_max_ordenes') or vehicle.get('km_actual') or 0
             # km_recorridos: total distance recorded in completed orders
-            vehicle['km_recorridos'] = km_traveled_sum
+            vehicle['km_recorridos'] = resumen.get('km_recorridos') or 0
         except Exception as e:
             current_app.logger.warning(f"No se pudo calcular km_actual para vehiculo {veh_id}: {e}")
             # Ensure km_actual field exists
@@ -355,6 +236,7 @@ def create_vehiculo():
 
     try:
         res = supabase.table('flota_vehiculos').insert(row).execute()
+        invalidar_kpis()
         return jsonify({'data': res.data[0]}), 201
     except PostgrestAPIError as e:
         current_app.logger.error(f"Error Supabase (POST): {e}")
@@ -514,17 +396,8 @@ def get_vehiculo_viajes(veh_id):
         if orden_ids:
             try:
                 adj_res = supabase.table('flota_orden_adjuntos').select('id, orden_id, storage_path, nombre_archivo, mime_type, created_at').in_('orden_id', orden_ids).order('created_at', desc=True).execute()
-                for a in adj_res.data or []:
+                for a in agregar_urls_adjuntos(supabase, adj_res.data or [], pide_firmas(request.args)):
                     oid = a.get('orden_id')
-                    # Añadir publicUrl si es posible
-                    try:
-                        sp = a.get('storage_path')
-                        if sp:
-                            public = supabase.storage.from_('adjuntos_ordenes').get_public_url(sp)
-                            url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None)
-                            a['publicUrl'] = url
-                    except Exception:
-                        a['publicUrl'] = None
                     if oid:
                         adjuntos_by_orden.setdefault(oid, []).append(a)
             except Exception as e:
@@ -600,6 +473,7 @@ def delete_vehiculo(veh_id):
         res = supabase.table('flota_vehiculos').update({'deleted_at': datetime.now().isoformat()}).eq('id', veh_id).execute()
         
         if res.data:
+            invalidar_kpis()
             return jsonify({'message': f'Vehículo {veh_id} marcado como eliminado (soft-delete).'}), 200
         return jsonify({'message': 'Vehículo no encontrado para eliminar'}), 404
         
@@ -837,99 +711,55 @@ def list_vehiculo_adjuntos(veh_id):
     try:
         all_adjuntos = []
 
-        # 1) Adjuntos de documentos del vehículo
-        try:
-            docs_res = supabase.table('flota_vehiculos_documentos').select('id').eq('vehiculo_id', veh_id).is_('deleted_at', None).execute()
-            doc_ids = [d['id'] for d in (docs_res.data or []) if d.get('id')]
-        except Exception:
-            doc_ids = []
-
-        if doc_ids:
-            try:
-                res_docs_adj = supabase.table('flota_vehiculo_doc_adjuntos').select('id, created_at, nombre_archivo, storage_path, mime_type, documento_id').in_('documento_id', doc_ids).order('created_at', desc=True).execute()
-                for item in res_docs_adj.data or []:
-                    # Add public URL
-                    try:
-                        sp = item.get('storage_path')
-                        public = supabase.storage.from_('adjuntos_ordenes').get_public_url(sp) if sp else None
-                        url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None) if public else None
-                    except Exception:
-                        url = None
-                    all_adjuntos.append({
-                        'id': item.get('id'),
-                        'created_at': item.get('created_at'),
-                        'nombre_archivo': item.get('nombre_archivo'),
-                        'storage_path': item.get('storage_path'),
-                        'mime_type': item.get('mime_type'),
-                        'publicUrl': url,
-                        'tipo_entidad': 'Documento Vehicular',
-                        'entidad_id': item.get('documento_id')
-                    })
-            except Exception:
-                current_app.logger.warning('No se pudieron obtener adjuntos de documentos del vehículo')
-
-        # 2) Adjuntos de órdenes donde la orden pertenece al vehículo
-        try:
-            ordenes_res = supabase.table('flota_ordenes').select('id').eq('vehiculo_id', veh_id).execute()
-            orden_ids = [o['id'] for o in (ordenes_res.data or []) if o.get('id')]
-        except Exception:
-            orden_ids = []
-
-        if orden_ids:
-            try:
-                res_ord_adj = supabase.table('flota_orden_adjuntos').select('id, created_at, nombre_archivo, storage_path, mime_type, orden_id').in_('orden_id', orden_ids).order('created_at', desc=True).execute()
-                for item in res_ord_adj.data or []:
-                    try:
-                        sp = item.get('storage_path')
-                        public = supabase.storage.from_('adjuntos_ordenes').get_public_url(sp) if sp else None
-                        url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None) if public else None
-                    except Exception:
-                        url = None
-                    all_adjuntos.append({
-                        'id': item.get('id'),
-                        'created_at': item.get('created_at'),
-                        'nombre_archivo': item.get('nombre_archivo'),
-                        'storage_path': item.get('storage_path'),
-                        'mime_type': item.get('mime_type'),
-                        'publicUrl': url,
-                        'tipo_entidad': 'Orden de Servicio',
-                        'entidad_id': item.get('orden_id')
-                    })
-            except Exception:
-                current_app.logger.warning('No se pudieron obtener adjuntos de órdenes para el vehículo')
-
-        # 3) Adjuntos de mantenimientos para el vehículo
-        try:
-            mant_res = supabase.table('flota_mantenimientos').select('id').eq('vehiculo_id', veh_id).execute()
-            mant_ids = [m['id'] for m in (mant_res.data or []) if m.get('id')]
-        except Exception:
-            mant_ids = []
+        # Fase 1: IDs de documentos, órdenes y mantenimientos del vehículo (en paralelo)
+        ids_res = ejecutar_consultas({
+            'docs': lambda: supabase.table('flota_vehiculos_documentos').select('id').eq('vehiculo_id', veh_id).is_('deleted_at', None).execute(),
+            'ordenes': lambda: supabase.table('flota_ordenes').select('id').eq('vehiculo_id', veh_id).execute(),
+            'mants': lambda: supabase.table('flota_mantenimientos').select('id').eq('vehiculo_id', veh_id).execute(),
+        })
+        doc_ids = [d['id'] for d in (ids_res['docs'].data if ids_res['docs'] else None) or [] if d.get('id')]
+        orden_ids = [o['id'] for o in (ids_res['ordenes'].data if ids_res['ordenes'] else None) or [] if o.get('id')]
+        mant_ids = [m['id'] for m in (ids_res['mants'].data if ids_res['mants'] else None) or [] if m.get('id')]
+
+        # Fase 2: adjuntos de cada origen (en paralelo)
+        # (tabla, columna entidad, ids, tipo_entidad)
+        fuentes = {
+            'docs': ('flota_vehiculo_doc_adjuntos', 'documento_id', doc_ids, 'Documento Vehicular'),
+            'ordenes': ('flota_orden_adjuntos', 'orden_id', orden_ids, 'Orden de Servicio'),
+            'mants': ('flota_mantenimiento_adjuntos', 'mantenimiento_id', mant_ids, 'Mantenimiento'),
+        }
 
-        if mant_ids:
-            try:
-                res_mant_adj = supabase.table('flota_mantenimiento_adjuntos').select('id, created_at, nombre_archivo, storage_path, mime_type, mantenimiento_id').in_('mantenimiento_id', mant_ids).order('created_at', desc=True).execute()
-                for item in res_mant_adj.data or []:
-                    try:
-                        sp = item.get('storage_path')
-                        public = supabase.storage.from_('adjuntos_ordenes').get_public_url(sp) if sp else None
-                        url = public.get('data', {}).get('publicUrl') if isinstance(public, dict) else getattr(public, 'publicUrl', None) if public else None
-                    except Exception:
-                        url = None
-                    all_adjuntos.append({
-                        'id': item.get('id'),
-                        'created_at': item.get('created_at'),
-                        'nombre_archivo': item.get('nombre_archivo'),
-                        'storage_path': item.get('storage_path'),
-                        'mime_type': item.get('mime_type'),
-                        'publicUrl': url,
-                        'tipo_entidad': 'Mantenimiento',
-                        'entidad_id': item.get('mantenimiento_id')
-                    })
-            except Exception:
-                current_app.logger.warning('No se pudieron obtener adjuntos de mantenimientos para el vehículo')
+        def _consulta_adjuntos(tabla, columna, ids):
+            return lambda: supabase.table(tabla).select(
+                f'id, created_at, nombre_archivo, storage_path, mime_type, {columna}'
+            ).in_(columna, ids).order('created_at', desc=True).execute()
+
+        adj_res = ejecutar_consultas({
+            nombre: _consulta_adjuntos(tabla, columna, ids)
+            for nombre, (tabla, columna, ids, _) in fuentes.items() if ids
+        })
+
+        for nombre, (tabla, columna, ids, tipo_entidad) in fuentes.items():
+            if not ids:
+                continue
+            res = adj_res.get(nombre)
+            if res is None:
+                current_app.logger.warning(f'No se pudieron obtener adjuntos ({tipo_entidad}) para el vehículo')
+                continue
+            for item in res.data or []:
+                all_adjuntos.append({
+                    'id': item.get('id'),
+                    'created_at': item.get('created_at'),
+                    'nombre_archivo': item.get('nombre_archivo'),
+                    'storage_path': item.get('storage_path'),
+                    'mime_type': item.get('mime_type'),
+                    'tipo_entidad': tipo_entidad,
+                    'entidad_id': item.get(columna)
+                })
 
         # Ordenar por fecha y devolver
         all_adjuntos.sort(key=lambda x: x.get('created_at') or '', reverse=True)
+        agregar_urls_adjuntos(supabase, all_adjuntos, pide_firmas(request.args))
 
         return jsonify({'data': all_adjuntos, 'meta': {'total': len(all_adjuntos)}})
 
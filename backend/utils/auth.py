@@ -1,4 +1,7 @@
 import os
+import time
+import logging
+import hashlib
 import datetime
 from functools import wraps
 
@@ -6,6 +9,32 @@ import jwt
 from flask import current_app, request, jsonify, g
 from werkzeug.security import check_password_hash
 
+from .cache import TTLCache
+
+# Caché de usuarios autenticados (por proceso), indexada por el "subject" del token
+# (email / user_id / sub). Evita un round trip a flota_usuarios en cada request.
+_user_cache = TTLCache(
+    maxsize=int(os.environ.get('AUTH_USER_CACHE_SIZE', 512)),
+    ttl=float(os.environ.get('AUTH_USER_CACHE_TTL', 60)),
+)
+
+# Payloads ya verificados, indexados por hash del token crudo. Nunca sobreviven al 'exp'.
+_token_cache = TTLCache(
+    maxsize=int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300)),
+)
+
+
+def _auth_log(msg: str, *args) -> None:
+    """Log de trazas de autenticación por request, con nivel configurable (AUTH_LOG_LEVEL).
+
+    Usa formato perezoso (%s) para no construir el mensaje si el nivel está deshabilitado.
+    """
+    level = logging.getLevelName(str(current_app.config.get('AUTH_LOG_LEVEL', 'INFO')).upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+    current_app.logger.log(level, msg, *args)
+
 
 def _get_secret():
     return current_app.config.get('SECRET_KEY') or os.environ.get('SECRET_KEY')
@@ -26,7 +55,28 @@ def generate_token(user: dict, hours: int = 24) -> str:
     return token
 
 
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _cache_payload(key: str, payload: dict) -> None:
+    ttl = _token_cache.ttl
+    exp = payload.get('exp')
+    if exp is not None:
+        try:
+            ttl = min(ttl, float(exp) - time.time())
+        except (TypeError, ValueError):
+            return
+    _token_cache.set(key, dict(payload), ttl=ttl)
+
+
 def decode_token(token: str) -> dict | None:
+    # 0. Token ya verificado recientemente: evitamos ambas verificaciones HMAC
+    key = _token_key(token)
+    cached = _token_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+
     # 1. Intentamos obtener la LLAVE MAESTRA del SSO
     sso_secret = os.environ.get('JWT_SECRET_KEY')
     
@@ -40,7 +90,8 @@ def decode_token(token: str) -> dict | None:
         try:
             # OJO: El portal usa HS256
             payload = jwt.decode(token, sso_secret, algorithms=['HS256'])
-            current_app.logger.info('✅ Token decodificado con llave SSO')
+            _auth_log('✅ Token decodificado con llave SSO')
+            _cache_payload(key, payload)
             return payload
         except jwt.ExpiredSignatureError:
             current_app.logger.warning('❌ Token SSO expirado')
@@ -55,7 +106,8 @@ def decode_token(token: str) -> dict | None:
     if local_secret:
         try:
             payload = jwt.decode(token, local_secret, algorithms=['HS256'])
-            current_app.logger.info('✅ Token decodificado con llave Local')
+            _auth_log('✅ Token decodificado con llave Local')
+            _cache_payload(key, payload)
             return payload
         except Exception as e:
             current_app.logger.warning(f'❌ Falló decodificación local: {e}')
@@ -114,30 +166,75 @@ def authenticate(email: str, password: str) -> tuple[dict | None, str | None]:
     return user, None
 
 
+def _token_subject(payload: dict):
+    """Clave de caché para el usuario referido por el token (o None)."""
+    if payload.get('email'):
+        return ('email', str(payload['email']).strip().lower())
+    if payload.get('user_id'):
+        return ('id', str(payload['user_id']))
+    if payload.get('sub'):
+        return ('id', str(payload['sub']))
+    return None
+
+
+def invalidate_user_cache(user_id=None, email: str | None = None) -> None:
+    """Descarta usuarios cacheados tras una escritura en flota_usuarios.
+
+    Solo afecta al proceso actual; el resto de workers expira por TTL.
+    """
+    if user_id is None and not email:
+        _user_cache.clear()
+        return
+    if user_id is not None:
+        _user_cache.pop(('id', str(user_id)))
+        _user_cache.pop_where(lambda u: u.get('id') == user_id)
+    if email:
+        _user_cache.pop(('email', email.strip().lower()))
+
+
 def get_user_from_token(token: str) -> dict | None:
     payload = decode_token(token)
     if not payload:
         return None
-    
+
+    subject = _token_subject(payload)
+    if subject is None:
+        return None
+
+    cached = _user_cache.get(subject)
+    if cached is not None:
+        return dict(cached)
+
     # ESTRATEGIA HÍBRIDA:
-    
-    # 1. Si el token trae 'email' (Viene del Portal SSO)
-    email_sso = payload.get('email')
-    if email_sso:
-        current_app.logger.info(f'🔎 Buscando usuario por Email SSO: {email_sso}')
-        return get_user_by_email(email_sso)
-
-    # 2. Si el token trae 'user_id' (Formato antiguo de Flota)
-    user_id = payload.get('user_id')
-    if user_id:
-        return get_user_by_id(user_id)
-        
-    # 3. Si el token trae 'sub' (Estándar JWT, puede ser el ID)
-    sub_id = payload.get('sub')
-    if sub_id:
-        # Intentamos ver si el 'sub' coincide con un ID local (si son enteros o UUID coincidentes)
-        return get_user_by_id(sub_id)
+    kind, value = subject
+    if kind == 'email':
+        # 1. Si el token trae 'email' (Viene del Portal SSO)
+        _auth_log('🔎 Buscando usuario por Email SSO: %s', value)
+        user = get_user_by_email(value)
+    else:
+        # 2. 'user_id' (Formato antiguo de Flota) o 3. 'sub' (Estándar JWT, puede ser el ID)
+        user = get_user_by_id(payload.get('user_id') or payload.get('sub'))
+
+    if user:
+        _user_cache.set(subject, dict(user))
+    return user
+
+
+def _autenticar(token: str | None):
+    """Valida el token, deja el usuario en `g.current_user` y retorna None, o una respuesta 401."""
+    if not token:
+        current_app.logger.warning('❌ Token no provisto o formato incorrecto')
+        return jsonify({'message': 'Token no provisto'}), 401
 
+    _auth_log('🔍 Intentando decodificar token: %s...', token[:20])
+
+    user = get_user_from_token(token)
+    if not user:
+        current_app.logger.warning('❌ Token inválido o usuario no encontrado')
+        return jsonify({'message': 'Token inválido o expirado'}), 401
+
+    _auth_log('✅ Usuario autenticado: %s', user.get('correo'))
+    g.current_user = user
     return None
 
 
@@ -149,22 +246,30 @@ def auth_required(func):
         auth = request.headers.get('Authorization', '')
         
         # DEBUG
-        current_app.logger.info(f'🔑 Header Authorization recibido: {auth[:50] if auth else "VACÍO"}...')
-        
-        if not auth.startswith('Bearer '):
-            current_app.logger.warning('❌ Token no provisto o formato incorrecto')
-            return jsonify({'message': 'Token no provisto'}), 401
-        
-        token = auth.split(' ', 1)[1]
-        current_app.logger.info(f'🔍 Intentando decodificar token: {token[:20]}...')
-        
-        user = get_user_from_token(token)
-        if not user:
-            current_app.logger.warning('❌ Token inválido o usuario no encontrado')
-            return jsonify({'message': 'Token inválido o expirado'}), 401
+        _auth_log('🔑 Header Authorization recibido: %s...', auth[:50] if auth else 'VACÍO')
         
-        current_app.logger.info(f'✅ Usuario autenticado: {user.get("correo")}')
-        g.current_user = user
+        error = _autenticar(auth.split(' ', 1)[1] if auth.startswith('Bearer ') else None)
+        if error:
+            return error
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def auth_required_stream(func):
+    """Como `auth_required`, pero acepta además el token en `?token=`.
+
+    Solo para streams (EventSource no permite enviar headers). No usar en
+    endpoints normales: el token queda en logs de acceso y proxies.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        auth = request.headers.get('Authorization', '')
+        token = auth.split(' ', 1)[1] if auth.startswith('Bearer ') else request.args.get('token')
+        error = _autenticar(token)
+        if error:
+            return error
         return func(*args, **kwargs)
 
     return wrapper
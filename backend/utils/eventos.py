@@ -0,0 +1,173 @@
+"""Bus de eventos en vivo (cambios de estado de órdenes y posiciones) para SSE.
+
+Cada worker tiene su propio bus. Un cambio de estado puede ocurrir en
+cualquier worker, así que mientras haya suscriptores un hilo por proceso
+consulta cada EVENTOS_INTERVALO segundos:
+
+- `flota_orden_historial` desde la última marca de tiempo (lo que registra
+  `_registrar_cambio_estado`), y
+- las posiciones de las órdenes en curso (utils/posiciones), emitiendo solo
+  las que cambiaron.
+
+El costo es una o dos consultas por worker por intervalo, sin importar
+cuántos clientes estén conectados. Los cambios hechos en el propio worker se
+publican de inmediato (`publicar_cambio_estado`) y el hilo no los repite.
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from .posiciones import obtener_posiciones
+from .rutas import leer_timestamp
+
+EVENTOS_INTERVALO = float(os.environ.get('EVENTOS_INTERVALO', 2))
+EVENTOS_MAX_CLIENTES = int(os.environ.get('EVENTOS_MAX_CLIENTES', 8))
+# Eventos en cola por cliente; si un cliente lento la llena se le pide resincronizar
+EVENTOS_COLA_CLIENTE = 500
+# Eventos recientes que se reenvían a un cliente que reconecta con Last-Event-ID
+EVENTOS_HISTORIAL = 500
+
+_lock = threading.Lock()
+_secuencia = itertools.count(1)
+_suscriptores = set()
+_recientes = deque(maxlen=EVENTOS_HISTORIAL)
+_hilo = None
+# Cambios de estado ya publicados: (orden_id, estado_nuevo, created_at)
+_vistos = deque(maxlen=2000)
+_marca_historial = None
+_posiciones = {}
+
+
+class Suscripcion:
+    def __init__(self, tipos=None, orden_id=None):
+        self.cola = queue.Queue(maxsize=EVENTOS_COLA_CLIENTE)
+        self.tipos = set(tipos) if tipos else None
+        self.orden_id = orden_id
+        self.desbordada = False
+
+    def acepta(self, evento: dict) -> bool:
+        if self.tipos and evento['tipo'] not in self.tipos:
+            return False
+        return self.orden_id is None or evento['data'].get('orden_id') == self.orden_id
+
+
+def _id_evento(seq: int) -> str:
+    # El pid evita reanudar con IDs de otro worker (el cliente puede reconectar a cualquiera)
+    return f'{os.getpid()}-{seq}'
+
+
+def publicar(tipo: str, data: dict) -> None:
+    evento = {'id': _id_evento(next(_secuencia)), 'tipo': tipo, 'data': data}
+    with _lock:
+        _recientes.append(evento)
+        suscriptores = list(_suscriptores)
+    for s in suscriptores:
+        if s.desbordada or not s.acepta(evento):
+            continue
+        try:
+            s.cola.put_nowait(evento)
+        except queue.Full:
+            s.desbordada = True
+
+
+def _clave_cambio(fila: dict):
+    return (fila.get('orden_id'), fila.get('estado_nuevo'), str(fila.get('created_at')))
+
+
+def publicar_cambio_estado(fila: dict) -> None:
+    """Publica una fila recién insertada en flota_orden_historial."""
+    with _lock:
+        clave = _clave_cambio(fila)
+        if clave in _vistos:
+            return
+        _vistos.append(clave)
+    publicar('estado', {k: fila.get(k) for k in ('orden_id', 'estado_anterior', 'estado_nuevo', 'usuario_id', 'created_at')})
+
+
+def _consultar_historial(supabase) -> None:
+    global _marca_historial
+    if _marca_historial is None:
+        # Primer ciclo: solo cambios desde ahora
+        _marca_historial = datetime.now(timezone.utc)
+        return
+    # gte: las filas con la misma marca ya publicadas se descartan por _vistos
+    res = supabase.table('flota_orden_historial') \
+        .select('orden_id, estado_anterior, estado_nuevo, usuario_id, created_at') \
+        .gte('created_at', _marca_historial.isoformat()).order('created_at').limit(500).execute()
+    for fila in res.data or []:
+        publicar_cambio_estado(fila)
+        creado = leer_timestamp(fila.get('created_at'))
+        if creado and creado > _marca_historial:
+            _marca_historial = creado
+
+
+def _consultar_posiciones(supabase) -> None:
+    global _posiciones
+    data, _ = obtener_posiciones(supabase)
+    actuales = {p['orden_id']: p for p in data}
+    for oid, p in actuales.items():
+        previa = _posiciones.get(oid)
+        if p.get('timestamp') and (previa is None or previa.get('timestamp') != p.get('timestamp')):
+            publicar('posicion', p)
+    _posiciones = actuales
+
+
+def _bucle(app) -> None:
+    global _hilo, _marca_historial, _posiciones
+    with app.app_context():
+        while True:
+            with _lock:
+                if not _suscriptores:
+                    # Sin clientes no hay a quién avisar de lo ocurrido mientras tanto
+                    _hilo, _marca_historial, _posiciones = None, None, {}
+                    return
+            supabase = app.config.get('SUPABASE')
+            if supabase is not None:
+                for consulta in (_consultar_historial, _consultar_posiciones):
+                    try:
+                        consulta(supabase)
+                    except Exception as e:
+                        app.logger.warning(f"Eventos: falló {consulta.__name__}: {e}")
+            time.sleep(EVENTOS_INTERVALO)
+
+
+def suscribir(app, tipos=None, orden_id=None, ultimo_id: str | None = None):
+    """Registra un suscriptor y arranca el hilo de consulta si hace falta.
+
+    Retorna (Suscripcion, reanudada) o (None, False) si se alcanzó EVENTOS_MAX_CLIENTES.
+    Con `ultimo_id` de este mismo worker se reencolan los eventos posteriores.
+    """
+    global _hilo
+    s = Suscripcion(tipos, orden_id)
+    with _lock:
+        if len(_suscriptores) >= EVENTOS_MAX_CLIENTES:
+            return None, False
+        reanudada = False
+        if ultimo_id:
+            ids = [e['id'] for e in _recientes]
+            if ultimo_id in ids:
+                reanudada = True
+                for e in list(_recientes)[ids.index(ultimo_id) + 1:]:
+                    if s.acepta(e):
+                        s.cola.put_nowait(e)
+        _suscriptores.add(s)
+        if _hilo is None:
+            _hilo = threading.Thread(target=_bucle, args=(app,), name='eventos', daemon=True)
+            _hilo.start()
+    return s, reanudada
+
+
+def desuscribir(s: Suscripcion) -> None:
+    with _lock:
+        _suscriptores.discard(s)
+
+
+def estado_eventos() -> dict:
+    """Suscriptores y hilo de consulta del proceso actual (GET /api/health/eventos)."""
+    with _lock:
+        return {'pid': os.getpid(), 'clientes': len(_suscriptores), 'max_clientes': EVENTOS_MAX_CLIENTES,
+                'desbordados': sum(1 for s in _suscriptores if s.desbordada), 'hilo_activo': _hilo is not None}
@@ -0,0 +1,236 @@
+"""Geometría de rutas GPS: proyección local, simplificación de polilíneas y grilla espacial."""
+import math
+
+import numpy as np
+
+RADIO_TIERRA_M = 6371008.8
+
+
+def proyectar_metros(lats, lngs):
+    """Proyección equirectangular local (metros) centrada en la ruta.
+
+    Suficiente para distancias de simplificación dentro de un viaje; no para
+    distancias entre puntos muy lejanos.
+    """
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lng = np.radians(np.asarray(lngs, dtype=float))
+    cos_lat0 = np.cos(lat.mean()) if lat.size else 1.0
+    return RADIO_TIERRA_M * lng * cos_lat0, RADIO_TIERRA_M * lat
+
+
+def _distancia_a_segmento(x, y, x0, y0, x1, y1):
+    """Distancia de cada (x, y) al segmento (x0, y0)-(x1, y1), vectorizada."""
+    dx, dy = x1 - x0, y1 - y0
+    largo2 = dx * dx + dy * dy
+    if largo2 == 0.0:
+        return np.hypot(x - x0, y - y0)
+    t = np.clip(((x - x0) * dx + (y - y0) * dy) / largo2, 0.0, 1.0)
+    return np.hypot(x - (x0 + t * dx), y - (y0 + t * dy))
+
+
+def douglas_peucker(x, y, tolerancia: float) -> np.ndarray:
+    """Índices (ordenados) de los puntos que conserva Douglas-Peucker.
+
+    Iterativo (sin recursión) y con la distancia de cada tramo calculada en
+    bloque con NumPy. Siempre conserva el primer y el último punto.
+    """
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+    conservar = np.zeros(n, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pendientes = [(0, n - 1)]
+    while pendientes:
+        ini, fin = pendientes.pop()
+        if fin - ini < 2:
+            continue
+        d = _distancia_a_segmento(x[ini + 1:fin], y[ini + 1:fin], x[ini], y[ini], x[fin], y[fin])
+        k = int(d.argmax())
+        if d[k] > tolerancia:
+            medio = ini + 1 + k
+            conservar[medio] = True
+            pendientes.append((ini, medio))
+            pendientes.append((medio, fin))
+    return np.flatnonzero(conservar)
+
+
+def simplificar_puntos(puntos: list, tolerancia_m: float, lat_key: str = 'latitud', lng_key: str = 'longitud') -> list:
+    """Simplifica una lista de puntos (dicts) con tolerancia en metros.
+
+    Los puntos sin coordenadas se descartan (no se pueden dibujar).
+    """
+    validos = [p for p in puntos if p.get(lat_key) is not None and p.get(lng_key) is not None]
+    if len(validos) <= 2 or tolerancia_m <= 0:
+        return validos
+    x, y = proyectar_metros([p[lat_key] for p in validos], [p[lng_key] for p in validos])
+    return [validos[i] for i in douglas_peucker(x, y, float(tolerancia_m))]
+
+
+def significancia_dp(x, y) -> np.ndarray:
+    """Tolerancia a partir de la cual Douglas-Peucker descartaría cada punto.
+
+    Se acota por la del punto que dividió su tramo, de modo que la
+    significancia es monótona: los N puntos más significativos forman una
+    simplificación válida y los niveles de detalle quedan anidados. Los
+    extremos tienen significancia infinita.
+    """
+    n = len(x)
+    sig = np.zeros(n)
+    if n == 0:
+        return sig
+    sig[0] = sig[-1] = np.inf
+    pendientes = [(0, n - 1, np.inf)]
+    while pendientes:
+        ini, fin, techo = pendientes.pop()
+        if fin - ini < 2:
+            continue
+        d = _distancia_a_segmento(x[ini + 1:fin], y[ini + 1:fin], x[ini], y[ini], x[fin], y[fin])
+        k = int(d.argmax())
+        medio = ini + 1 + k
+        sig[medio] = min(float(d[k]), techo)
+        pendientes.append((ini, medio, sig[medio]))
+        pendientes.append((medio, fin, sig[medio]))
+    return sig
+
+
+def niveles_detalle(puntos: list, niveles, lat_key: str = 'latitud', lng_key: str = 'longitud') -> dict:
+    """{nivel: puntos} con los `nivel` puntos más significativos, en orden original.
+
+    Los niveles mayores o iguales a la cantidad de puntos reciben la ruta
+    completa (solo el primero de ellos, los siguientes serían idénticos).
+    """
+    validos = [p for p in puntos if p.get(lat_key) is not None and p.get(lng_key) is not None]
+    resultado = {}
+    if not validos:
+        return resultado
+    x, y = proyectar_metros([p[lat_key] for p in validos], [p[lng_key] for p in validos])
+    # Orden estable por significancia descendente: los empates favorecen el punto anterior
+    ranking = np.argsort(-significancia_dp(x, y), kind='stable')
+    for nivel in sorted(niveles):
+        if nivel >= len(validos):
+            resultado[nivel] = validos
+            break
+        resultado[nivel] = [validos[i] for i in np.sort(ranking[:nivel])]
+    return resultado
+
+
+def _codificar_enteros(deltas) -> str:
+    """Algoritmo de 'encoded polyline' de Google sobre enteros ya diferenciados."""
+    salida = []
+    for v in np.asarray(deltas, dtype=np.int64).tolist():
+        v = ~(v << 1) if v < 0 else v << 1
+        while v >= 0x20:
+            salida.append(chr((0x20 | (v & 0x1f)) + 63))
+            v >>= 5
+        salida.append(chr(v + 63))
+    return ''.join(salida)
+
+
+def codificar_deltas(valores, escala: float = 1.0) -> str:
+    """Serie numérica -> enteros (valor * escala) diferenciados y codificados como polyline."""
+    enteros = np.round(np.asarray(valores, dtype=float) * escala).astype(np.int64)
+    return _codificar_enteros(np.diff(enteros, prepend=0))
+
+
+def codificar_polyline(lats, lngs, precision: int = 5) -> str:
+    """Encoded polyline de Google (lat/lng intercalados, precisión 1e-5 por defecto)."""
+    escala = 10 ** precision
+    lat = np.round(np.asarray(lats, dtype=float) * escala).astype(np.int64)
+    lng = np.round(np.asarray(lngs, dtype=float) * escala).astype(np.int64)
+    pares = np.empty(lat.size * 2, dtype=np.int64)
+    pares[0::2] = np.diff(lat, prepend=0)
+    pares[1::2] = np.diff(lng, prepend=0)
+    return _codificar_enteros(pares)
+
+
+# --- Métricas de viaje ---
+
+# Bajo esta velocidad (entre dos puntos) el vehículo se considera detenido
+VELOCIDAD_MOVIMIENTO_KMH = 3.0
+# Sobre esta velocidad el tramo es un salto del GPS: no suma distancia ni velocidad
+VELOCIDAD_MAX_VALIDA_KMH = 250.0
+# Duración mínima de una detención para contarla como parada
+PARADA_MIN_SEG = 120
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Distancia de gran círculo en metros, vectorizada sobre arreglos."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def metricas_trayecto(lats, lngs, segundos) -> dict:
+    """Distancia, tiempos en movimiento/detenido, velocidades y paradas de un trayecto.
+
+    `segundos` son los tiempos de cada punto (crecientes). Las velocidades se
+    derivan de distancia/tiempo entre puntos consecutivos, no de la velocidad
+    que reporta el dispositivo.
+    """
+    lat = np.asarray(lats, dtype=float)
+    lng = np.asarray(lngs, dtype=float)
+    t = np.asarray(segundos, dtype=float)
+    metricas = {
+        'puntos': int(lat.size),
+        'distancia_km': 0.0,
+        'duracion_seg': 0,
+        'tiempo_movimiento_seg': 0,
+        'tiempo_detenido_seg': 0,
+        'velocidad_max_kmh': 0.0,
+        'velocidad_promedio_kmh': 0.0,
+        'paradas': 0,
+    }
+    if lat.size < 2:
+        return metricas
+
+    d = haversine_m(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    dt = np.diff(t)
+    con_tiempo = dt > 0
+    v = np.zeros_like(d)
+    v[con_tiempo] = d[con_tiempo] / dt[con_tiempo] * 3.6
+    valido = con_tiempo & (v <= VELOCIDAD_MAX_VALIDA_KMH)
+    movimiento = valido & (v >= VELOCIDAD_MOVIMIENTO_KMH)
+    detenido = valido & ~movimiento
+
+    # Paradas: rachas de tramos detenidos consecutivos que suman al menos PARADA_MIN_SEG
+    bordes = np.diff(np.concatenate(([0], detenido.astype(np.int8), [0])))
+    acumulado = np.concatenate(([0.0], np.cumsum(np.where(detenido, dt, 0.0))))
+    duraciones = acumulado[np.flatnonzero(bordes == -1)] - acumulado[np.flatnonzero(bordes == 1)]
+
+    distancia = float(d[valido].sum())
+    seg_movimiento = float(dt[movimiento].sum())
+    metricas.update({
+        'distancia_km': round(distancia / 1000, 3),
+        'duracion_seg': int(t[-1] - t[0]),
+        'tiempo_movimiento_seg': int(seg_movimiento),
+        'tiempo_detenido_seg': int(dt[detenido].sum()),
+        'velocidad_max_kmh': round(float(v[movimiento].max()), 1) if movimiento.any() else 0.0,
+        'velocidad_promedio_kmh': round(float(d[movimiento].sum()) / seg_movimiento * 3.6, 1) if seg_movimiento else 0.0,
+        'paradas': int((duraciones >= PARADA_MIN_SEG).sum()),
+    })
+    return metricas
+
+
+# --- Grilla espacial ---
+
+# Celdas de 0,01° (~1,1 km de lado). Debe coincidir con la columna generada
+# flota_orden_rutas.celda (backend/migrations/007_flota_orden_rutas_celda.sql).
+CELDAS_POR_GRADO = 100
+COLUMNAS_GRILLA = 360 * CELDAS_POR_GRADO
+# Margen para que un punto justo en el borde de una celda no quede fuera por redondeo
+_EPSILON_GRILLA = 1e-9
+
+
+def celda_de(lat: float, lng: float) -> int:
+    fila = math.floor((lat + 90) * CELDAS_POR_GRADO)
+    columna = min(math.floor((lng + 180) * CELDAS_POR_GRADO), COLUMNAS_GRILLA - 1)
+    return fila * COLUMNAS_GRILLA + columna
+
+
+def rangos_celdas(lat_min: float, lng_min: float, lat_max: float, lng_max: float) -> list:
+    """Celdas que cubren el rectángulo, como rangos [desde, hasta] contiguos (uno por fila de la grilla)."""
+    f0 = math.floor((lat_min + 90) * CELDAS_POR_GRADO - _EPSILON_GRILLA)
+    f1 = math.floor((lat_max + 90) * CELDAS_POR_GRADO + _EPSILON_GRILLA)
+    c0 = max(math.floor((lng_min + 180) * CELDAS_POR_GRADO - _EPSILON_GRILLA), 0)
+    c1 = min(math.floor((lng_max + 180) * CELDAS_POR_GRADO + _EPSILON_GRILLA), COLUMNAS_GRILLA - 1)
+    return [(f * COLUMNAS_GRILLA + c0, f * COLUMNAS_GRILLA + c1) for f in range(max(f0, 0), f1 + 1)]
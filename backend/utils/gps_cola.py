@@ -0,0 +1,320 @@
+"""Cola de escritura asíncrona de puntos GPS con journal local.
+
+La ingesta valida el lote, lo agrega a un journal NDJSON en disco (append +
+fsync) y responde sin esperar a la base. Un hilo por proceso vacía la cola
+cada GPS_COLA_INTERVALO segundos (o antes si se acumula un bloque) y escribe
+en `flota_orden_rutas` por bloques con la misma inserción idempotente de la
+ingesta síncrona (ver gps_ingesta._insertar_bloque), de modo que reescribir
+un segmento tras un fallo no duplica puntos.
+
+El journal se divide en segmentos: el activo recibe los appends y el hilo lo
+rota antes de escribirlo; un segmento se borra solo cuando todos sus puntos
+llegaron a la base. Cada proceso mantiene un flock sobre sus segmentos: los
+que quedan sin dueño (worker caído o reiniciado) los adopta el primer proceso
+que los encuentra. Para sobrevivir a un redeploy GPS_COLA_DIR debe estar en un
+volumen persistente; con el default (bajo el directorio temporal) init_cola_gps
+lo advierte en el log al arrancar.
+
+Contrapresión: si los puntos pendientes superan GPS_COLA_MAX_PUNTOS la
+ingesta se rechaza (el endpoint responde 503 con Retry-After).
+"""
+import fcntl
+import glob
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+from .gps_ingesta import _insertar_bloque, GPS_INGESTA_BLOQUE
+from .rutas import registrar_puntos, resumen_desde_puntos
+
+GPS_COLA_ACTIVA = os.environ.get('GPS_COLA_ACTIVA', 'true').lower() == 'true'
+GPS_COLA_DIR = os.environ.get('GPS_COLA_DIR', os.path.join(tempfile.gettempdir(), 'flota_gps_cola'))
+GPS_COLA_MAX_PUNTOS = int(os.environ.get('GPS_COLA_MAX_PUNTOS', 200000))
+GPS_COLA_INTERVALO = float(os.environ.get('GPS_COLA_INTERVALO', 1.0))
+GPS_COLA_FSYNC = os.environ.get('GPS_COLA_FSYNC', 'true').lower() == 'true'
+# Espera entre reintentos cuando la base falla (se duplica hasta el máximo)
+REINTENTO_MAX_SEG = 60.0
+# Cada cuánto se buscan segmentos abandonados por otros workers
+RECUPERAR_CADA_SEG = 60.0
+
+_lock = threading.Lock()
+_despertar = threading.Event()
+_secuencia = itertools.count()
+_app = None
+_pid = None
+_hilo = None
+_activo = None          # {'archivo', 'ruta', 'filas', 'desde'}
+_segmentos = deque()    # rotados y pendientes de escribir, del más antiguo al más nuevo
+_profundidad = 0
+_latencias = deque(maxlen=200)
+_metricas = {
+    'encolados': 0,
+    'escritos': 0,
+    'descartados_duplicados': 0,
+    'vaciados': 0,
+    'errores': 0,
+    'ultimo_error': None,
+    'rechazos_contrapresion': 0,
+    'segmentos_recuperados': 0,
+}
+
+
+def cola_activa() -> bool:
+    return GPS_COLA_ACTIVA and _app is not None
+
+
+def _nombre(sufijo: str) -> str:
+    return os.path.join(GPS_COLA_DIR, f"{os.getpid()}-{next(_secuencia)}-{sufijo}.ndjson")
+
+
+def _bloquear(archivo) -> bool:
+    try:
+        fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _leer_segmento(archivo) -> list:
+    """Filas de un segmento; descarta líneas cortadas por una caída a mitad de escritura."""
+    archivo.seek(0)
+    filas = []
+    for linea in archivo:
+        try:
+            filas.append(json.loads(linea))
+        except ValueError:
+            continue
+    return filas
+
+
+def _recuperar_huerfanos() -> None:
+    """Adopta los segmentos de procesos que ya no los tienen bloqueados."""
+    global _profundidad
+    for ruta in sorted(glob.glob(os.path.join(GPS_COLA_DIR, '*.ndjson')), key=os.path.getmtime):
+        try:
+            archivo = open(ruta, 'r+', encoding='utf-8')
+        except OSError:
+            continue
+        # Bloqueado: tiene dueño vivo. st_nlink == 0: el dueño lo terminó y borró mientras tanto
+        if not _bloquear(archivo) or os.fstat(archivo.fileno()).st_nlink == 0:
+            archivo.close()
+            continue
+        nueva = _nombre('recuperado')
+        os.rename(ruta, nueva)
+        filas = _leer_segmento(archivo)
+        with _lock:
+            _segmentos.append({'archivo': archivo, 'ruta': nueva, 'filas': filas, 'hechos': 0,
+                               'desde': time.monotonic()})
+            _profundidad += len(filas)
+            _metricas['segmentos_recuperados'] += 1
+        _app.logger.info(f"Cola GPS: recuperados {len(filas)} puntos de {os.path.basename(ruta)}")
+
+
+def _abrir_activo() -> dict:
+    ruta = _nombre('activo')
+    archivo = open(ruta, 'a+', encoding='utf-8')
+    _bloquear(archivo)
+    return {'archivo': archivo, 'ruta': ruta, 'filas': [], 'desde': None}
+
+
+def _rotar() -> None:
+    """Pasa el segmento activo (si tiene puntos) a la lista de pendientes."""
+    global _activo
+    with _lock:
+        if not _activo or not _activo['filas']:
+            return
+        segmento, _activo = _activo, None
+        ruta = _nombre('pendiente')
+        os.rename(segmento['ruta'], ruta)
+        segmento.update(ruta=ruta, hechos=0)
+        _segmentos.append(segmento)
+
+
+def _escribir_segmento(supabase, segmento: dict) -> None:
+    """Escribe por bloques lo que falta del segmento, agrupado por orden.
+
+    `hechos` avanza por bloque, así un fallo a mitad de camino no repite lo ya escrito.
+    """
+    filas = segmento['filas']
+    while segmento['hechos'] < len(filas):
+        inicio = segmento['hechos']
+        orden_id = filas[inicio]['orden_id']
+        bloque = []
+        for fila in itertools.islice(filas, inicio, inicio + GPS_INGESTA_BLOQUE):
+            if fila['orden_id'] != orden_id:
+                break
+            bloque.append(fila)
+        nuevas = _insertar_bloque(supabase, bloque)
+        segmento['hechos'] += len(bloque)
+        with _lock:
+            _metricas['escritos'] += len(nuevas)
+            _metricas['descartados_duplicados'] += len(bloque) - len(nuevas)
+        if nuevas:
+            # Resumen de lo realmente insertado: se suma al de la orden sin recalcularlo
+            registrar_puntos(supabase, orden_id, resumen_lote=resumen_desde_puntos(orden_id, nuevas))
+
+
+def _vaciar(supabase) -> bool:
+    """Escribe los segmentos pendientes en orden. False si la base falló."""
+    global _profundidad
+    _rotar()
+    while _segmentos:
+        segmento = _segmentos[0]
+        inicio = time.monotonic()
+        try:
+            _escribir_segmento(supabase, segmento)
+        except Exception as e:
+            with _lock:
+                _metricas['errores'] += 1
+                _metricas['ultimo_error'] = str(e)[:300]
+            _app.logger.error(f"Cola GPS: error escribiendo puntos ({len(segmento['filas']) - segmento['hechos']} pendientes): {e}")
+            return False
+        with _lock:
+            _latencias.append((time.monotonic() - inicio) * 1000)
+        try:
+            os.remove(segmento['ruta'])
+        except OSError:
+            pass
+        segmento['archivo'].close()
+        with _lock:
+            _segmentos.popleft()
+            _profundidad -= len(segmento['filas'])
+            _metricas['vaciados'] += 1
+    return True
+
+
+def _bucle() -> None:
+    espera = GPS_COLA_INTERVALO
+    proxima_recuperacion = 0.0
+    with _app.app_context():
+        while True:
+            if time.monotonic() >= proxima_recuperacion:
+                proxima_recuperacion = time.monotonic() + RECUPERAR_CADA_SEG
+                try:
+                    _recuperar_huerfanos()
+                except Exception as e:
+                    _app.logger.error(f"Cola GPS: no se pudieron recuperar segmentos: {e}")
+            _despertar.wait(espera)
+            _despertar.clear()
+            supabase = _app.config.get('SUPABASE')
+            if supabase is None:
+                continue
+            try:
+                ok = _vaciar(supabase)
+            except Exception as e:
+                # Un error de disco no debe matar el hilo: se reintenta en el próximo ciclo
+                _app.logger.error(f"Cola GPS: error en el vaciado: {e}")
+                ok = False
+            espera = GPS_COLA_INTERVALO if ok else min(max(espera, 1.0) * 2, REINTENTO_MAX_SEG)
+
+
+def _asegurar_hilo() -> None:
+    """Arranca el hilo del proceso actual (también tras un fork de gunicorn)."""
+    global _pid, _hilo, _activo, _profundidad
+    if _pid == os.getpid() and _hilo is not None:
+        return
+    with _lock:
+        if _pid == os.getpid() and _hilo is not None:
+            return
+        if _pid != os.getpid():
+            # Estado heredado del padre: sus segmentos siguen siendo suyos
+            _activo = None
+            _segmentos.clear()
+            _profundidad = 0
+        os.makedirs(GPS_COLA_DIR, exist_ok=True)
+        _pid = os.getpid()
+        _hilo = threading.Thread(target=_bucle, name='gps-cola', daemon=True)
+        _hilo.start()
+
+
+def init_cola_gps(app) -> None:
+    """Registra la app y arranca el hilo de vaciado (si la cola está activa)."""
+    global _app
+    if not GPS_COLA_ACTIVA:
+        return
+    _app = app
+    try:
+        _asegurar_hilo()
+    except OSError as e:
+        _app = None
+        app.logger.error(f"Cola GPS desactivada, no se pudo usar {GPS_COLA_DIR}: {e}")
+        return
+    if os.path.realpath(GPS_COLA_DIR).startswith(os.path.realpath(tempfile.gettempdir()) + os.sep):
+        # Puntos ya respondidos con 202 pueden perderse si el contenedor se recrea antes del vaciado
+        app.logger.warning(f"Cola GPS: el journal está en un directorio temporal ({GPS_COLA_DIR}); "
+                           "definir GPS_COLA_DIR en un volumen persistente")
+
+
+def encolar(filas: list) -> bool:
+    """Agrega filas ya validadas al journal y a la cola.
+
+    Retorna False si la cola está llena (contrapresión). Lanza OSError si no se
+    pudo escribir el journal; en ese caso nada quedó encolado.
+    """
+    global _activo, _profundidad
+    if not filas:
+        return True
+    _asegurar_hilo()
+    datos = ''.join(json.dumps(f, separators=(',', ':')) + '\n' for f in filas)
+    with _lock:
+        if _profundidad + len(filas) > GPS_COLA_MAX_PUNTOS:
+            _metricas['rechazos_contrapresion'] += 1
+            return False
+        if _activo is None:
+            _activo = _abrir_activo()
+        archivo = _activo['archivo']
+        posicion = archivo.tell()
+        try:
+            archivo.write(datos)
+            archivo.flush()
+            if GPS_COLA_FSYNC:
+                os.fsync(archivo.fileno())
+        except OSError:
+            # No dejar una línea a medias que se confunda con puntos confirmados
+            archivo.truncate(posicion)
+            raise
+        _activo['filas'].extend(filas)
+        if _activo['desde'] is None:
+            _activo['desde'] = time.monotonic()
+        _profundidad += len(filas)
+        _metricas['encolados'] += len(filas)
+        lleno = len(_activo['filas']) >= GPS_INGESTA_BLOQUE
+    if lleno:
+        _despertar.set()
+    return True
+
+
+def reintentar_en() -> int:
+    """Segundos sugeridos para Retry-After cuando la cola está llena."""
+    return int(max(GPS_COLA_INTERVALO * 5, 5))
+
+
+def estado_cola() -> dict:
+    """Métricas del proceso actual: profundidad, antigüedad y latencia de vaciado."""
+    with _lock:
+        desde = [s['desde'] for s in _segmentos if s.get('desde') is not None]
+        if _activo and _activo['desde'] is not None:
+            desde.append(_activo['desde'])
+        ultima = _latencias[-1] if _latencias else None
+        latencias = sorted(_latencias)
+        estado = {
+            'activa': cola_activa(),
+            'pid': os.getpid(),
+            'profundidad': _profundidad,
+            'max_puntos': GPS_COLA_MAX_PUNTOS,
+            'segmentos_pendientes': len(_segmentos) + (1 if _activo and _activo['filas'] else 0),
+            'antiguedad_seg': round(time.monotonic() - min(desde), 1) if desde else 0,
+            **_metricas,
+        }
+    if latencias:
+        estado['latencia_vaciado_ms'] = {
+            'ultima': round(ultima, 1),
+            'p50': round(latencias[len(latencias) // 2], 1),
+            'p95': round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))], 1),
+            'max': round(latencias[-1], 1),
+        }
+    return estado
@@ -0,0 +1,204 @@
+"""Ingesta de puntos GPS: validación, deduplicación e inserción por bloques.
+
+Los puntos se procesan como un flujo (lista JSON ya parseada o NDJSON leído
+línea a línea del body) y se insertan en bloques de GPS_INGESTA_BLOQUE filas
+con `ON CONFLICT (orden_id, timestamp) DO NOTHING` (índice único de la
+migración 005), de modo que reenviar un lote no duplica puntos. Con el header
+`Idempotency-Key` el resultado de la primera ingesta se guarda y los
+reintentos lo reciben sin volver a procesar.
+"""
+import json
+import math
+import os
+import time
+from datetime import timezone
+
+from flask import current_app
+
+from .cache import TTLCache
+from .rpc import es_tabla_inexistente
+from .rutas import leer_timestamp, resumen_desde_puntos, _fusionar
+
+TABLA_PUNTOS = 'flota_orden_rutas'
+TABLA_INGESTAS = 'flota_orden_rutas_ingestas'
+GPS_INGESTA_BLOQUE = int(os.environ.get('GPS_INGESTA_BLOQUE', 500))
+REINTENTO_SEG = 300
+
+# Respuestas ya entregadas por (orden_id, Idempotency-Key); la tabla cubre al resto de workers
+_ingestas_recientes = TTLCache(maxsize=2048, ttl=3600)
+_sin_indice_unico_hasta = 0.0
+_sin_tabla_ingestas_hasta = 0.0
+
+
+def leer_ndjson(stream):
+    """Genera un dict por línea no vacía de un body NDJSON, sin cargarlo entero.
+
+    Una línea que no es JSON válido genera None (se contabiliza como rechazo).
+    """
+    for linea in stream:
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            yield json.loads(linea)
+        except ValueError:
+            yield None
+
+
+def _numero(valor):
+    if valor is None or valor == '' or isinstance(valor, bool):
+        return None
+    try:
+        n = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return n if math.isfinite(n) else None
+
+
+def normalizar_punto(p, orden_id):
+    """Retorna (fila, None) si el punto es válido, o (None, motivo) si se rechaza."""
+    if not isinstance(p, dict):
+        return None, 'formato'
+    lat = _numero(p.get('latitude', p.get('latitud')))
+    lng = _numero(p.get('longitude', p.get('longitud')))
+    if lat is None or lng is None or not (-90 <= lat <= 90) or not (-180 <= lng <= 180) or (lat == 0 and lng == 0):
+        return None, 'coordenadas'
+    t = leer_timestamp(p.get('timestamp'))
+    if t is None:
+        return None, 'timestamp'
+    velocidad = _numero(p.get('speed', p.get('velocidad')))
+    if velocidad is not None and velocidad < 0:
+        # Android reporta -1 cuando no conoce la velocidad
+        velocidad = None
+    return {
+        'orden_id': orden_id,
+        'latitud': lat,
+        'longitud': lng,
+        'velocidad': velocidad,
+        'timestamp': t.astimezone(timezone.utc).isoformat(),
+    }, None
+
+
+def _insertar_bloque(supabase, filas: list) -> list:
+    """Inserta un bloque ignorando puntos ya existentes. Retorna las filas insertadas.
+
+    Su resumen (resumen_desde_puntos) es el delta exacto para el resumen de la
+    orden aunque parte del bloque ya existiera.
+    """
+    global _sin_indice_unico_hasta
+    if time.monotonic() >= _sin_indice_unico_hasta:
+        try:
+            # Con ignore-duplicates la representación trae solo las filas insertadas. No sirve
+            # returning='minimal' + count: el body vacío deja count=0 en postgrest-py
+            res = supabase.table(TABLA_PUNTOS).upsert(
+                filas, on_conflict='orden_id,timestamp', ignore_duplicates=True,
+                returning='representation'
+            ).execute()
+            return res.data or []
+        except Exception as e:
+            # 42P10: no hay índice único para ON CONFLICT (migración 005 sin aplicar)
+            if '42P10' not in str(e):
+                raise
+            _sin_indice_unico_hasta = time.monotonic() + REINTENTO_SEG
+            current_app.logger.warning('flota_orden_rutas sin índice único (orden_id, timestamp); insertando sin deduplicar en la base')
+    supabase.table(TABLA_PUNTOS).insert(filas, returning='minimal').execute()
+    return filas
+
+
+def validar_puntos(puntos, orden_id, conteo: dict):
+    """Genera las filas válidas y no repetidas dentro de `puntos` (iterable).
+
+    Acumula en `conteo` 'recibidos', 'duplicados' y 'motivos_rechazo'.
+    """
+    conteo.setdefault('recibidos', 0)
+    conteo.setdefault('duplicados', 0)
+    rechazos = conteo.setdefault('motivos_rechazo', {})
+    vistos = set()
+    for p in puntos:
+        conteo['recibidos'] += 1
+        fila, motivo = normalizar_punto(p, orden_id)
+        if motivo:
+            rechazos[motivo] = rechazos.get(motivo, 0) + 1
+            continue
+        if fila['timestamp'] in vistos:
+            conteo['duplicados'] += 1
+            continue
+        vistos.add(fila['timestamp'])
+        yield fila
+
+
+def ingerir_puntos(supabase, orden_id, puntos) -> dict:
+    """Valida, deduplica e inserta `puntos` (iterable) por bloques.
+
+    Retorna los conteos; en 'resumen', el resumen de ruta de lo insertado
+    (solo las filas nuevas), y en 'ultimo' el punto válido más reciente del lote.
+    """
+    conteo = {}
+    insertados = 0
+    resumen = resumen_desde_puntos(orden_id, [])
+    bloque = []
+    ultimo = None
+
+    def _vaciar():
+        nonlocal insertados, resumen
+        nuevas = _insertar_bloque(supabase, bloque)
+        insertados += len(nuevas)
+        conteo['duplicados'] += len(bloque) - len(nuevas)
+        if nuevas:
+            resumen = _fusionar(resumen, resumen_desde_puntos(orden_id, nuevas))
+        bloque.clear()
+
+    for fila in validar_puntos(puntos, orden_id, conteo):
+        if ultimo is None or fila['timestamp'] >= ultimo['timestamp']:
+            ultimo = fila
+        bloque.append(fila)
+        if len(bloque) >= GPS_INGESTA_BLOQUE:
+            _vaciar()
+    if bloque:
+        _vaciar()
+
+    rechazos = conteo.get('motivos_rechazo', {})
+    return {
+        'recibidos': conteo.get('recibidos', 0),
+        'aceptados': insertados,
+        'duplicados': conteo.get('duplicados', 0),
+        'rechazados': sum(rechazos.values()),
+        'motivos_rechazo': rechazos,
+        'resumen': resumen,
+        'ultimo': ultimo,
+    }
+
+
+def buscar_ingesta(supabase, orden_id, clave: str):
+    """Resultado guardado de una ingesta previa con la misma Idempotency-Key, o None."""
+    global _sin_tabla_ingestas_hasta
+    previo = _ingestas_recientes.get((orden_id, clave))
+    if previo is not None or time.monotonic() < _sin_tabla_ingestas_hasta:
+        return previo
+    try:
+        res = supabase.table(TABLA_INGESTAS).select('resultado') \
+            .eq('orden_id', orden_id).eq('idempotency_key', clave).limit(1).execute()
+    except Exception as e:
+        if es_tabla_inexistente(e):
+            _sin_tabla_ingestas_hasta = time.monotonic() + REINTENTO_SEG
+        current_app.logger.warning(f"{TABLA_INGESTAS} no disponible: {e}")
+        return None
+    if res.data:
+        previo = res.data[0]['resultado']
+        _ingestas_recientes.set((orden_id, clave), previo)
+    return previo
+
+
+def guardar_ingesta(supabase, orden_id, clave: str, resultado: dict) -> None:
+    global _sin_tabla_ingestas_hasta
+    _ingestas_recientes.set((orden_id, clave), resultado)
+    if time.monotonic() < _sin_tabla_ingestas_hasta:
+        return
+    try:
+        supabase.table(TABLA_INGESTAS).upsert({
+            'orden_id': orden_id, 'idempotency_key': clave, 'resultado': resultado
+        }, on_conflict='orden_id,idempotency_key', returning='minimal').execute()
+    except Exception as e:
+        if es_tabla_inexistente(e):
+            _sin_tabla_ingestas_hasta = time.monotonic() + REINTENTO_SEG
+        current_app.logger.warning(f"No se pudo guardar {TABLA_INGESTAS}: {e}")
@@ -0,0 +1,122 @@
+"""Sesión HTTP saliente compartida por el proceso.
+
+Se crea una sola vez en `create_app` (init_http) y queda en
+app.config['HTTP_SESSION']. Mantiene conexiones keep-alive por host (así una
+descarga al Storage no paga un handshake TCP/TLS nuevo) y reintenta con
+backoff los GET/HEAD que fallan por conexión o con 502/503/504, esperando a lo
+sumo HTTP_ESPERA_MAX_SEG entre intentos.
+
+`requests.Session` se comparte entre los hilos de gthread: el pool de urllib3
+es thread-safe y la sesión no guarda cookies de las respuestas del Storage.
+"""
+import os
+import threading
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_HOSTS = int(os.environ.get('HTTP_POOL_HOSTS', 4))
+# Conexiones por host; con gthread conviene igualar la cantidad de hilos por worker
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 16))
+HTTP_REINTENTOS = int(os.environ.get('HTTP_REINTENTOS', 2))
+HTTP_BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.3))
+# Tope de espera entre reintentos (backoff y Retry-After): cada espera ocupa un hilo del worker
+HTTP_ESPERA_MAX_SEG = float(os.environ.get('HTTP_ESPERA_MAX_SEG', 2))
+
+_lock = threading.Lock()
+_sesion = None
+_metricas = {
+    'requests': 0,
+    'errores_5xx': 0,
+    'reintentos': 0,
+}
+
+
+def _registrar(respuesta, *args, **kwargs):
+    reintentos = getattr(getattr(respuesta.raw, 'retries', None), 'history', None) or ()
+    with _lock:
+        _metricas['requests'] += 1
+        _metricas['reintentos'] += len(reintentos)
+        if respuesta.status_code >= 500:
+            _metricas['errores_5xx'] += 1
+
+
+class _Reintentos(Retry):
+    """Retry que respeta Retry-After solo hasta HTTP_ESPERA_MAX_SEG."""
+
+    def get_retry_after(self, response):
+        espera = super().get_retry_after(response)
+        return None if espera is None else min(espera, HTTP_ESPERA_MAX_SEG)
+
+
+def crear_sesion() -> requests.Session:
+    reintentos = _Reintentos(
+        total=HTTP_REINTENTOS,
+        backoff_factor=HTTP_BACKOFF,
+        backoff_max=HTTP_ESPERA_MAX_SEG,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        respect_retry_after_header=True,
+        # Agotados los reintentos se entrega la última respuesta (el endpoint decide el error)
+        raise_on_status=False,
+    )
+    adaptador = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                            max_retries=reintentos)
+    sesion = requests.Session()
+    sesion.mount('https://', adaptador)
+    sesion.mount('http://', adaptador)
+    sesion.hooks['response'].append(_registrar)
+    return sesion
+
+
+def init_http(app) -> requests.Session:
+    """Crea la sesión compartida y la deja en app.config['HTTP_SESSION']."""
+    global _sesion
+    _sesion = crear_sesion()
+    app.config['HTTP_SESSION'] = _sesion
+    return _sesion
+
+
+def sesion_http() -> requests.Session:
+    """Sesión de la app actual; fuera de contexto (o sin init_http) una del módulo."""
+    global _sesion
+    try:
+        sesion = current_app.config.get('HTTP_SESSION')
+    except RuntimeError:
+        sesion = None
+    if sesion is not None:
+        return sesion
+    with _lock:
+        if _sesion is None:
+            _sesion = crear_sesion()
+        return _sesion
+
+
+def estado_http() -> dict:
+    """Uso de los pools por host del proceso actual y contadores de requests."""
+    sesion = _sesion
+    pools = []
+    if sesion is not None:
+        administrador = sesion.get_adapter('https://').poolmanager
+        for clave in list(administrador.pools.keys()):
+            pool = administrador.pools.get(clave)
+            if pool is None:
+                continue
+            # La cola del pool tiene maxsize lugares (conexiones libres o vacíos): el resto está en uso
+            en_uso = pool.pool.maxsize - pool.pool.qsize() if pool.pool is not None else 0
+            pools.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'conexiones_creadas': pool.num_connections,
+                'conexiones_en_uso': en_uso,
+                'requests': pool.num_requests,
+                'max_por_host': HTTP_POOL_MAXSIZE,
+            })
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'max_hosts': HTTP_POOL_HOSTS,
+            'pools': pools,
+            **_metricas,
+        }
@@ -0,0 +1,96 @@
+"""Snapshot en memoria de los KPIs del dashboard (/api/reportes/kpis_resumen).
+
+Los conteos solo cambian cuando se escriben vehículos, conductores, órdenes o
+mantenimientos; esos blueprints llaman a `invalidar_kpis()` tras cada escritura.
+Mientras el snapshot está fresco (KPI_CACHE_TTL) se sirve sin tocar la base.
+Vencido el TTL y dentro de la ventana KPI_STALE_WHILE_REVALIDATE, o tras una
+invalidación, se sirve el valor anterior y el recálculo corre en un hilo
+propio (no en el pool de consultas, que el propio cálculo usa), de modo que
+solo el primer request del proceso espera el cálculo.
+
+El snapshot es por proceso: la invalidación solo alcanza al worker que atendió
+la escritura; el resto converge al vencer el TTL.
+"""
+import os
+import threading
+import time
+
+from flask import current_app
+
+KPI_CACHE_TTL = float(os.environ.get('KPI_CACHE_TTL', 30))
+KPI_STALE_WHILE_REVALIDATE = float(os.environ.get('KPI_STALE_WHILE_REVALIDATE', 300))
+
+_lock = threading.Lock()
+_snapshot = {'data': None, 'generado': 0.0, 'version': 0, 'refrescando': False, 'invalidado': False}
+
+
+def invalidar_kpis() -> None:
+    """Marca el snapshot como obsoleto; la próxima lectura lo sirve y recalcula en segundo plano."""
+    with _lock:
+        _snapshot['invalidado'] = True
+        _snapshot['version'] += 1
+
+
+def _guardar(data, version) -> None:
+    with _lock:
+        # Una escritura ocurrida durante el cálculo deja el resultado obsoleto
+        if version == _snapshot['version']:
+            _snapshot['data'] = data
+            _snapshot['generado'] = time.monotonic()
+            _snapshot['invalidado'] = False
+
+
+def _calcular_y_guardar(calcular, version):
+    data, completo = calcular()
+    # Un conteo fallido se reporta como 0; no se cachea para no fijar un valor erróneo
+    if completo:
+        _guardar(data, version)
+    return data
+
+
+def _refrescar_en_fondo(app, calcular, version) -> None:
+    try:
+        with app.app_context():
+            _calcular_y_guardar(calcular, version)
+    except Exception as e:
+        app.logger.warning(f"No se pudo refrescar snapshot de KPIs: {e}")
+    finally:
+        with _lock:
+            _snapshot['refrescando'] = False
+
+
+def obtener_kpis(calcular) -> tuple[dict, str]:
+    """Retorna (kpis, estado) con estado 'HIT', 'STALE' o 'MISS'.
+
+    `calcular` es un callable sin argumentos que retorna (kpis, completo).
+    """
+    app = current_app._get_current_object()
+    ahora = time.monotonic()
+    with _lock:
+        data = _snapshot['data']
+        edad = ahora - _snapshot['generado']
+        version = _snapshot['version']
+        invalidado = _snapshot['invalidado']
+        if data is not None and not invalidado and edad < KPI_CACHE_TTL:
+            return data, 'HIT'
+
+        if data is not None and (invalidado or edad < KPI_CACHE_TTL + KPI_STALE_WHILE_REVALIDATE):
+            lanzar = not _snapshot['refrescando']
+            _snapshot['refrescando'] = True
+        else:
+            lanzar = None
+
+    if lanzar is None:
+        return _calcular_y_guardar(calcular, version), 'MISS'
+
+    if lanzar:
+        try:
+            # Hilo propio: el cálculo reparte sus consultas en QUERY_POOL y no debe esperar detrás de sí mismo
+            threading.Thread(target=_refrescar_en_fondo, args=(app, calcular, version),
+                             name='kpis-refresco', daemon=True).start()
+        except RuntimeError as e:
+            # Intérprete apagándose: se sirve el snapshot anterior igualmente
+            with _lock:
+                _snapshot['refrescando'] = False
+            app.logger.warning(f"No se pudo programar refresco de KPIs: {e}")
+    return data, 'STALE'
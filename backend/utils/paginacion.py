@@ -0,0 +1,116 @@
+"""Paginación por cursor (keyset) para los listados.
+
+Un cursor es opaco para el cliente: codifica los valores de la clave de orden
+de la última fila entregada (siempre terminada en `id` para desempatar). La
+página siguiente se pide con un filtro `(clave, id) > cursor` en vez de un
+OFFSET, por lo que su costo no crece con la profundidad.
+
+`orden` es una lista de (columna, desc). Se respeta el orden por defecto de
+Postgres para NULL (primero en DESC, al final en ASC), igual que `.order()`.
+"""
+import base64
+import json
+
+
+def _con_id(orden):
+    if orden and orden[-1][0] == 'id':
+        return list(orden)
+    return list(orden) + [('id', orden[-1][1] if orden else False)]
+
+
+def codificar_cursor(valores: list) -> str:
+    raw = json.dumps(valores, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor: str, n_claves: int) -> list:
+    """Retorna los valores del cursor; ValueError si es inválido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valores = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Cursor inválido') from e
+    if not isinstance(valores, list) or len(valores) != n_claves or valores[-1] is None:
+        raise ValueError('Cursor inválido')
+    return valores
+
+
+def _literal(valor) -> str:
+    # Comillas dobles para que comas, paréntesis o ':' no rompan la sintaxis de or=(...)
+    texto = str(valor).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{texto}"'
+
+
+def _condicion_posterior(col, desc, valor):
+    """Condiciones (lista OR) para filas estrictamente después de `valor` en `col`."""
+    if valor is None:
+        # NULL va primero en DESC: lo siguiente son los no nulos. En ASC va al final: no hay más.
+        return [f'{col}.not.is.null'] if desc else []
+    op = 'lt' if desc else 'gt'
+    condiciones = [f'{col}.{op}.{_literal(valor)}']
+    if not desc and col != 'id':
+        condiciones.append(f'{col}.is.null')
+    return condiciones
+
+
+def _igual(col, valor):
+    return f'{col}.is.null' if valor is None else f'{col}.eq.{_literal(valor)}'
+
+
+def _filtro_keyset(orden, valores) -> str:
+    """Expande (c1, c2, ..., id) > (v1, v2, ..., vid) a la sintaxis lógica de PostgREST."""
+    ramas = []
+    for i, (col, desc) in enumerate(orden):
+        prefijo = [_igual(c, v) for (c, _), v in zip(orden[:i], valores[:i])]
+        for cond in _condicion_posterior(col, desc, valores[i]):
+            ramas.append(f"and({','.join(prefijo + [cond])})" if prefijo else cond)
+    return ','.join(ramas)
+
+
+def preparar_pagina(query, orden, page: int, per_page: int, cursor: str | None = None):
+    """Ordena y limita `query`. Con `cursor` usa keyset; si no, OFFSET por `page`.
+
+    Pide una fila extra para saber si hay página siguiente (ver `cerrar_pagina`).
+    Lanza ValueError si el cursor no es válido.
+    """
+    orden = _con_id(orden)
+    if cursor:
+        valores = decodificar_cursor(cursor, len(orden))
+        filtro = _filtro_keyset(orden, valores)
+        if filtro:
+            query = query.or_(filtro)
+    for col, desc in orden:
+        query = query.order(col, desc=desc)
+    if cursor:
+        return query.limit(per_page + 1)
+    start = (page - 1) * per_page
+    return query.range(start, start + per_page)
+
+
+def cerrar_pagina(data: list, orden, per_page: int):
+    """Recorta la fila extra y retorna (data, next_cursor)."""
+    orden = _con_id(orden)
+    if len(data) <= per_page:
+        return data, None
+    data = data[:per_page]
+    ultima = data[-1]
+    return data, codificar_cursor([ultima.get(col) for col, _ in orden])
+
+
+MODOS_CONTEO = ('exact', 'planned', 'none')
+
+
+def modo_conteo(valor: str | None, cursor: str | None = None) -> str | None:
+    """Traduce ?count= al argumento `count` de `.select()`.
+
+    'exact' (default) cuenta con COUNT(*); 'planned' usa la estimación del
+    planificador de Postgres; 'none' no cuenta. Con cursor no se cuenta: el
+    filtro keyset haría que el total solo cubra las filas restantes.
+    Lanza ValueError si el modo no es válido.
+    """
+    valor = (valor or 'exact').lower()
+    if valor not in MODOS_CONTEO:
+        raise ValueError(f"count debe ser uno de: {', '.join(MODOS_CONTEO)}")
+    if cursor or valor == 'none':
+        return None
+    return valor
@@ -0,0 +1,92 @@
+"""Última posición conocida de los vehículos con orden en curso.
+
+La fuente compartida es el fin de ruta de `flota_orden_rutas_resumen`, que
+actualizan todos los workers al escribir cada lote. Cada worker además guarda
+en memoria el último punto de los lotes que recibió (`actualizar_posicion`),
+pero solo lo prefiere durante POSICIONES_VENTANA_SEG tras recibirlo, lo que
+tarda el resumen en reflejarlo (vaciado de la cola GPS + caché de aquí).
+Pasada la ventana todos los workers responden lo mismo, así un cliente
+repartido entre workers no ve retroceder los marcadores ni cambiar el ETag.
+Las órdenes en curso y sus resúmenes se cachean POSICIONES_CACHE_SEG segundos,
+así un mapa que consulta cada pocos segundos cuesta a lo sumo dos consultas
+por worker en ese intervalo, independiente de la cantidad de puntos.
+"""
+import hashlib
+import json
+import os
+from datetime import timezone
+
+from .cache import TTLCache
+from .gps_cola import GPS_COLA_INTERVALO
+from .rutas import _leer, leer_timestamp
+
+POSICIONES_CACHE_SEG = float(os.environ.get('POSICIONES_CACHE_SEG', 2))
+# Tiempo durante el que un punto recibido por este worker puede no estar aún en el resumen
+POSICIONES_VENTANA_SEG = float(os.environ.get('POSICIONES_VENTANA_SEG', GPS_COLA_INTERVALO + POSICIONES_CACHE_SEG + 1))
+
+# orden_id -> último punto recibido por este worker; expira a los POSICIONES_VENTANA_SEG de recibido
+_ultimas = TTLCache(maxsize=20000, ttl=max(POSICIONES_VENTANA_SEG, 1))
+_activas = TTLCache(maxsize=1, ttl=POSICIONES_CACHE_SEG)
+
+
+def actualizar_posicion(orden_id, punto: dict | None) -> None:
+    """Registra `punto` ({latitud, longitud, timestamp, velocidad}) si es más nuevo que el guardado."""
+    if not punto or not punto.get('timestamp'):
+        return
+    actual = _ultimas.get(orden_id)
+    # Los timestamps se normalizan a ISO en UTC en la ingesta: se comparan como texto
+    if actual is None or punto['timestamp'] >= actual['timestamp']:
+        _ultimas.set(orden_id, {k: punto.get(k) for k in ('latitud', 'longitud', 'timestamp', 'velocidad')})
+
+
+def ultimo_punto(filas: list) -> dict | None:
+    return max(filas, key=lambda f: f['timestamp']) if filas else None
+
+
+def _iso_utc(valor) -> str:
+    # El resumen viene de Postgres (con 'Z' u otro offset); se lleva al formato de la ingesta
+    t = leer_timestamp(valor)
+    return t.astimezone(timezone.utc).isoformat() if t else ''
+
+
+def _ordenes_en_curso(supabase) -> tuple[list, dict]:
+    cache = _activas.get('en_curso')
+    if cache is not None:
+        return cache
+    res = supabase.table('flota_ordenes').select(
+        'id, vehiculo_id, vehiculo:flota_vehiculos(placa, marca, modelo), conductor:flota_conductores(nombre, apellido)'
+    ).eq('estado', 'en_curso').order('id').execute()
+    ordenes = res.data or []
+    resumenes = _leer(supabase, [o['id'] for o in ordenes]) if ordenes else {}
+    _activas.set('en_curso', (ordenes, resumenes))
+    return ordenes, resumenes
+
+
+def obtener_posiciones(supabase) -> tuple[list, str]:
+    """(posiciones de todas las órdenes en curso, firma para el ETag). Sin puntos, lat/lng van en None."""
+    ordenes, resumenes = _ordenes_en_curso(supabase)
+    data = []
+    for orden in ordenes:
+        oid = orden['id']
+        resumen = resumenes.get(oid) or {}
+        posicion = {
+            'latitud': resumen.get('fin_latitud'),
+            'longitud': resumen.get('fin_longitud'),
+            'timestamp': resumen.get('fin_timestamp'),
+            'velocidad': None,
+        }
+        # Pasada la ventana la entrada ya expiró y manda el resumen compartido
+        memoria = _ultimas.get(oid)
+        if memoria and (posicion['timestamp'] is None or memoria['timestamp'] > _iso_utc(posicion['timestamp'])):
+            posicion = memoria
+        vehiculo = orden.get('vehiculo') or {}
+        conductor = orden.get('conductor') or {}
+        data.append({
+            'orden_id': oid,
+            'vehiculo_id': orden.get('vehiculo_id'),
+            'placa': vehiculo.get('placa'),
+            'vehiculo': f"{vehiculo.get('marca') or ''} {vehiculo.get('modelo') or ''}".strip() or None,
+            'conductor': f"{conductor.get('nombre') or ''} {conductor.get('apellido') or ''}".strip() or None,
+            **posicion,
+        })
+    return data, hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
@@ -0,0 +1,60 @@
+"""Ejecución concurrente de consultas independientes dentro de un request.
+
+El pool se crea una sola vez en `create_app` (init_query_pool) y se comparte
+entre requests. Cada consulta es un callable sin argumentos que retorna la
+respuesta de Supabase; un fallo o timeout en una no afecta a las demás.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import current_app
+
+
+def init_query_pool(app):
+    """Crea el pool acotado de hilos para consultas y lo deja en app.config['QUERY_POOL']."""
+    workers = int(os.environ.get('QUERY_POOL_WORKERS', 8))
+    app.config['QUERY_POOL'] = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='consultas')
+    app.config['QUERY_TIMEOUT'] = float(os.environ.get('QUERY_TIMEOUT', 20))
+    return app.config['QUERY_POOL']
+
+
+def _run_with_context(app, fn):
+    with app.app_context():
+        return fn()
+
+
+def ejecutar_consultas(consultas: dict, timeout: float | None = None) -> dict:
+    """Ejecuta {nombre: callable} en paralelo y retorna {nombre: resultado}.
+
+    Si una consulta falla o excede `timeout` segundos (medido desde el envío del
+    lote), su resultado es None y se registra un warning. Sin pool configurado,
+    las consultas se ejecutan en secuencia con el mismo aislamiento de errores.
+    """
+    app = current_app._get_current_object()
+    pool = app.config.get('QUERY_POOL')
+    timeout = timeout if timeout is not None else app.config.get('QUERY_TIMEOUT', 20)
+    resultados = {}
+
+    if not pool or len(consultas) <= 1:
+        for nombre, fn in consultas.items():
+            try:
+                resultados[nombre] = fn()
+            except Exception as e:
+                app.logger.warning(f"Consulta '{nombre}' falló: {e}")
+                resultados[nombre] = None
+        return resultados
+
+    deadline = time.monotonic() + timeout
+    futuros = {nombre: pool.submit(_run_with_context, app, fn) for nombre, fn in consultas.items()}
+    for nombre, futuro in futuros.items():
+        try:
+            resultados[nombre] = futuro.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            futuro.cancel()
+            app.logger.warning(f"Consulta '{nombre}' excedió {timeout}s")
+            resultados[nombre] = None
+        except Exception as e:
+            app.logger.warning(f"Consulta '{nombre}' falló: {e}")
+            resultados[nombre] = None
+    return resultados
@@ -0,0 +1,42 @@
+"""Llamadas a funciones SQL (supabase.rpc) con respaldo en Python.
+
+Las funciones se crean con las migraciones de backend/migrations/. Si una base
+aún no las tiene, `llamar_rpc` retorna None y el endpoint sigue por su camino
+en Python; la ausencia se recuerda por REINTENTO_RPC_SEG para no pagar un
+round-trip fallido en cada request.
+"""
+import time
+
+from flask import current_app
+
+REINTENTO_RPC_SEG = 300
+
+_no_disponibles = {}
+
+
+def _es_funcion_inexistente(error) -> bool:
+    texto = str(error)
+    # PGRST202: PostgREST no encuentra la función; 42883: undefined_function en Postgres
+    return 'PGRST202' in texto or '42883' in texto or 'Could not find the function' in texto
+
+
+def es_tabla_inexistente(error) -> bool:
+    """True si el error indica que la tabla no existe (migración sin aplicar)."""
+    texto = str(error)
+    # PGRST205: PostgREST no encuentra la tabla; 42P01: undefined_table en Postgres
+    return 'PGRST205' in texto or '42P01' in texto or 'Could not find the table' in texto
+
+
+def llamar_rpc(supabase, nombre: str, params: dict | None = None):
+    """Ejecuta la función `nombre` y retorna su `data`, o None si no está disponible."""
+    if time.monotonic() < _no_disponibles.get(nombre, 0.0):
+        return None
+    try:
+        return supabase.rpc(nombre, params or {}).execute().data
+    except Exception as e:
+        if _es_funcion_inexistente(e):
+            _no_disponibles[nombre] = time.monotonic() + REINTENTO_RPC_SEG
+            current_app.logger.info(f"Función {nombre} no existe; usando cálculo en Python")
+        else:
+            current_app.logger.warning(f"Error en rpc {nombre}, usando cálculo en Python: {e}")
+        return None
@@ -0,0 +1,570 @@
+"""Resumen por orden de la ruta GPS: primer punto, último punto y cantidad.
+
+Se guarda en `flota_orden_rutas_resumen` (backend/migrations/003_flota_orden_rutas_resumen.sql)
+y se actualiza en cada ingesta de puntos, de modo que el historial de rutas de
+un vehículo no necesita leer `flota_orden_rutas`. La suma de cada lote se hace
+en SQL (`flota_rutas_resumen_sumar`, migración 008) para que ingestas
+concurrentes de distintos workers no pierdan puntos. Las órdenes sin fila de
+resumen (rutas anteriores a la tabla) se calculan una vez con la función
+`flota_rutas_resumen` y quedan guardadas.
+
+Además mantiene niveles de detalle por orden (`flota_orden_rutas_niveles`,
+migración 004) para que el mapa no tenga que leer todos los puntos crudos, y
+las métricas del viaje calculadas desde la traza (`flota_orden_rutas_metricas`,
+migración 006).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+from .cache import TTLCache
+from .geo import niveles_detalle, codificar_polyline, codificar_deltas, metricas_trayecto, rangos_celdas
+from .query_batch import ejecutar_consultas
+from .rpc import llamar_rpc, es_tabla_inexistente
+
+TABLA_RESUMEN_RUTAS = 'flota_orden_rutas_resumen'
+TABLA_NIVELES_RUTA = 'flota_orden_rutas_niveles'
+TABLA_METRICAS_RUTA = 'flota_orden_rutas_metricas'
+NIVELES_RUTA = (100, 500, 2000)
+# Filas por página al leer puntos crudos (tope por defecto de PostgREST)
+PAGINA_PUNTOS = 1000
+# Un nivel obsoleto solo se regenera desde una lectura si la ruta lleva este tiempo sin puntos nuevos
+NIVELES_INACTIVIDAD_SEG = 600
+# Hilos del pool propio de reconstrucciones (lecturas largas, fuera del QUERY_POOL de los requests)
+NIVELES_WORKERS = int(os.environ.get('NIVELES_WORKERS', 2))
+# Espera mínima entre reconstrucciones de una misma orden disparadas por lecturas (se duplica hasta el máximo)
+NIVELES_REINTENTO_SEG = 600
+NIVELES_REINTENTO_MAX_SEG = 6 * 3600
+FORMATOS_RUTA = ('json', 'polyline', 'columnar')
+# Consultas de flota por tiempo/área: ventana máxima y tope de puntos por respuesta
+CONSULTA_MAX_HORAS = 24
+CONSULTA_MAX_PUNTOS = 10000
+# Sobre esta cantidad de filas de la grilla el área se filtra solo por lat/lng (la ventana de tiempo acota)
+CONSULTA_MAX_FILAS_GRILLA = 100
+# Órdenes sin métricas que un mismo listado puede mandar a calcular en segundo plano
+MAX_METRICAS_PROGRAMADAS = 20
+# Sobre esta cantidad de IDs se divide el filtro `in` en lotes (evita URLs gigantes)
+MAX_IDS_FILTRO = 200
+# Campos del resumen de un lote que se suman al de la orden
+CAMPOS_LOTE = ('total_puntos', 'inicio_latitud', 'inicio_longitud', 'inicio_timestamp',
+               'fin_latitud', 'fin_longitud', 'fin_timestamp')
+# Si la tabla de resumen no existe, no se reintenta leerla hasta pasado este tiempo
+REINTENTO_TABLA_SEG = 300
+
+_tabla_no_disponible_hasta = 0.0
+_niveles_no_disponible_hasta = 0.0
+_metricas_no_disponible_hasta = 0.0
+_niveles_pendientes = set()
+_niveles_lock = threading.Lock()
+_pool_niveles = None
+# orden_id -> (reconstrucciones disparadas por lecturas, monotonic antes del cual no se repite)
+_reintentos_niveles = TTLCache(maxsize=20000, ttl=2 * NIVELES_REINTENTO_MAX_SEG)
+
+
+def leer_timestamp(valor):
+    """Timestamp ISO -> datetime aware (UTC si viene sin zona); None si no se puede leer."""
+    if not valor:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(valor).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _lotes(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), MAX_IDS_FILTRO):
+        yield ids[i:i + MAX_IDS_FILTRO]
+
+
+def resumen_desde_puntos(orden_id, puntos: list) -> dict:
+    """Resumen de un lote de puntos ({latitud, longitud, timestamp})."""
+    resumen = {
+        'orden_id': orden_id,
+        'total_puntos': len(puntos),
+        'inicio_latitud': None, 'inicio_longitud': None, 'inicio_timestamp': None,
+        'fin_latitud': None, 'fin_longitud': None, 'fin_timestamp': None,
+    }
+    inicio = fin = None
+    for p in puntos:
+        t = leer_timestamp(p.get('timestamp'))
+        if t is None:
+            continue
+        if inicio is None or t < inicio[0]:
+            inicio = (t, p)
+        if fin is None or t >= fin[0]:
+            fin = (t, p)
+    for prefijo, extremo in (('inicio', inicio), ('fin', fin)):
+        if extremo:
+            resumen[f'{prefijo}_latitud'] = extremo[1].get('latitud')
+            resumen[f'{prefijo}_longitud'] = extremo[1].get('longitud')
+            resumen[f'{prefijo}_timestamp'] = extremo[1].get('timestamp')
+    return resumen
+
+
+def _fusionar(actual: dict, nuevo: dict) -> dict:
+    r = dict(actual)
+    r['total_puntos'] = (actual.get('total_puntos') or 0) + (nuevo.get('total_puntos') or 0)
+    t_ini_a, t_ini_n = leer_timestamp(actual.get('inicio_timestamp')), leer_timestamp(nuevo.get('inicio_timestamp'))
+    if t_ini_n and (t_ini_a is None or t_ini_n < t_ini_a):
+        for k in ('inicio_latitud', 'inicio_longitud', 'inicio_timestamp'):
+            r[k] = nuevo[k]
+    t_fin_a, t_fin_n = leer_timestamp(actual.get('fin_timestamp')), leer_timestamp(nuevo.get('fin_timestamp'))
+    if t_fin_n and (t_fin_a is None or t_fin_n >= t_fin_a):
+        for k in ('fin_latitud', 'fin_longitud', 'fin_timestamp'):
+            r[k] = nuevo[k]
+    return r
+
+
+def punto_inicio(resumen: dict | None):
+    if not resumen or not resumen.get('total_puntos') or resumen.get('inicio_timestamp') is None:
+        return None
+    return {'latitud': resumen['inicio_latitud'], 'longitud': resumen['inicio_longitud'], 'timestamp': resumen['inicio_timestamp']}
+
+
+def punto_fin(resumen: dict | None):
+    # Con un solo punto no hay "fin" distinto del inicio
+    if not resumen or (resumen.get('total_puntos') or 0) < 2 or resumen.get('fin_timestamp') is None:
+        return None
+    return {'latitud': resumen['fin_latitud'], 'longitud': resumen['fin_longitud'], 'timestamp': resumen['fin_timestamp']}
+
+
+def _calcular_por_orden(supabase, orden_ids) -> dict:
+    """Respaldo sin la función SQL: primer y último punto por orden, en paralelo."""
+    consultas = {}
+    for oid in orden_ids:
+        base = lambda oid=oid: supabase.table('flota_orden_rutas').select('latitud, longitud, timestamp', count='exact').eq('orden_id', oid)
+        consultas[(oid, 'ini')] = (lambda b=base: b().order('timestamp').limit(1).execute())
+        consultas[(oid, 'fin')] = (lambda b=base: b().order('timestamp', desc=True).limit(1).execute())
+    res = ejecutar_consultas(consultas)
+
+    resumenes = {}
+    for oid in orden_ids:
+        ini, fin = res.get((oid, 'ini')), res.get((oid, 'fin'))
+        if ini is None or fin is None:
+            continue
+        puntos = (ini.data or []) + (fin.data or [])
+        r = resumen_desde_puntos(oid, puntos)
+        r['total_puntos'] = ini.count or 0
+        resumenes[oid] = r
+    return resumenes
+
+
+def calcular_resumenes_ruta(supabase, orden_ids) -> dict:
+    """Calcula los resúmenes desde `flota_orden_rutas` (una llamada RPC por lote)."""
+    ids = [oid for oid in orden_ids if oid]
+    resumenes = {}
+    for lote in _lotes(ids):
+        filas = llamar_rpc(supabase, 'flota_rutas_resumen', {'p_orden_ids': lote})
+        if filas is None:
+            resumenes.update(_calcular_por_orden(supabase, lote))
+            continue
+        for f in filas:
+            resumenes[f['orden_id']] = f
+        for oid in lote:
+            resumenes.setdefault(oid, resumen_desde_puntos(oid, []))
+    return resumenes
+
+
+def _guardar(supabase, resumenes: list, sobrescribir: bool = True) -> None:
+    """Upsert de resúmenes. Con sobrescribir=False no pisa filas existentes (las escribe la ingesta)."""
+    global _tabla_no_disponible_hasta
+    if not resumenes or time.monotonic() < _tabla_no_disponible_hasta:
+        return
+    ahora = datetime.now(timezone.utc).isoformat()
+    try:
+        supabase.table(TABLA_RESUMEN_RUTAS).upsert(
+            [{**r, 'actualizado_en': ahora} for r in resumenes], on_conflict='orden_id',
+            ignore_duplicates=not sobrescribir, returning='minimal'
+        ).execute()
+    except Exception as e:
+        if es_tabla_inexistente(e):
+            _tabla_no_disponible_hasta = time.monotonic() + REINTENTO_TABLA_SEG
+        current_app.logger.warning(f"No se pudo guardar {TABLA_RESUMEN_RUTAS}: {e}")
+
+
+def _leer(supabase, orden_ids) -> dict:
+    global _tabla_no_disponible_hasta
+    if time.monotonic() < _tabla_no_disponible_hasta:
+        return {}
+    leidos = {}
+    try:
+        for lote in _lotes(orden_ids):
+            res = supabase.table(TABLA_RESUMEN_RUTAS).select('*').in_('orden_id', lote).execute()
+            leidos.update({r['orden_id']: r for r in (res.data or [])})
+    except Exception as e:
+        if es_tabla_inexistente(e):
+            _tabla_no_disponible_hasta = time.monotonic() + REINTENTO_TABLA_SEG
+        current_app.logger.warning(f"{TABLA_RESUMEN_RUTAS} no disponible, calculando en línea: {e}")
+    return leidos
+
+
+def obtener_resumenes_ruta(supabase, orden_ids) -> dict:
+    """Lee los resúmenes guardados; los faltantes se calculan y guardan en el momento."""
+    ids = [oid for oid in orden_ids if oid]
+    if not ids:
+        return {}
+    resumenes = _leer(supabase, ids)
+    faltantes = [oid for oid in ids if oid not in resumenes]
+    if faltantes:
+        calculados = calcular_resumenes_ruta(supabase, faltantes)
+        # Si una ingesta creó la fila mientras tanto, la suya prevalece
+        _guardar(supabase, list(calculados.values()), sobrescribir=False)
+        resumenes.update(calculados)
+    return resumenes
+
+
+def registrar_puntos(supabase, orden_id, puntos: list | None = None, resumen_lote: dict | None = None) -> None:
+    """Hook de ingesta: incorpora un lote recién insertado al resumen de la orden.
+
+    Recibe los puntos insertados o su resumen ya calculado (`resumen_lote`).
+    Sin ninguno de los dos el resumen se recalcula completo. La suma se hace
+    en la base (flota_rutas_resumen_sumar); sin la migración 008 se fusiona en
+    Python, sin protección ante ingestas concurrentes de la misma orden.
+    Best-effort: un fallo aquí nunca debe romper la ingesta que lo disparó.
+    """
+    try:
+        if resumen_lote is None and puntos is not None:
+            resumen_lote = resumen_desde_puntos(orden_id, puntos)
+        if resumen_lote is not None and not resumen_lote.get('total_puntos'):
+            return
+        lote = None if resumen_lote is None else {k: v for k, v in resumen_lote.items() if k in CAMPOS_LOTE}
+        if llamar_rpc(supabase, 'flota_rutas_resumen_sumar', {'p_orden_id': orden_id, 'p_lote': lote}) is not None:
+            return
+        actual = _leer(supabase, [orden_id]).get(orden_id) if resumen_lote is not None else None
+        if actual is None:
+            # Primera vez, ruta previa a la tabla o lote inexacto: se calcula completo, ya incluye el lote
+            resumen = calcular_resumenes_ruta(supabase, [orden_id]).get(orden_id)
+        else:
+            resumen = _fusionar(actual, resumen_lote)
+        if resumen:
+            resumen.pop('actualizado_en', None)
+            _guardar(supabase, [resumen])
+    except Exception as e:
+        current_app.logger.warning(f"No se pudo actualizar resumen de ruta de la orden {orden_id}: {e}")
+
+
+# --- Niveles de detalle ---
+
+def leer_puntos_ruta(supabase, orden_id, columnas: str = 'latitud, longitud, timestamp, velocidad') -> list:
+    """Todos los puntos de la orden en orden cronológico, paginando de a PAGINA_PUNTOS."""
+    puntos = []
+    while True:
+        res = supabase.table('flota_orden_rutas').select(columnas).eq('orden_id', orden_id) \
+            .order('timestamp').range(len(puntos), len(puntos) + PAGINA_PUNTOS - 1).execute()
+        pagina = res.data or []
+        puntos.extend(pagina)
+        if len(pagina) < PAGINA_PUNTOS:
+            return puntos
+
+
+def metricas_ruta(puntos: list) -> dict:
+    """Métricas del viaje (ver geo.metricas_trayecto) desde puntos en orden cronológico."""
+    validos = []
+    for p in puntos:
+        t = leer_timestamp(p.get('timestamp'))
+        if t is not None and p.get('latitud') is not None and p.get('longitud') is not None:
+            validos.append((p, t))
+    t0 = validos[0][1] if validos else None
+    return metricas_trayecto(
+        [p['latitud'] for p, _ in validos],
+        [p['longitud'] for p, _ in validos],
+        [(t - t0).total_seconds() for _, t in validos],
+    )
+
+
+def _al_dia(fila: dict | None, resumen: dict | None) -> bool:
+    """True si `fila` (nivel o métricas) se calculó con los puntos que describe `resumen`.
+
+    Se compara el último timestamp que leyó la reconstrucción con el fin del
+    resumen: un total de puntos desfasado no deja la fila obsoleta para siempre.
+    Filas sin fin_timestamp_origen (anteriores a las migraciones 009/010) usan el total.
+    """
+    if not fila or not resumen or not resumen.get('total_puntos'):
+        return False
+    fin_origen = leer_timestamp(fila.get('fin_timestamp_origen'))
+    if fin_origen is not None:
+        fin = leer_timestamp(resumen.get('fin_timestamp'))
+        return fin is None or fin_origen >= fin
+    return fila.get('total_puntos_origen') == resumen['total_puntos']
+
+
+def _upsert_con_origen(supabase, tabla: str, filas, on_conflict: str) -> None:
+    try:
+        supabase.table(tabla).upsert(filas, on_conflict=on_conflict, returning='minimal').execute()
+    except Exception as e:
+        if 'fin_timestamp_origen' not in str(e):
+            raise
+        # Base sin la migración 009/010: se guarda sin la columna y la frescura se decide por el total
+        supabase.table(tabla).upsert([{k: v for k, v in f.items() if k != 'fin_timestamp_origen'} for f in filas],
+                                     on_conflict=on_conflict, returning='minimal').execute()
+
+
+def construir_niveles(supabase, orden_id) -> None:
+    """Recalcula y guarda los niveles de detalle y las métricas de la ruta de una orden.
+
+    Ambos salen de la misma lectura de puntos crudos.
+    """
+    global _niveles_no_disponible_hasta, _metricas_no_disponible_hasta
+    puntos = leer_puntos_ruta(supabase, orden_id)
+    if not puntos:
+        return
+    ahora = datetime.now(timezone.utc).isoformat()
+    # Último timestamp leído (puntos en orden cronológico)
+    fin_origen = puntos[-1].get('timestamp')
+
+    if time.monotonic() >= _metricas_no_disponible_hasta:
+        try:
+            _upsert_con_origen(supabase, TABLA_METRICAS_RUTA, [{
+                'orden_id': orden_id,
+                'metricas': metricas_ruta(puntos),
+                'total_puntos_origen': len(puntos),
+                'fin_timestamp_origen': fin_origen,
+                'calculado_en': ahora,
+            }], 'orden_id')
+        except Exception as e:
+            if es_tabla_inexistente(e):
+                _metricas_no_disponible_hasta = time.monotonic() + REINTENTO_TABLA_SEG
+            current_app.logger.warning(f"No se pudo guardar {TABLA_METRICAS_RUTA}: {e}")
+
+    niveles = niveles_detalle(puntos, NIVELES_RUTA)
+    if not niveles or time.monotonic() < _niveles_no_disponible_hasta:
+        return
+    filas = [{
+        'orden_id': orden_id,
+        'nivel': nivel,
+        'puntos': pts,
+        'total_puntos_origen': len(puntos),
+        'fin_timestamp_origen': fin_origen,
+        'generado_en': ahora,
+    } for nivel, pts in niveles.items()]
+    try:
+        _upsert_con_origen(supabase, TABLA_NIVELES_RUTA, filas, 'orden_id,nivel')
+    except Exception as e:
+        if es_tabla_inexistente(e):
+            _niveles_no_disponible_hasta = time.monotonic() + REINTENTO_TABLA_SEG
+        current_app.logger.warning(f"No se pudo guardar {TABLA_NIVELES_RUTA}: {e}")
+
+
+def _construir_en_fondo(app, orden_id) -> None:
+    try:
+        with app.app_context():
+            construir_niveles(app.config.get('SUPABASE'), orden_id)
+    except Exception as e:
+        app.logger.warning(f"No se pudieron construir niveles de ruta de la orden {orden_id}: {e}")
+    finally:
+        with _niveles_lock:
+            _niveles_pendientes.discard(orden_id)
+
+
+def programar_niveles(orden_id, forzar: bool = False) -> None:
+    """Encola la construcción de niveles y métricas (sin bloquear el request).
+
+    Corre en un pool propio de NIVELES_WORKERS hilos: una ráfaga de
+    reconstrucciones no demora las consultas de los requests en QUERY_POOL.
+    Salvo con `forzar` (fin de viaje), una misma orden no se reconstruye de
+    nuevo antes de NIVELES_REINTENTO_SEG, espera que se duplica en cada repetición.
+    """
+    global _pool_niveles
+    if not orden_id or time.monotonic() < min(_niveles_no_disponible_hasta, _metricas_no_disponible_hasta):
+        return
+    app = current_app._get_current_object()
+    with _niveles_lock:
+        if orden_id in _niveles_pendientes:
+            return
+        if not forzar:
+            intentos, no_antes = _reintentos_niveles.get(orden_id, (0, 0.0))
+            if time.monotonic() < no_antes:
+                return
+            espera = min(NIVELES_REINTENTO_SEG * 2 ** intentos, NIVELES_REINTENTO_MAX_SEG)
+            _reintentos_niveles.set(orden_id, (intentos + 1, time.monotonic() + espera))
+        _niveles_pendientes.add(orden_id)
+        if _pool_niveles is None:
+            _pool_niveles = ThreadPoolExecutor(max_workers=max(1, NIVELES_WORKERS), thread_name_prefix='niveles')
+        pool = _pool_niveles
+    try:
+        pool.submit(_construir_en_fondo, app, orden_id)
+    except RuntimeError:
+        _construir_en_fondo(app, orden_id)
+
+
+def obtener_nivel(supabase, orden_id, max_points: int):
+    """Nivel precalculado más detallado con <= max_points puntos, o None.
+
+    Si el nivel falta o está obsoleto (la ruta tiene puntos nuevos) retorna
+    None y, si la ruta está inactiva, programa su reconstrucción. La fila
+    incluye en 'metricas' las métricas del viaje si están al día (o None).
+    """
+    if max_points < min(NIVELES_RUTA) or time.monotonic() < _niveles_no_disponible_hasta:
+        return None
+
+    def _nivel():
+        global _niveles_no_disponible_hasta
+        try:
+            # '*': fin_timestamp_origen puede no existir aún (migración 009)
+            return supabase.table(TABLA_NIVELES_RUTA).select('*').eq('orden_id', orden_id) \
+                .lte('nivel', max_points).order('nivel', desc=True).limit(1).execute()
+        except Exception as e:
+            if es_tabla_inexistente(e):
+                _niveles_no_disponible_hasta = time.monotonic() + REINTENTO_TABLA_SEG
+            raise
+
+    consultas = {
+        'nivel': _nivel,
+        'resumen': lambda: _leer(supabase, [orden_id]).get(orden_id),
+    }
+    if time.monotonic() >= _metricas_no_disponible_hasta:
+        consultas['metricas'] = lambda: (_leer_metricas(supabase, [orden_id]) or {}).get(orden_id)
+    res = ejecutar_consultas(consultas)
+    if res['nivel'] is None:
+        return None
+
+    resumen = res['resumen']
+    total = (resumen or {}).get('total_puntos') or 0
+    fila = (res['nivel'].data or [None])[0]
+    if _al_dia(fila, resumen):
+        metricas = res.get('metricas')
+        fila['metricas'] = metricas['metricas'] if _al_dia(metricas, resumen) else None
+        return fila
+
+    # Solo vale la pena precalcular si la ruta supera lo pedido y ya no está recibiendo puntos
+    fin = leer_timestamp((resumen or {}).get('fin_timestamp'))
+    inactiva = fin is not None and datetime.now(timezone.utc) - fin > timedelta(seconds=NIVELES_INACTIVIDAD_SEG)
+    if total > max_points and inactiva:
+        programar_niveles(orden_id)
+    return None
+
+
+# --- Métricas de viaje ---
+
+def _leer_metricas(supabase, orden_ids) -> dict:
+    """{orden_id: fila de flota_orden_rutas_metricas}. Si la consulta falla, None."""
+    global _metricas_no_disponible_hasta
+    filas = {}
+    try:
+        for lote in _lotes(orden_ids):
+            # '*': fin_timestamp_origen puede no existir aún (migración 010)
+            res = supabase.table(TABLA_METRICAS_RUTA).select('*').in_('orden_id', lote).execute()
+            for fila in res.data or []:
+                filas[fila['orden_id']] = fila
+    except Exception as e:
+        if es_tabla_inexistente(e):
+            _metricas_no_disponible_hasta = time.monotonic() + REINTENTO_TABLA_SEG
+        current_app.logger.warning(f"{TABLA_METRICAS_RUTA} no disponible: {e}")
+        return None
+    return filas
+
+
+def obtener_metricas_ruta(supabase, orden_ids, resumenes: dict) -> dict:
+    """{orden_id: métricas} de las órdenes cuyas métricas guardadas están al día.
+
+    `resumenes` son los resúmenes de ruta de esas órdenes (obtener_resumenes_ruta);
+    su fin de ruta decide si una métrica está obsoleta (ver _al_dia). Las que faltan u
+    obsoletas se mandan a calcular en segundo plano (hasta MAX_METRICAS_PROGRAMADAS).
+    """
+    con_puntos = [oid for oid in dict.fromkeys(orden_ids) if oid and (resumenes.get(oid) or {}).get('total_puntos')]
+    if not con_puntos or time.monotonic() < _metricas_no_disponible_hasta:
+        return {}
+    guardadas = _leer_metricas(supabase, con_puntos)
+    if guardadas is None:
+        # Sin saber cuáles están al día no se programa nada
+        return {}
+    metricas, faltantes = {}, []
+    for oid in con_puntos:
+        fila = guardadas.get(oid)
+        if _al_dia(fila, resumenes[oid]):
+            metricas[oid] = fila['metricas']
+        else:
+            faltantes.append(oid)
+    for oid in faltantes[:MAX_METRICAS_PROGRAMADAS]:
+        programar_niveles(oid)
+    return metricas
+
+
+def odometro_sospechoso(km_odometro, metricas: dict | None) -> bool | None:
+    """True si los km del odómetro no cuadran con la distancia GPS; None si no hay con qué comparar.
+
+    La traza subestima algo la distancia real (tramos rectos entre muestras,
+    cortes de señal), por eso se tolera más hacia arriba que hacia abajo.
+    """
+    km_gps = (metricas or {}).get('distancia_km') or 0
+    if km_gps < 1 or km_odometro is None:
+        return None
+    return km_odometro < km_gps * 0.8 or km_odometro > km_gps * 2 + 10
+
+
+# --- Consultas de flota por tiempo y área ---
+
+def consultar_puntos(supabase, desde: datetime, hasta: datetime, bbox: tuple | None = None,
+                     orden_ids: list | None = None, limite: int = CONSULTA_MAX_PUNTOS):
+    """Puntos de todas las órdenes en [desde, hasta) y, opcionalmente, dentro de `bbox`.
+
+    `bbox` es (lng_min, lat_min, lng_max, lat_max). Se filtra por los rangos de
+    celdas de la grilla (índice celda, timestamp) y luego por las coordenadas
+    exactas. Se pagina de a PAGINA_PUNTOS (tope de filas de PostgREST) hasta
+    `limite` + 1 filas. Retorna (puntos ordenados por tiempo, truncado).
+    """
+    def _consulta():
+        query = supabase.table('flota_orden_rutas').select('orden_id, latitud, longitud, timestamp, velocidad') \
+            .gte('timestamp', desde.isoformat()).lt('timestamp', hasta.isoformat())
+        if orden_ids is not None:
+            query = query.in_('orden_id', list(orden_ids))
+        if bbox:
+            lng_min, lat_min, lng_max, lat_max = bbox
+            rangos = rangos_celdas(lat_min, lng_min, lat_max, lng_max)
+            if len(rangos) <= CONSULTA_MAX_FILAS_GRILLA:
+                query = query.or_(','.join(f'and(celda.gte.{a},celda.lte.{b})' for a, b in rangos))
+            query = query.gte('latitud', lat_min).lte('latitud', lat_max) \
+                .gte('longitud', lng_min).lte('longitud', lng_max)
+        # orden_id desempata puntos con el mismo timestamp: el orden entre páginas es estable
+        return query.order('timestamp').order('orden_id')
+
+    puntos = []
+    while len(puntos) <= limite:
+        pedidas = min(PAGINA_PUNTOS, limite + 1 - len(puntos))
+        pagina = _consulta().range(len(puntos), len(puntos) + pedidas - 1).execute().data or []
+        puntos.extend(pagina)
+        if len(pagina) < pedidas:
+            break
+    return puntos[:limite], len(puntos) > limite
+
+
+# --- Formatos de respuesta ---
+
+def formatear_puntos(puntos: list, formato: str = 'json'):
+    """Serializa puntos {latitud, longitud, timestamp, velocidad} en el formato pedido.
+
+    - json: lista de objetos (sin cambios).
+    - columnar: un arreglo por campo, alineados por índice.
+    - polyline: coordenadas como encoded polyline (precisión 1e-5); timestamps
+      como segundos desde `t0` y velocidades en décimas (-1 = sin dato), ambos
+      diferenciados y codificados con el mismo algoritmo. Un timestamp ilegible
+      repite el anterior. Los puntos sin coordenadas se omiten.
+    """
+    if formato == 'columnar':
+        return {campo: [p.get(campo) for p in puntos] for campo in ('latitud', 'longitud', 'timestamp', 'velocidad')}
+    if formato != 'polyline':
+        return puntos
+
+    validos = [p for p in puntos if p.get('latitud') is not None and p.get('longitud') is not None]
+    tiempos = [leer_timestamp(p.get('timestamp')) for p in validos]
+    t0 = next((t for t in tiempos if t is not None), None)
+    segundos, previo = [], 0.0
+    for t in tiempos:
+        if t is not None:
+            previo = (t - t0).total_seconds()
+        segundos.append(previo)
+    velocidades = [-1.0 if p.get('velocidad') is None else float(p['velocidad']) for p in validos]
+    return {
+        'puntos': len(validos),
+        'precision': 5,
+        'polyline': codificar_polyline([p['latitud'] for p in validos], [p['longitud'] for p in validos]),
+        't0': t0.isoformat() if t0 else None,
+        'timestamps': codificar_deltas(segundos),
+        'velocidades': codificar_deltas(velocidades, 10),
+    }
@@ -0,0 +1,158 @@
+"""URLs de archivos en Supabase Storage construidas localmente.
+
+`storage.from_(bucket).get_public_url(path)` solo concatena texto, pero crea un
+proxy del bucket por llamada y su tipo de retorno cambió entre versiones de
+storage3 (dict, objeto o str). Aquí la URL pública se arma directamente desde
+la URL base del Storage y se memoiza por (base, bucket, path).
+
+Para buckets privados las URLs firmadas se cachean por (bucket, path) hasta
+poco antes de expirar y los listados las piden en bloque (`create_signed_urls`,
+una llamada por página).
+"""
+import os
+from functools import lru_cache
+from urllib.parse import quote
+
+from .cache import TTLCache
+
+BUCKET_ADJUNTOS = 'adjuntos_ordenes'
+# Vigencia de las URLs firmadas y margen antes de su expiración en que dejan de reutilizarse
+URL_FIRMADA_SEG = int(os.environ.get('STORAGE_URL_FIRMADA_SEG', 3600))
+URL_FIRMADA_MARGEN_SEG = min(300, URL_FIRMADA_SEG // 4)
+# Con true los listados agregan signedUrl siempre (bucket privado), no solo con ?signed=true
+STORAGE_FIRMAR_URLS = os.environ.get('STORAGE_FIRMAR_URLS', 'false').lower() == 'true'
+# Paths por llamada a create_signed_urls
+LOTE_FIRMAS = 200
+
+_firmadas = TTLCache(maxsize=8192, ttl=max(URL_FIRMADA_SEG - URL_FIRMADA_MARGEN_SEG, 1))
+# Buckets cuya URL pública fue rechazada en este proceso: se descargan con URL firmada
+_buckets_privados = set()
+
+
+def _base_storage(supabase) -> str | None:
+    base = getattr(supabase, 'storage_url', None) if supabase is not None else None
+    if not base and os.environ.get('SUPABASE_URL'):
+        base = f"{os.environ['SUPABASE_URL'].rstrip('/')}/storage/v1"
+    return str(base).rstrip('/') if base else None
+
+
+@lru_cache(maxsize=8192)
+def _url_publica(base: str, bucket: str, path: str) -> str:
+    return f"{base}/object/public/{bucket}/{quote(path.lstrip('/'), safe='/')}"
+
+
+def url_publica(supabase, path: str | None, bucket: str = BUCKET_ADJUNTOS) -> str | None:
+    """URL pública de `path` en `bucket`, o None si no hay path o no se conoce el Storage."""
+    base = _base_storage(supabase)
+    if not path or not base:
+        return None
+    return _url_publica(base, bucket, path)
+
+
+def agregar_urls_publicas(supabase, items: list, campo: str = 'storage_path',
+                          destino: str = 'publicUrl', bucket: str = BUCKET_ADJUNTOS) -> list:
+    """Agrega `destino` con la URL pública de `item[campo]` a cada item (None si no tiene path)."""
+    base = _base_storage(supabase)
+    for item in items:
+        path = item.get(campo)
+        item[destino] = _url_publica(base, bucket, path) if path and base else None
+    return items
+
+
+def _url_de_firma(respuesta) -> str | None:
+    # storage3 retorna 'signedURL'; versiones anteriores usaban 'signedUrl' o data.signed_url
+    if not isinstance(respuesta, dict):
+        return getattr(respuesta, 'signedURL', None) or getattr(respuesta, 'signed_url', None)
+    return (respuesta.get('signedURL') or respuesta.get('signedUrl')
+            or (respuesta.get('data') or {}).get('signed_url'))
+
+
+def url_firmada(supabase, path: str | None, bucket: str = BUCKET_ADJUNTOS) -> str | None:
+    """URL firmada de `path`, reutilizada desde caché mientras le quede vigencia. None si falla."""
+    if not path or supabase is None:
+        return None
+    url = _firmadas.get((bucket, path))
+    if url is None:
+        try:
+            url = _url_de_firma(supabase.storage.from_(bucket).create_signed_url(path, URL_FIRMADA_SEG))
+        except Exception:
+            return None
+        if url:
+            _firmadas.set((bucket, path), url)
+    return url
+
+
+def urls_firmadas(supabase, paths, bucket: str = BUCKET_ADJUNTOS) -> dict:
+    """{path: URL firmada} para `paths`, pidiendo en bloque solo los que no están en caché."""
+    resultado, faltantes = {}, []
+    for path in dict.fromkeys(p for p in paths if p):
+        url = _firmadas.get((bucket, path))
+        if url is None:
+            faltantes.append(path)
+        else:
+            resultado[path] = url
+    for i in range(0, len(faltantes), LOTE_FIRMAS):
+        lote = faltantes[i:i + LOTE_FIRMAS]
+        try:
+            firmas = supabase.storage.from_(bucket).create_signed_urls(lote, URL_FIRMADA_SEG)
+        except Exception:
+            # storage3 falla el lote entero si un objeto no existe (signedURL null):
+            # se firma de a uno y los inexistentes quedan sin URL
+            for path in lote:
+                url = url_firmada(supabase, path, bucket)
+                if url:
+                    resultado[path] = url
+            continue
+        for item in firmas or []:
+            url = _url_de_firma(item)
+            if item.get('path') and url and not item.get('error'):
+                _firmadas.set((bucket, item['path']), url)
+                resultado[item['path']] = url
+    return resultado
+
+
+def agregar_urls_adjuntos(supabase, items: list, firmar: bool = False, campo: str = 'storage_path',
+                          bucket: str = BUCKET_ADJUNTOS) -> list:
+    """Agrega publicUrl y, si `firmar` (o STORAGE_FIRMAR_URLS), signedUrl a cada item.
+
+    Las firmas de toda la lista se piden en una sola llamada; si fallan,
+    signedUrl queda en None y publicUrl sigue disponible.
+    """
+    agregar_urls_publicas(supabase, items, campo=campo, bucket=bucket)
+    if not (firmar or STORAGE_FIRMAR_URLS) or not items:
+        return items
+    try:
+        firmadas = urls_firmadas(supabase, [item.get(campo) for item in items], bucket)
+    except Exception:
+        firmadas = {}
+    for item in items:
+        item['signedUrl'] = firmadas.get(item.get(campo))
+    return items
+
+
+def con_descarga(url: str, nombre: str | None) -> str:
+    """Agrega `download=<nombre>` a una URL del Storage: responde con Content-Disposition: attachment."""
+    url = url.rstrip('?')
+    separador = '&' if '?' in url else '?'
+    return f"{url}{separador}download={quote(nombre or '', safe='')}"
+
+
+def ruta_en_storage(supabase, url: str) -> str | None:
+    """Parte de `url` posterior a la URL base del Storage (para X-Accel-Redirect), o None."""
+    base = _base_storage(supabase)
+    if not base or not url.startswith(base + '/'):
+        return None
+    return url[len(base) + 1:]
+
+
+def bucket_privado(bucket: str = BUCKET_ADJUNTOS) -> bool:
+    return STORAGE_FIRMAR_URLS or bucket in _buckets_privados
+
+
+def marcar_bucket_privado(bucket: str = BUCKET_ADJUNTOS) -> None:
+    _buckets_privados.add(bucket)
+
+
+def pide_firmas(args) -> bool:
+    """True si el request pidió URLs firmadas (?signed=true)."""
+    return (args.get('signed') or '').lower() in ('1', 'true')
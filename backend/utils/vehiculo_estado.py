@@ -0,0 +1,216 @@
+"""Motor de estado de vehículos: odómetro, última mantención y recorrido.
+
+Un único cálculo compartido por vehiculos.py y reportes.py. El resultado se
+materializa por vehículo en `flota_vehiculos_resumen` (ver
+backend/migrations/001_flota_vehiculos_resumen.sql) y se refresca solo para
+los vehículos tocados por una escritura de órdenes o mantenimientos, de modo
+que los listados leen valores ya calculados en vez de re-agregar tablas completas.
+"""
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from .rpc import es_tabla_inexistente
+
+TABLA_RESUMEN = 'flota_vehiculos_resumen'
+INTERVALO_MANTENCION_DEFAULT = 10000
+UMBRAL_POR_VENCER_KM = 700
+# Deltas de odómetro por viaje sobre este valor se consideran errores de digitación
+KM_DELTA_MAX = 100000
+# IDs por filtro `in` (evita URLs gigantes); más IDs se consultan en varios lotes
+MAX_IDS_FILTRO = 200
+# Si la tabla de resumen no existe, no se reintenta leerla hasta pasado este tiempo
+REINTENTO_TABLA_SEG = 300
+
+_tabla_no_disponible_hasta = 0.0
+
+
+def _to_int(value):
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value))
+    except (ValueError, TypeError):
+        return None
+
+
+def resumen_vacio(vehiculo_id) -> dict:
+    return {
+        'vehiculo_id': vehiculo_id,
+        'km_max_ordenes': 0,
+        'km_max_mant': 0,
+        'km_actual': 0,
+        'km_ultima_mant': 0,
+        'fecha_ultima_mant': None,
+        'km_recorridos': 0,
+        'total_viajes': 0,
+    }
+
+
+def calcular_resumenes(ordenes: list, mantenimientos: list) -> dict:
+    """Agrega órdenes y mantenimientos en una sola pasada. Retorna {vehiculo_id: resumen}.
+
+    - km_max_ordenes: mayor kilometraje_inicio/fin registrado en órdenes.
+    - km_max_mant: mayor max(km_realizacion, km_programado) de cualquier mantenimiento.
+    - km_ultima_mant / fecha_ultima_mant: del mantenimiento FINALIZADO más reciente por
+      fecha_realizacion (base del intervalo); a igual fecha, el de más km.
+    - km_recorridos / total_viajes: sobre órdenes completadas con odómetro coherente.
+    """
+    resumenes = {}
+    ultima = {}
+
+    for o in ordenes:
+        vid = o.get('vehiculo_id')
+        if not vid:
+            continue
+        r = resumenes.get(vid)
+        if r is None:
+            r = resumenes[vid] = resumen_vacio(vid)
+
+        ki = _to_int(o.get('kilometraje_inicio'))
+        kf = _to_int(o.get('kilometraje_fin'))
+        for km in (ki, kf):
+            if km is not None and km > r['km_max_ordenes']:
+                r['km_max_ordenes'] = km
+
+        if str(o.get('estado') or '').lower() == 'completada':
+            r['total_viajes'] += 1
+            if ki is not None and kf is not None and 0 < kf - ki < KM_DELTA_MAX:
+                r['km_recorridos'] += kf - ki
+
+    for m in mantenimientos:
+        vid = m.get('vehiculo_id')
+        if not vid:
+            continue
+        r = resumenes.get(vid)
+        if r is None:
+            r = resumenes[vid] = resumen_vacio(vid)
+
+        # Si se cerró con menos km que el programado, asumimos que cubrió el hito programado
+        km = max(_to_int(m.get('km_realizacion')) or 0, _to_int(m.get('km_programado')) or 0)
+        if km > r['km_max_mant']:
+            r['km_max_mant'] = km
+
+        if m.get('estado') == 'FINALIZADO':
+            # Fechas ISO (YYYY-MM-DD) comparables como texto; sin fecha cuenta como la más antigua
+            clave = (m.get('fecha_realizacion') or '', km)
+            if clave > ultima.get(vid, ('', -1)):
+                ultima[vid] = clave
+                r['km_ultima_mant'] = km
+                r['fecha_ultima_mant'] = m.get('fecha_realizacion')
+
+    for r in resumenes.values():
+        r['km_actual'] = max(r['km_max_ordenes'], r['km_max_mant'])
+    return resumenes
+
+
+def estado_mantencion(resumen: dict | None, km_intervalo=None) -> dict:
+    """Campos de alerta de mantención por km a partir de un resumen."""
+    resumen = resumen or resumen_vacio(None)
+    intervalo = _to_int(km_intervalo) or INTERVALO_MANTENCION_DEFAULT
+    km_actual = resumen.get('km_actual') or 0
+    km_ultima = resumen.get('km_ultima_mant') or 0
+    km_proxima = km_ultima + intervalo
+    restante = km_proxima - km_actual
+
+    if restante < 0:
+        estado = 'VENCIDO'
+    elif restante <= UMBRAL_POR_VENCER_KM:
+        estado = 'POR_VENCER'
+    else:
+        estado = 'OK'
+
+    return {
+        'km_actual_calculado': km_actual,
+        'km_ultima_mant': km_ultima,
+        'mant_proxima_km': km_proxima,
+        'mant_restante_km': restante,
+        'mant_estado': estado,
+    }
+
+
+def _leer_por_ids(consulta, vehiculo_ids) -> list:
+    """Filas de `consulta()` para vehiculo_ids (todas si es None), con `in` por lotes de MAX_IDS_FILTRO."""
+    if vehiculo_ids is None:
+        return consulta().execute().data or []
+    ids = list(vehiculo_ids)
+    filas = []
+    for i in range(0, len(ids), MAX_IDS_FILTRO):
+        filas.extend(consulta().in_('vehiculo_id', ids[i:i + MAX_IDS_FILTRO]).execute().data or [])
+    return filas
+
+
+def recalcular_resumenes(supabase, vehiculo_ids=None, guardar: bool = True) -> dict:
+    """Recalcula desde órdenes y mantenimientos (2 consultas) y guarda el resultado."""
+    ids = set(vehiculo_ids) if vehiculo_ids is not None else None
+    if ids is not None and not ids:
+        return {}
+
+    ordenes = _leer_por_ids(lambda: supabase.table('flota_ordenes').select(
+        'vehiculo_id, kilometraje_inicio, kilometraje_fin, estado'
+    ), ids)
+    mantenimientos = _leer_por_ids(lambda: supabase.table('flota_mantenimientos').select(
+        'vehiculo_id, estado, km_realizacion, km_programado, fecha_realizacion'
+    ).is_('deleted_at', None), ids)
+
+    resumenes = calcular_resumenes(ordenes, mantenimientos)
+    if ids is not None:
+        resumenes = {vid: resumenes.get(vid) or resumen_vacio(vid) for vid in ids}
+
+    if guardar and resumenes:
+        _guardar(supabase, list(resumenes.values()))
+    return resumenes
+
+
+def _guardar(supabase, resumenes: list) -> None:
+    global _tabla_no_disponible_hasta
+    if time.monotonic() < _tabla_no_disponible_hasta:
+        return
+    ahora = datetime.now(timezone.utc).isoformat()
+    filas = [{**r, 'actualizado_en': ahora} for r in resumenes]
+    try:
+        supabase.table(TABLA_RESUMEN).upsert(filas, on_conflict='vehiculo_id', returning='minimal').execute()
+    except Exception as e:
+        # Solo una tabla inexistente suspende el uso; un timeout o 5xx afecta a este guardado
+        if es_tabla_inexistente(e):
+            _tabla_no_disponible_hasta = time.monotonic() + REINTENTO_TABLA_SEG
+        current_app.logger.warning(f"No se pudo guardar {TABLA_RESUMEN}: {e}")
+
+
+def obtener_resumenes(supabase, vehiculo_ids) -> dict:
+    """Lee los resúmenes materializados; los faltantes se calculan y guardan en el momento."""
+    global _tabla_no_disponible_hasta
+    ids = [vid for vid in vehiculo_ids if vid]
+    if not ids:
+        return {}
+
+    resumenes = {}
+    if time.monotonic() >= _tabla_no_disponible_hasta:
+        try:
+            filas = _leer_por_ids(lambda: supabase.table(TABLA_RESUMEN).select('*'), ids)
+            resumenes = {r['vehiculo_id']: r for r in filas}
+        except Exception as e:
+            if es_tabla_inexistente(e):
+                _tabla_no_disponible_hasta = time.monotonic() + REINTENTO_TABLA_SEG
+            current_app.logger.warning(f"{TABLA_RESUMEN} no disponible, calculando en línea: {e}")
+
+    faltantes = [vid for vid in ids if vid not in resumenes]
+    if faltantes:
+        resumenes.update(recalcular_resumenes(supabase, faltantes))
+    return resumenes
+
+
+def refrescar_vehiculos(*vehiculo_ids) -> None:
+    """Hook para rutas de escritura: refresca el resumen de los vehículos afectados.
+
+    Best-effort: un fallo aquí nunca debe romper la escritura que lo disparó.
+    """
+    ids = {vid for vid in vehiculo_ids if vid}
+    supabase = current_app.config.get('SUPABASE')
+    if not ids or not supabase:
+        return
+    try:
+        recalcular_resumenes(supabase, ids)
+    except Exception as e:
+        current_app.logger.warning(f"No se pudo refrescar resumen de vehículos {sorted(ids)}: {e}")
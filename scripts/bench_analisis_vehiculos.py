@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Benchmark de reportes._construir_analisis con datos sintéticos.
+
+Escala vehículos y cargas de combustible juntos (cargas = 100 x vehículos) y
+mide el tiempo por fila. Con el índice por vehículo el costo por fila debe
+mantenerse constante; el filtro por vehículo anterior crecía con N².
+
+Uso: python scripts/bench_analisis_vehiculos.py [--max-vehiculos 3000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.modules.reportes import _construir_analisis  # noqa: E402
+
+CARGAS_POR_VEHICULO = 100
+DOCS_POR_VEHICULO = 4
+
+
+def generar(n_vehiculos: int, seed: int = 7):
+    rnd = random.Random(seed)
+    ahora = datetime.now()
+    vehiculos = [{
+        'id': i, 'placa': f'AB{i:04d}', 'marca': 'M', 'modelo': 'X', 'ano': 2020, 'tipo': 'CAMION',
+        'fecha_vencimiento_gases': (ahora + timedelta(days=rnd.randint(-30, 200))).strftime('%Y-%m-%d'),
+        'tipo_combustible': rnd.choice(['DIESEL', 'GASOLINA']),
+    } for i in range(1, n_vehiculos + 1)]
+    cargas = [{
+        'vehiculo_id': rnd.randint(1, n_vehiculos),
+        'kilometraje': rnd.randint(1000, 300000),
+        'litros_cargados': round(rnd.uniform(20, 120), 1),
+        'costo_total': rnd.randint(20000, 150000),
+        'fecha_carga': (ahora - timedelta(days=rnd.randint(0, 365))).isoformat(),
+    } for _ in range(n_vehiculos * CARGAS_POR_VEHICULO)]
+    documentos = [{
+        'vehiculo_id': rnd.randint(1, n_vehiculos),
+        'tipo_documento': rnd.choice(['SOAP', 'PERMISO_CIRCULACION', 'REVISION_TECNICA', 'SEGURO_AUTOMOTRIZ']),
+        'fecha_vencimiento': (ahora + timedelta(days=rnd.randint(-60, 365))).date().isoformat(),
+    } for _ in range(n_vehiculos * DOCS_POR_VEHICULO)]
+    mantenimientos = [{
+        'vehiculo_id': rnd.randint(1, n_vehiculos), 'costo': rnd.randint(0, 500000),
+        'descripcion': 'Cambio de aceite', 'tipo_mantenimiento': 'PREVENTIVO', 'estado': 'PROGRAMADO',
+    } for _ in range(n_vehiculos)]
+    resumenes = {v['id']: {'km_actual': rnd.randint(1000, 300000), 'km_ultima_mant': 0, 'total_viajes': 3} for v in vehiculos}
+    return vehiculos, cargas, documentos, mantenimientos, resumenes
+
+
+def medir(args, repeticiones: int = 3) -> float:
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        _construir_analisis(*args)
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-vehiculos', type=int, default=3000)
+    parser.add_argument('--tolerancia', type=float, default=3.0,
+                        help='razón máxima aceptada entre el costo por fila mayor y menor')
+    opts = parser.parse_args()
+
+    tamanos = []
+    n = 100
+    while n <= opts.max_vehiculos:
+        tamanos.append(n)
+        n *= 2
+
+    print(f"{'vehiculos':>10} {'filas':>10} {'seg':>9} {'us/fila':>9}")
+    por_fila = []
+    for n in tamanos:
+        args = generar(n)
+        filas = sum(len(x) for x in args[:4])
+        seg = medir(args)
+        por_fila.append(seg / filas * 1e6)
+        print(f"{n:>10} {filas:>10} {seg:>9.4f} {por_fila[-1]:>9.3f}")
+
+    razon = max(por_fila) / min(por_fila)
+    print(f"\nrazón costo/fila (max/min): {razon:.2f}")
+    if razon > opts.tolerancia:
+        print('FALLO: el costo por fila crece con el tamaño (escalamiento no lineal)')
+        return 1
+    print('OK: escalamiento lineal')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Verifica los conteos de la ingesta GPS contra un PostgREST simulado.
+
+El upsert de gps_ingesta._insertar_bloque pasa por postgrest-py real; solo el
+transporte HTTP se reemplaza por un httpx.MockTransport que imita a PostgREST
+con `Prefer: resolution=ignore-duplicates` (solo devuelve las filas nuevas).
+Comprueba que un lote nuevo cuente sus puntos como aceptados, que reenviarlo
+los cuente como duplicados y que un lote mixto distinga ambos y resuma solo
+las filas nuevas.
+
+Uso: python scripts/verificar_ingesta_gps.py
+"""
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from flask import Flask
+from postgrest import SyncPostgrestClient
+from postgrest.utils import SyncClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.utils.gps_ingesta import ingerir_puntos, GPS_INGESTA_BLOQUE  # noqa: E402
+
+URL_BASE = 'http://postgrest.local'
+
+
+def postgrest_simulado():
+    """Cliente postgrest-py cuyo transporte guarda puntos por (orden_id, timestamp)."""
+    guardados = set()
+
+    def responder(request: httpx.Request) -> httpx.Response:
+        if request.method != 'POST' or not request.url.path.endswith('/flota_orden_rutas'):
+            return httpx.Response(404, json={'message': 'no simulado'})
+        prefer = request.headers.get('prefer', '')
+        nuevas = []
+        for fila in json.loads(request.content):
+            clave = (fila['orden_id'], fila['timestamp'])
+            if clave in guardados and 'resolution=ignore-duplicates' in prefer:
+                continue
+            guardados.add(clave)
+            nuevas.append(fila)
+        if 'return=minimal' in prefer:
+            return httpx.Response(201, content=b'')
+        return httpx.Response(201, json=nuevas)
+
+    cliente = SyncPostgrestClient(URL_BASE)
+    cliente.session = SyncClient(base_url=URL_BASE, headers=dict(cliente.session.headers),
+                                 transport=httpx.MockTransport(responder))
+    return cliente
+
+
+def puntos(desde: datetime, n: int) -> list:
+    return [{
+        'latitude': -33.45 + i * 1e-4,
+        'longitude': -70.66 + i * 1e-4,
+        'timestamp': (desde + timedelta(seconds=5 * i)).isoformat(),
+        'speed': 30,
+    } for i in range(n)]
+
+
+def verificar(nombre: str, resultado: dict, aceptados: int, duplicados: int) -> bool:
+    ok = resultado['aceptados'] == aceptados and resultado['duplicados'] == duplicados
+    print(f"{'OK ' if ok else 'ERR'} {nombre}: aceptados={resultado['aceptados']} "
+          f"(esperado {aceptados}), duplicados={resultado['duplicados']} (esperado {duplicados})")
+    return ok
+
+
+def main() -> int:
+    app = Flask(__name__)
+    supabase = postgrest_simulado()
+    inicio = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    n = GPS_INGESTA_BLOQUE + 50
+    lote = puntos(inicio, n)
+    ok = True
+    with app.app_context():
+        primero = ingerir_puntos(supabase, 1, lote)
+        ok &= verificar('lote nuevo', primero, n, 0)
+        ok &= primero['resumen'] is not None and primero['resumen']['total_puntos'] == n
+        ok &= verificar('reenvío', ingerir_puntos(supabase, 1, lote), 0, n)
+        mixto = lote[-10:] + puntos(inicio + timedelta(days=1), 20)
+        resultado = ingerir_puntos(supabase, 1, mixto)
+        ok &= verificar('lote mixto', resultado, 20, 10)
+        # El resumen cubre solo las filas nuevas: es el delta para el resumen de la orden
+        ok &= resultado['resumen']['total_puntos'] == 20
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
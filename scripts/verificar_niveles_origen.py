@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Verifica que niveles y métricas de ruta se guarden en bases sin las migraciones 009/010.
+
+Usa un cliente simulado cuyo primer upsert de cada tabla falla como PostgREST
+cuando falta la columna fin_timestamp_origen (PGRST204). Comprueba que
+construir_niveles reintente cada upsert sin esa clave y que, con la columna
+presente, la envíe en un solo intento.
+
+Uso: python scripts/verificar_niveles_origen.py
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.utils import rutas  # noqa: E402
+
+ERROR_COLUMNA = "{'code': 'PGRST204', 'message': \"Could not find the 'fin_timestamp_origen' column of '%s' in the schema cache\"}"
+
+
+class _Consulta:
+    def __init__(self, cliente, tabla):
+        self.cliente, self.tabla, self.accion = cliente, tabla, None
+
+    def __getattr__(self, nombre):
+        # select/eq/order/range/...: encadenables sin efecto
+        return lambda *args, **kwargs: self
+
+    def upsert(self, filas, **kwargs):
+        self.accion = ('upsert', filas if isinstance(filas, list) else [filas])
+        return self
+
+    def execute(self):
+        class Respuesta:
+            data = []
+        if self.accion is None:
+            # Lectura de puntos crudos: una sola página
+            Respuesta.data = self.cliente.puntos if self.tabla == 'flota_orden_rutas' else []
+            return Respuesta
+        filas = self.accion[1]
+        self.cliente.upserts.append((self.tabla, filas))
+        if self.cliente.sin_columna and any('fin_timestamp_origen' in f for f in filas):
+            raise Exception(ERROR_COLUMNA % self.tabla)
+        return Respuesta
+
+
+class ClienteSimulado:
+    def __init__(self, sin_columna: bool):
+        self.sin_columna = sin_columna
+        self.upserts = []
+        inicio = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+        self.puntos = [{
+            'latitud': -33.45 + i * 1e-3, 'longitud': -70.66 + i * 1e-3,
+            'timestamp': (inicio + timedelta(seconds=10 * i)).isoformat(), 'velocidad': 40,
+        } for i in range(300)]
+
+    def table(self, tabla):
+        return _Consulta(self, tabla)
+
+
+def verificar(sin_columna: bool) -> bool:
+    cliente = ClienteSimulado(sin_columna)
+    with Flask(__name__).app_context():
+        rutas.construir_niveles(cliente, 1)
+    ok = True
+    for tabla in (rutas.TABLA_METRICAS_RUTA, rutas.TABLA_NIVELES_RUTA):
+        envios = [filas for t, filas in cliente.upserts if t == tabla]
+        con_clave = [all('fin_timestamp_origen' in f for f in filas) for filas in envios]
+        esperado = [True, False] if sin_columna else [True]
+        estado = con_clave == esperado and all(envios)
+        ok &= estado
+        print(f"{'OK ' if estado else 'ERR'} {'sin' if sin_columna else 'con'} columna, {tabla}: "
+              f"upserts con fin_timestamp_origen={con_clave} (esperado {esperado})")
+    return ok
+
+
+def main() -> int:
+    ok = verificar(sin_columna=False)
+    ok &= verificar(sin_columna=True)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
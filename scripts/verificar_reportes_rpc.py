@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""Compara las agregaciones SQL de reportes (migración 002) con su respaldo en Python.
+
+Ejecuta cada endpoint dos veces contra la misma base: con la función SQL
+(llamar_rpc) y con la función marcada como no disponible, que fuerza el
+cálculo en Python. Reporta las diferencias en totales, categorías y
+vehículos.
+
+Dos modos:
+- Con --database-url (o DATABASE_URL) apunta a un Postgres desechable: dentro
+  de una transacción crea tablas mínimas, aplica 002_reportes_rpc.sql, carga
+  un fixture con costos NULL, km NULL, filas con deleted_at, detalles sin
+  concepto o categoría y fechas justo en los bordes de cada rango, y al final
+  hace rollback. Los endpoints leen las tablas con un cliente mínimo que
+  imita los filtros de PostgREST usados por el camino en Python. Requiere
+  psycopg (v3) y una base sin esas tablas.
+- Sin DATABASE_URL usa SUPABASE_URL y SUPABASE_KEY (como la app) con la
+  migración 002 aplicada y compara sobre los datos reales; no escribe nada.
+
+Uso: python scripts/verificar_reportes_rpc.py [--database-url postgresql://...]
+                                              [--fecha-inicio 2024-01-01] [--fecha-fin 2024-12-31]
+"""
+import argparse
+import math
+import os
+import sys
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.app import app  # noqa: E402
+from backend.modules.reportes import get_costo_mantenimiento  # noqa: E402
+from backend.modules.reportes_mant import get_dashboard_mantenimiento  # noqa: E402
+from backend.utils import rpc  # noqa: E402
+
+# Diferencia tolerada en montos (redondeo de numeric vs float)
+TOLERANCIA = 0.01
+MIGRACION = os.path.join(os.path.dirname(__file__), '..', 'backend', 'migrations', '002_reportes_rpc.sql')
+
+# Tablas mínimas que leen 002 y los endpoints (el esquema real tiene más columnas)
+ESQUEMA_PG = """
+create table public.flota_vehiculos (id bigint primary key, placa text, marca text, modelo text, km_actual numeric);
+create table public.categorias_mantencion (id bigint primary key, nombre text);
+create table public.conceptos_gasto (id bigint primary key, nombre text, categoria_id bigint);
+create table public.flota_mantenimientos (id bigint primary key, vehiculo_id bigint, fecha_programada date,
+                                          costo numeric, km numeric, estado text, deleted_at timestamptz);
+create table public.mantenimiento_detalles (id bigint primary key, mantenimiento_id bigint, concepto_id bigint, costo numeric);
+"""
+
+
+def _ejecutar(vista, path: str, sql: bool, funcion: str):
+    """Respuesta JSON de `vista` (sin el decorador de auth), con o sin la función SQL."""
+    rpc._no_disponibles.pop(funcion, None)
+    if not sql:
+        rpc._no_disponibles[funcion] = math.inf
+    try:
+        with app.test_request_context(path):
+            respuesta = vista.__wrapped__()
+    finally:
+        rpc._no_disponibles.pop(funcion, None)
+    respuesta = respuesta[0] if isinstance(respuesta, tuple) else respuesta
+    return respuesta.get_json()
+
+
+def _igual(a, b) -> bool:
+    return abs(float(a or 0) - float(b or 0)) <= TOLERANCIA
+
+
+def _comparar_serie(nombre: str, sql: list, python: list, solo_top: int | None = None) -> list:
+    a = {i['name']: i['value'] for i in sql}
+    b = {i['name']: i['value'] for i in python}
+    if solo_top is not None:
+        # En el top N un empate en el último lugar puede elegir otro nombre: se comparan los valores
+        valores_a = sorted((float(v) for v in a.values()), reverse=True)[:solo_top]
+        valores_b = sorted((float(v) for v in b.values()), reverse=True)[:solo_top]
+        if len(valores_a) != len(valores_b) or not all(_igual(x, y) for x, y in zip(valores_a, valores_b)):
+            return [f"{nombre}: valores del top {solo_top} distintos: sql={valores_a} python={valores_b}"]
+        a = {k: v for k, v in a.items() if k in b}
+        b = {k: v for k, v in b.items() if k in a}
+    diferencias = []
+    for clave in sorted(set(a) | set(b)):
+        if not _igual(a.get(clave), b.get(clave)):
+            diferencias.append(f"{nombre}[{clave}]: sql={a.get(clave)} python={b.get(clave)}")
+    return diferencias
+
+
+def verificar_costo_mensual() -> list:
+    funcion = 'flota_costo_mantenimiento'
+    sql = _ejecutar(get_costo_mantenimiento, '/api/reportes/costo_mantenimiento_mensual', True, funcion)
+    python = _ejecutar(get_costo_mantenimiento, '/api/reportes/costo_mantenimiento_mensual', False, funcion)
+    a, b = sql['data']['costo_total_clp'], python['data']['costo_total_clp']
+    print(f"{funcion}: sql={a} python={b}")
+    return [] if _igual(a, b) else [f"{funcion}: sql={a} python={b}"]
+
+
+def verificar_dashboard(fecha_ini: str, fecha_fin: str) -> list:
+    funcion = 'flota_dashboard_mant_periodo'
+    path = f'/api/reportes-mant/dashboard?fecha_inicio={fecha_ini}&fecha_fin={fecha_fin}'
+    sql = _ejecutar(get_dashboard_mantenimiento, path, True, funcion)
+    python = _ejecutar(get_dashboard_mantenimiento, path, False, funcion)
+    diferencias = []
+    for kpi in ('total_gasto_periodo', 'total_items_periodo', 'total_pendiente', 'cantidad_activos'):
+        a, b = sql['kpis'][kpi], python['kpis'][kpi]
+        print(f"{funcion}.{kpi}: sql={a} python={b}")
+        if not _igual(a, b):
+            diferencias.append(f"{kpi}: sql={a} python={b}")
+    diferencias += _comparar_serie('grafica_categorias', sql['grafica_categorias'], python['grafica_categorias'])
+    diferencias += _comparar_serie('grafica_vehiculos', sql['grafica_vehiculos'], python['grafica_vehiculos'], solo_top=10)
+    return diferencias
+
+
+def _a_json(valor):
+    """Valores de psycopg como los entrega PostgREST en JSON."""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, dict):
+        return {k: _a_json(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_a_json(v) for v in valor]
+    return valor
+
+
+class _Respuesta:
+    def __init__(self, data):
+        self.data = data
+
+
+class _ConsultaPg:
+    """Subconjunto de la API de postgrest-py que usan los dos endpoints, evaluado en memoria."""
+
+    def __init__(self, cliente, tabla: str):
+        self.cliente, self.tabla = cliente, tabla
+        self.filtros, self.columnas, self.orden = [], '*', None
+
+    def select(self, columnas='*'):
+        self.columnas = columnas
+        return self
+
+    def is_(self, columna, valor):
+        self.filtros.append(lambda f: f.get(columna) is None)
+        return self
+
+    def gte(self, columna, valor):
+        self.filtros.append(lambda f: f.get(columna) is not None and f[columna] >= valor)
+        return self
+
+    def lte(self, columna, valor):
+        self.filtros.append(lambda f: f.get(columna) is not None and f[columna] <= valor)
+        return self
+
+    def in_(self, columna, valores):
+        valores = set(valores)
+        self.filtros.append(lambda f: f.get(columna) in valores)
+        return self
+
+    def or_(self, expresion):
+        # Solo la forma del dashboard: "estado.is.null,estado.not.in.(A,B)"
+        nulo, excluidos = expresion.split(',', 1)
+        columna = nulo.split('.', 1)[0]
+        cerrados = set(excluidos.split('.not.in.(', 1)[1].rstrip(')').split(','))
+        self.filtros.append(lambda f: f.get(columna) is None or f[columna] not in cerrados)
+        return self
+
+    def order(self, columna, desc=False):
+        self.orden = (columna, desc)
+        return self
+
+    def execute(self):
+        filas = [f for f in self.cliente.filas(self.tabla) if all(filtro(f) for filtro in self.filtros)]
+        if self.orden:
+            columna, desc = self.orden
+            filas.sort(key=lambda f: (f.get(columna) is not None, f.get(columna) or ''), reverse=desc)
+        if self.tabla == 'mantenimiento_detalles' and 'concepto:' in self.columnas:
+            conceptos = {c['id']: c for c in self.cliente.filas('conceptos_gasto')}
+            categorias = {c['id']: c for c in self.cliente.filas('categorias_mantencion')}
+            for f in filas:
+                concepto = conceptos.get(f.get('concepto_id'))
+                categoria = categorias.get(concepto.get('categoria_id')) if concepto else None
+                f['concepto'] = None if concepto is None else {
+                    'nombre': concepto['nombre'],
+                    'categoria': None if categoria is None else {'nombre': categoria['nombre']},
+                }
+        return _Respuesta(filas)
+
+
+class ClientePg:
+    """Cliente con .table()/.rpc() sobre una conexión psycopg (solo lo que usan los reportes)."""
+
+    def __init__(self, conexion):
+        self.conexion = conexion
+
+    def filas(self, tabla: str) -> list:
+        with self.conexion.cursor() as cur:
+            cur.execute(f'select * from public.{tabla} order by id')
+            columnas = [c.name for c in cur.description]
+            return [{c: _a_json(v) for c, v in zip(columnas, fila)} for fila in cur.fetchall()]
+
+    def table(self, tabla: str):
+        return _ConsultaPg(self, tabla)
+
+    def rpc(self, nombre: str, params: dict):
+        argumentos = ', '.join(f'{k} => %({k})s::date' for k in params)
+        with self.conexion.cursor() as cur:
+            cur.execute(f'select public.{nombre}({argumentos})', params)
+            return _Respuesta(_a_json(cur.fetchone()[0]))
+
+
+def _cargar_fixture(cur, hoy: date, fecha_ini: date, fecha_fin: date) -> None:
+    desde = hoy - timedelta(days=30)  # límite de costo_mantenimiento_mensual (inclusive)
+    cur.execute("insert into public.flota_vehiculos values (1, 'AA1111', 'Toyota', 'Hilux', null), "
+                "(2, 'BB2222', 'Nissan', 'Navara', 120000)")
+    cur.execute("insert into public.categorias_mantencion values (1, 'Motor'), (2, null)")
+    cur.execute("insert into public.conceptos_gasto values (1, 'Aceite', 1), (2, 'Varios', null), (3, 'Filtro', 2)")
+    mantenimientos = [
+        # id, vehiculo, fecha_programada, costo, km, estado, deleted_at
+        (1, 1, desde, 100, None, 'FINALIZADO', None),               # borde inferior del mes
+        (2, 1, desde - timedelta(days=1), 50, 1000, 'FINALIZADO', None),
+        (3, 2, hoy, None, None, 'PENDIENTE', None),                 # costo NULL
+        (4, 2, hoy - timedelta(days=5), 70, None, 'PENDIENTE', hoy),  # borrado
+        (5, None, fecha_fin, 30, None, None, None),                 # sin vehículo ni detalles, borde final
+        (6, 1, fecha_ini, 999, 5000, 'Finalizado', None),           # borde inicial; los detalles mandan
+        (7, 2, fecha_fin + timedelta(days=1), 20, None, 'CANCELADO', None),
+        (8, 2, fecha_ini - timedelta(days=1), 15, None, 'PENDIENTE', None),
+        (9, 2, fecha_fin - timedelta(days=2), None, None, 'EN_PROCESO', None),  # costo NULL sin detalles
+        (10, 1, fecha_fin - timedelta(days=1), 80, None, 'PENDIENTE', hoy),     # borrado con detalles
+    ]
+    cur.executemany('insert into public.flota_mantenimientos values (%s, %s, %s, %s, %s, %s, %s)', mantenimientos)
+    detalles = [
+        (1, 6, 1, 40), (2, 6, 2, None), (3, 6, None, 10), (4, 6, 3, 5),
+        (5, 9, 1, 12), (6, 10, 1, 80), (7, 7, 1, 20),
+    ]
+    cur.executemany('insert into public.mantenimiento_detalles values (%s, %s, %s, %s)', detalles)
+
+
+def verificar_postgres(url: str) -> list:
+    """Aplica 002 y el fixture en una transacción, compara ambos caminos y hace rollback."""
+    try:
+        import psycopg
+    except ImportError:
+        print('ERROR: el modo --database-url requiere psycopg (pip install "psycopg[binary]")')
+        return ['psycopg no instalado']
+    hoy = date.today()
+    fecha_ini, fecha_fin = hoy - timedelta(days=60), hoy - timedelta(days=10)
+    with psycopg.connect(url) as conexion:
+        try:
+            with conexion.cursor() as cur:
+                cur.execute("select to_regclass('public.flota_mantenimientos')")
+                if cur.fetchone()[0] is not None:
+                    print('ERROR: la base ya tiene flota_mantenimientos; usar una base desechable')
+                    return ['base no desechable']
+                cur.execute(ESQUEMA_PG)
+                with open(MIGRACION, encoding='utf-8') as f:
+                    cur.execute(f.read())
+                _cargar_fixture(cur, hoy, fecha_ini, fecha_fin)
+            anterior = app.config.get('SUPABASE')
+            app.config['SUPABASE'] = ClientePg(conexion)
+            try:
+                return verificar_costo_mensual() + verificar_dashboard(fecha_ini.isoformat(), fecha_fin.isoformat())
+            finally:
+                app.config['SUPABASE'] = anterior
+        finally:
+            conexion.rollback()
+
+
+def main() -> int:
+    hoy = date.today()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                        help='Postgres desechable para aplicar 002 con el fixture (default: DATABASE_URL)')
+    parser.add_argument('--fecha-inicio', default=(hoy - timedelta(days=365)).isoformat())
+    parser.add_argument('--fecha-fin', default=hoy.isoformat())
+    args = parser.parse_args()
+
+    if args.database_url:
+        diferencias = verificar_postgres(args.database_url)
+    elif not app.config.get('SUPABASE'):
+        print('ERROR: faltan DATABASE_URL o las variables de entorno SUPABASE_URL/SUPABASE_KEY')
+        return 2
+    else:
+        diferencias = verificar_costo_mensual() + verificar_dashboard(args.fecha_inicio, args.fecha_fin)
+    if diferencias:
+        print(f"\n{len(diferencias)} diferencia(s) entre SQL y Python:")
+        for d in diferencias:
+            print(f"  - {d}")
+        return 1
+    print('\nSQL y Python coinciden')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())